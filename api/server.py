@@ -2,16 +2,23 @@
 import logging
 from aiohttp import web
 import json
-from database import db
+from typing import Optional
+from database import ChargeResult, db
 from services.gemini_service import gemini_service
-from services.tarot_deck import tarot_deck
-from config import ADMIN_ID
+from services.tarot_deck import SPREADS, tarot_deck
+from services.tarot_interpretations import tarot_interpretations
+from services.compatibility_matrix import compatibility_matrix
+from services.fulfilment_queue import fulfilment_queue
+from keyboards import ZODIAC_SIGNS
+from config import ADMIN_ID, FLOOD_CONTROL_ENABLED, WEB_SERVER_HOST, WEB_SERVER_PORT
+from utils.flood_control import api_flood_middleware
 
 logger = logging.getLogger(__name__)
 
 class MiniAppAPI:
     def __init__(self):
         self.app = web.Application()
+        self.runner = None
         self.setup_routes()
         self.setup_middlewares()
 
@@ -27,6 +34,13 @@ class MiniAppAPI:
         self.app.router.add_route('POST', '/api/request_history', self.handle_request_history)
         self.app.router.add_route('POST', '/api/check_payment', self.handle_check_payment)
         self.app.router.add_route('POST', '/api/confirm_payment', self.handle_confirm_payment)
+        self.app.router.add_route('POST', '/api/fulfilment_status', self.handle_fulfilment_status)
+        
+        # Потоковая выдача текста (Server-Sent Events)
+        self.app.router.add_route('POST', '/api/daily_horoscope/stream', self.handle_daily_horoscope_stream)
+        self.app.router.add_route('POST', '/api/weekly_horoscope/stream', self.handle_weekly_horoscope_stream)
+        self.app.router.add_route('POST', '/api/tarot/stream', self.handle_tarot_stream)
+        self.app.router.add_route('POST', '/api/natal_chart/stream', self.handle_natal_chart_stream)
         
         # OPTIONS для CORS
         self.app.router.add_route('OPTIONS', '/api/user/{user_id}', self.handle_options)
@@ -38,11 +52,57 @@ class MiniAppAPI:
         self.app.router.add_route('OPTIONS', '/api/request_history', self.handle_options)
         self.app.router.add_route('OPTIONS', '/api/check_payment', self.handle_options)
         self.app.router.add_route('OPTIONS', '/api/confirm_payment', self.handle_options)
+        self.app.router.add_route('OPTIONS', '/api/fulfilment_status', self.handle_options)
+        self.app.router.add_route('OPTIONS', '/api/daily_horoscope/stream', self.handle_options)
+        self.app.router.add_route('OPTIONS', '/api/weekly_horoscope/stream', self.handle_options)
+        self.app.router.add_route('OPTIONS', '/api/tarot/stream', self.handle_options)
+        self.app.router.add_route('OPTIONS', '/api/natal_chart/stream', self.handle_options)
 
     def setup_middlewares(self):
         """Настройка middleware для CORS"""
         @web.middleware
-    async def cors_middleware(request, handler):
+        async def cors_middleware(request, handler):
+            if request.method == 'OPTIONS':
+                response = web.Response(status=200)
+            else:
+                response = await handler(request)
+            
+            # Потоковые ответы получают заголовки до отправки первых данных
+            if not response.prepared:
+                response.headers.update(self.cors_headers(request))
+            
+            return response
+        
+        self.app.middlewares.append(cors_middleware)
+        
+        # Ограничение частоты запросов: после CORS, чтобы ответ 429 был виден MiniApp
+        if FLOOD_CONTROL_ENABLED:
+            self.app.middlewares.append(api_flood_middleware(self.route_limits()))
+
+    def route_limits(self) -> dict:
+        """Лимит на пользователя для маршрутов с генерацией и списаниями"""
+        heavy_routes = [
+            '/api/daily_horoscope',
+            '/api/weekly_horoscope',
+            '/api/compatibility',
+            '/api/tarot',
+            '/api/natal_chart',
+            '/api/confirm_payment',
+            '/api/daily_horoscope/stream',
+            '/api/weekly_horoscope/stream',
+            '/api/tarot/stream',
+            '/api/natal_chart/stream'
+        ]
+        limits = {route: "heavy" for route in heavy_routes}
+        limits.update({
+            '/api/request_history': "default",
+            '/api/check_payment': "default",
+            '/api/fulfilment_status': "default"
+        })
+        return limits
+
+    def cors_headers(self, request) -> dict:
+        """Заголовки CORS для запроса"""
         # Разрешаем конкретные домены
         allowed_origins = [
             'https://your-app-name.netlify.app',
@@ -51,22 +111,12 @@ class MiniAppAPI:
         ]
         
         origin = request.headers.get('Origin', '')
-        if origin in allowed_origins:
-            response.headers['Access-Control-Allow-Origin'] = origin
-        else:
-            response.headers['Access-Control-Allow-Origin'] = '*'
-        
-        response.headers['Access-Control-Allow-Methods'] = 'POST, GET, OPTIONS, PUT, DELETE'
-        response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, X-Requested-With, X-Telegram-Init-Data'
-        response.headers['Access-Control-Allow-Credentials'] = 'true'
-        
-        if request.method == 'OPTIONS':
-            return web.Response(status=200)
-        else:
-            response = await handler(request)
-            return response
-    
-    self.app.middlewares.append(cors_middleware)
+        return {
+            'Access-Control-Allow-Origin': origin if origin in allowed_origins else '*',
+            'Access-Control-Allow-Methods': 'POST, GET, OPTIONS, PUT, DELETE',
+            'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Requested-With, X-Telegram-Init-Data',
+            'Access-Control-Allow-Credentials': 'true'
+        }
 
     async def handle_options(self, request):
         """Обработчик OPTIONS запросов для CORS"""
@@ -77,12 +127,51 @@ class MiniAppAPI:
             'Access-Control-Allow-Credentials': 'true'
         })
 
+    def charge_failed_response(self, cost: int, charge: ChargeResult):
+        """Ответ при неудачном списании"""
+        if charge.error:
+            # Баланс неизвестен - нельзя отвечать, что средств не хватает
+            return web.json_response({
+                "success": False,
+                "error": "Оплата временно недоступна, попробуйте позже."
+            }, status=503)
+        if charge.conflict:
+            return web.json_response({
+                "success": False,
+                "error": "Ключ идемпотентности уже использован для другой операции."
+            }, status=409)
+        return self.payment_required_response(cost, charge.balance)
+
+    def duplicate_response(self, charge: ChargeResult):
+        """Повтор запроса с тем же ключом: сохраненный ответ без повторной генерации"""
+        if charge.result is None:
+            return web.json_response({
+                "success": False,
+                "error": "Запрос с этим ключом еще выполняется. Повторите позже.",
+                "in_progress": True
+            }, status=409)
+        return web.json_response(json.loads(charge.result))
+
+    async def paid_response(self, user_id: int, charge: ChargeResult, payload: dict):
+        """Ответ об оказанной услуге; сохраняется по ключу списания для повторов"""
+        await db.save_charge_result(user_id, charge.key, json.dumps(payload, ensure_ascii=False))
+        return web.json_response(payload)
+
+    def payment_required_response(self, cost: int, balance: int):
+        """Ответ при недостатке средств"""
+        return web.json_response({
+            "success": False,
+            "error": f"Недостаточно средств. Нужно {cost} Stars, у вас {balance} Stars.",
+            "payment_required": True,
+            "cost": cost
+        }, status=402)
+
     async def handle_user(self, request):
         """Получение данных пользователя"""
         try:
             user_id = int(request.match_info['user_id'])
-            user = db.get_user(user_id)
-            user_balance = db.get_user_balance(user_id) if user else 100
+            user = await db.get_user_profile(user_id)
+            user_balance = user["balance"] if user else 100
             
             response_data = {
                 "success": True,
@@ -96,8 +185,8 @@ class MiniAppAPI:
             
             if user:
                 response_data["user"].update({
-                    "name": user[3] or "Пользователь",
-                    "zodiac": user[6] or "Не указан"
+                    "name": user["first_name"] or "Пользователь",
+                    "zodiac": user["zodiac_sign"] or "Не указан"
                 })
             
             return web.json_response(response_data)
@@ -123,7 +212,7 @@ class MiniAppAPI:
                 }, status=400)
             
             horoscope_text = await gemini_service.safe_generate_horoscope(zodiac_sign)
-            db.log_request(user_id, f"daily_horoscope_{zodiac_sign}")
+            await db.log_request(user_id, f"daily_horoscope_{zodiac_sign}")
             
             return web.json_response({
                 "success": True,
@@ -140,47 +229,42 @@ class MiniAppAPI:
 
     async def handle_weekly_horoscope(self, request):
         """Обработка недельного гороскопа"""
+        charge = None
         try:
             data = await request.json()
             zodiac_sign = data.get('zodiac_sign')
             user_id = data.get('user_id')
+            idempotency_key = data.get('idempotency_key')
             
-            if not zodiac_sign:
-                return web.json_response({
-                    "success": False,
-                    "error": "Не указан знак зодиака"
-                }, status=400)
+            # Данные проверяются до списания: отказ не должен стоить списания и возврата
+            error = self.validate_service_data('weekly_horoscope', data)
+            if error is not None:
+                return web.json_response({"success": False, "error": error}, status=400)
             
-            # Проверяем баланс пользователя
+            # Списываем средства одной транзакцией
             cost = 333
-            user_balance = db.get_user_balance(user_id)
+            service_name = f"weekly_horoscope_{zodiac_sign}"
+            charge = await db.charge(user_id, service_name, cost, idempotency_key)
             
-            if user_balance < cost:
-                return web.json_response({
-                    "success": False,
-                    "error": f"Недостаточно средств. Нужно {cost} Stars, у вас {user_balance} Stars.",
-                    "payment_required": True,
-                    "cost": cost
-                }, status=402)
+            if not charge.success:
+                return self.charge_failed_response(cost, charge)
+            if charge.duplicate:
+                return self.duplicate_response(charge)
             
-            # Списываем средства
-            if db.update_balance(user_id, -cost):
-                horoscope_text = await gemini_service.generate_weekly_horoscope(zodiac_sign)
-                db.log_request(user_id, f"weekly_horoscope_{zodiac_sign}", cost)
-                
-                return web.json_response({
-                    "success": True,
-                    "content": horoscope_text,
-                    "cost": cost
-                })
-            else:
-                return web.json_response({
-                    "success": False,
-                    "error": "Ошибка списания средств"
-                }, status=500)
+            horoscope_text = await gemini_service.generate_weekly_horoscope(zodiac_sign)
+            
+            return await self.paid_response(user_id, charge, {
+                "success": True,
+                "content": horoscope_text,
+                "cost": cost,
+                "new_balance": charge.balance
+            })
                 
         except Exception as e:
             logger.error(f"Error in handle_weekly_horoscope: {e}")
+            # Возвращаем средства, если услуга не была предоставлена
+            if charge is not None and charge.success and not charge.duplicate:
+                await db.refund(user_id, cost, service_name, charge.key)
             return web.json_response({
                 "success": False,
                 "error": str(e)
@@ -188,48 +272,43 @@ class MiniAppAPI:
 
     async def handle_compatibility(self, request):
         """Обработка совместимости"""
+        charge = None
         try:
             data = await request.json()
             sign1 = data.get('sign1')
             sign2 = data.get('sign2')
             user_id = data.get('user_id')
+            idempotency_key = data.get('idempotency_key')
             
-            if not sign1 or not sign2:
-                return web.json_response({
-                    "success": False,
-                    "error": "Не указаны знаки зодиака"
-                }, status=400)
+            # Данные проверяются до списания: отказ не должен стоить списания и возврата
+            error = self.validate_service_data('compatibility', data)
+            if error is not None:
+                return web.json_response({"success": False, "error": error}, status=400)
             
-            # Проверяем баланс пользователя
+            # Списываем средства одной транзакцией
             cost = 55
-            user_balance = db.get_user_balance(user_id)
+            service_name = f"compatibility_{sign1}_{sign2}"
+            charge = await db.charge(user_id, service_name, cost, idempotency_key)
             
-            if user_balance < cost:
-                return web.json_response({
-                    "success": False,
-                    "error": f"Недостаточно средств. Нужно {cost} Stars, у вас {user_balance} Stars.",
-                    "payment_required": True,
-                    "cost": cost
-                }, status=402)
+            if not charge.success:
+                return self.charge_failed_response(cost, charge)
+            if charge.duplicate:
+                return self.duplicate_response(charge)
             
-            # Списываем средства
-            if db.update_balance(user_id, -cost):
-                compatibility_text = await gemini_service.generate_compatibility(sign1, sign2)
-                db.log_request(user_id, f"compatibility_{sign1}_{sign2}", cost)
-                
-                return web.json_response({
-                    "success": True,
-                    "content": compatibility_text,
-                    "cost": cost
-                })
-            else:
-                return web.json_response({
-                    "success": False,
-                    "error": "Ошибка списания средств"
-                }, status=500)
+            compatibility_text = await compatibility_matrix.get(sign1, sign2)
+            
+            return await self.paid_response(user_id, charge, {
+                "success": True,
+                "content": compatibility_text,
+                "cost": cost,
+                "new_balance": charge.balance
+            })
                 
         except Exception as e:
             logger.error(f"Error in handle_compatibility: {e}")
+            # Возвращаем средства, если услуга не была предоставлена
+            if charge is not None and charge.success and not charge.duplicate:
+                await db.refund(user_id, cost, service_name, charge.key)
             return web.json_response({
                 "success": False,
                 "error": str(e)
@@ -237,10 +316,12 @@ class MiniAppAPI:
 
     async def handle_tarot(self, request):
         """Обработка расклада Таро"""
+        charge = None
         try:
             data = await request.json()
             spread_type = data.get('spread_type')
             user_id = data.get('user_id')
+            idempotency_key = data.get('idempotency_key')
             
             if not spread_type:
                 return web.json_response({
@@ -248,55 +329,46 @@ class MiniAppAPI:
                     "error": "Не указан тип расклада"
                 }, status=400)
             
-            # Проверяем баланс пользователя
-            cost = 888
-            user_balance = db.get_user_balance(user_id)
+            # Данные проверяются до списания: отказ не должен стоить списания и возврата
+            error = self.validate_service_data('tarot', data)
+            if error is not None:
+                return web.json_response({"success": False, "error": error}, status=400)
             
-            if user_balance < cost:
-                return web.json_response({
-                    "success": False,
-                    "error": f"Недостаточно средств. Нужно {cost} Stars, у вас {user_balance} Stars.",
-                    "payment_required": True,
-                    "cost": cost
-                }, status=402)
-            
-            # Списываем средства
-            if db.update_balance(user_id, -cost):
-                cards, positions = tarot_deck.create_spread(spread_type)
-                
-                spread_description = ""
-                for i, card in enumerate(cards):
-                    position_name = positions[i] if i < len(positions) else f"Позиция {i+1}"
-                    orientation = "прямое" if card["position"] == "upright" else "перевернутое"
-                    spread_description += f"{position_name}: {card['name']} ({orientation})\n"
-                
-                interpretation = await gemini_service.generate_tarot_reading(spread_type, spread_description)
-                
-                formatted_cards = []
-                for i, card in enumerate(cards):
-                    formatted_cards.append({
-                        "name": card["name"],
-                        "position": card["position"],
-                        "meaning": tarot_deck.get_card_meaning(card),
-                        "position_name": positions[i] if i < len(positions) else f"Позиция {i+1}"
-                    })
-                
-                db.log_request(user_id, f"tarot_{spread_type}", cost)
-                
-                return web.json_response({
-                    "success": True,
-                    "cards": formatted_cards,
-                    "interpretation": interpretation,
-                    "cost": cost
+            # Списываем средства одной транзакцией
+            cost = 888
+            service_name = f"tarot_{spread_type}"
+            charge = await db.charge(user_id, service_name, cost, idempotency_key)
+            
+            if not charge.success:
+                return self.charge_failed_response(cost, charge)
+            if charge.duplicate:
+                return self.duplicate_response(charge)
+            
+            cards, positions = tarot_deck.create_reading(spread_type, user_id, purchase=charge.key)
+            interpretation = await tarot_interpretations.interpret(spread_type, cards, positions)
+            
+            formatted_cards = []
+            for i, card in enumerate(cards):
+                formatted_cards.append({
+                    "name": card.name,
+                    "position": card.position,
+                    "meaning": tarot_deck.get_card_meaning(card),
+                    "position_name": positions[i] if i < len(positions) else f"Позиция {i+1}"
                 })
-            else:
-                return web.json_response({
-                    "success": False,
-                    "error": "Ошибка списания средств"
-                }, status=500)
+            
+            return await self.paid_response(user_id, charge, {
+                "success": True,
+                "cards": formatted_cards,
+                "interpretation": interpretation,
+                "cost": cost,
+                "new_balance": charge.balance
+            })
                 
         except Exception as e:
             logger.error(f"Error in handle_tarot: {e}")
+            # Возвращаем средства, если услуга не была предоставлена
+            if charge is not None and charge.success and not charge.duplicate:
+                await db.refund(user_id, cost, service_name, charge.key)
             return web.json_response({
                 "success": False,
                 "error": str(e)
@@ -304,53 +376,275 @@ class MiniAppAPI:
 
     async def handle_natal_chart(self, request):
         """Обработка натальной карты"""
+        charge = None
         try:
             data = await request.json()
             birth_data = data.get('birth_data', {})
             user_id = data.get('user_id')
+            idempotency_key = data.get('idempotency_key')
             
-            required_fields = ['birth_date', 'birth_time', 'birth_place']
-            for field in required_fields:
-                if not birth_data.get(field):
-                    return web.json_response({
-                        "success": False,
-                        "error": f"Не указано поле: {field}"
-                    }, status=400)
+            # Данные проверяются до списания: отказ не должен стоить списания и возврата
+            error = self.validate_service_data('natal_chart', data)
+            if error is not None:
+                return web.json_response({"success": False, "error": error}, status=400)
             
-            # Проверяем баланс пользователя
+            # Списываем средства одной транзакцией
             cost = 999
-            user_balance = db.get_user_balance(user_id)
+            service_name = "natal_chart"
+            charge = await db.charge(user_id, service_name, cost, idempotency_key)
             
-            if user_balance < cost:
-                return web.json_response({
-                    "success": False,
-                    "error": f"Недостаточно средств. Нужно {cost} Stars, у вас {user_balance} Stars.",
-                    "payment_required": True,
-                    "cost": cost
-                }, status=402)
+            if not charge.success:
+                return self.charge_failed_response(cost, charge)
+            if charge.duplicate:
+                return self.duplicate_response(charge)
             
-            # Списываем средства
-            if db.update_balance(user_id, -cost):
-                natal_chart_text = await gemini_service.generate_natal_chart_interpretation(birth_data)
-                db.log_request(user_id, "natal_chart", cost)
+            natal_chart_text = await gemini_service.generate_natal_chart_interpretation(birth_data)
+            
+            return await self.paid_response(user_id, charge, {
+                "success": True,
+                "content": natal_chart_text,
+                "cost": cost,
+                "new_balance": charge.balance
+            })
                 
+        except Exception as e:
+            logger.error(f"Error in handle_natal_chart: {e}")
+            # Возвращаем средства, если услуга не была предоставлена
+            if charge is not None and charge.success and not charge.duplicate:
+                await db.refund(user_id, cost, service_name, charge.key)
+            return web.json_response({
+                "success": False,
+                "error": str(e)
+            }, status=500)
+
+    async def send_event(self, response, event: str, data: dict):
+        """Отправка одного события SSE"""
+        payload = json.dumps(data, ensure_ascii=False)
+        await response.write(f"event: {event}\ndata: {payload}\n\n".encode('utf-8'))
+
+    async def stream_text(self, request, chunks, meta: dict, on_error=None, on_complete=None):
+        """
+        Отдача текста частями в формате Server-Sent Events:
+        meta (стоимость, баланс, карты) -> chunk... -> done или error.
+        on_complete получает весь текст до события done.
+        """
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
+        response.headers.update(self.cors_headers(request))
+        await response.prepare(request)
+        
+        try:
+            await self.send_event(response, "meta", meta)
+            parts = []
+            async for chunk in chunks:
+                parts.append(chunk)
+                await self.send_event(response, "chunk", {"text": chunk})
+            if on_complete is not None:
+                await on_complete("".join(parts))
+            await self.send_event(response, "done", {"success": True})
+        except ConnectionResetError:
+            # Клиент ушел - генерация останавливается вместе с потоком
+            logger.info("Клиент закрыл потоковое соединение")
+        except Exception as e:
+            logger.error(f"Error in stream_text: {e}")
+            if on_error is not None:
+                await on_error()
+            try:
+                await self.send_event(response, "error", {"success": False, "error": str(e)})
+            except ConnectionResetError:
+                pass
+        finally:
+            await chunks.aclose()
+        
+        return response
+
+    async def handle_daily_horoscope_stream(self, request):
+        """Потоковый ежедневный гороскоп"""
+        try:
+            data = await request.json()
+            zodiac_sign = data.get('zodiac_sign')
+            user_id = data.get('user_id')
+            
+            if not zodiac_sign:
                 return web.json_response({
-                    "success": True,
-                    "content": natal_chart_text,
-                    "cost": cost
-                })
-            else:
+                    "success": False,
+                    "error": "Не указан знак зодиака"
+                }, status=400)
+            
+            await db.log_request(user_id, f"daily_horoscope_{zodiac_sign}")
+            
+        except Exception as e:
+            logger.error(f"Error in handle_daily_horoscope_stream: {e}")
+            return web.json_response({
+                "success": False,
+                "error": str(e)
+            }, status=500)
+        
+        return await self.stream_text(request, gemini_service.stream_horoscope(zodiac_sign), {"cost": 0})
+
+    async def charge_for_stream(self, data: dict, cost: int, service_name: str):
+        """Списание перед потоковой выдачей: (ответ об ошибке или None, результат списания)"""
+        user_id = data.get('user_id')
+        charge = await db.charge(user_id, service_name, cost, data.get('idempotency_key'))
+        if not charge.success:
+            return self.charge_failed_response(cost, charge), charge
+        return None, charge
+
+    def remember_stream(self, data: dict, charge: ChargeResult, meta: dict, field: str):
+        """Сохранение ответа потока в том же виде, что у обычного обработчика"""
+        async def remember(text: str):
+            payload = {"success": True, **meta, field: text}
+            await db.save_charge_result(data.get('user_id'), charge.key, json.dumps(payload, ensure_ascii=False))
+        return remember
+
+    async def replay_stream(self, request, charge: ChargeResult, field: str):
+        """Повтор потокового запроса с тем же ключом: сохраненный текст одной частью"""
+        if charge.result is None:
+            return self.duplicate_response(charge)
+        meta = json.loads(charge.result)
+        meta.pop("success", None)
+        text = meta.pop(field, "")
+        
+        async def chunks():
+            yield text
+        return await self.stream_text(request, chunks(), meta)
+
+    def refund_for_stream(self, data: dict, cost: int, service_name: str, charge: ChargeResult):
+        """Возврат средств, если поток оборвался из-за ошибки генерации"""
+        async def refund():
+            await db.refund(data.get('user_id'), cost, service_name, charge.key)
+        return refund
+
+    async def handle_weekly_horoscope_stream(self, request):
+        """Потоковый недельный гороскоп"""
+        try:
+            data = await request.json()
+            zodiac_sign = data.get('zodiac_sign')
+            
+            # Данные проверяются до списания: отказ не должен стоить списания и возврата
+            error = self.validate_service_data('weekly_horoscope', data)
+            if error is not None:
+                return web.json_response({"success": False, "error": error}, status=400)
+            
+            cost = 333
+            service_name = f"weekly_horoscope_{zodiac_sign}"
+            error_response, charge = await self.charge_for_stream(data, cost, service_name)
+            if error_response is not None:
+                return error_response
+            
+        except Exception as e:
+            logger.error(f"Error in handle_weekly_horoscope_stream: {e}")
+            return web.json_response({
+                "success": False,
+                "error": str(e)
+            }, status=500)
+        
+        if charge.duplicate:
+            return await self.replay_stream(request, charge, "content")
+        
+        meta = {"cost": cost, "new_balance": charge.balance}
+        return await self.stream_text(
+            request,
+            gemini_service.stream_weekly_horoscope(zodiac_sign),
+            meta,
+            on_error=self.refund_for_stream(data, cost, service_name, charge),
+            on_complete=self.remember_stream(data, charge, meta, "content")
+        )
+
+    async def handle_tarot_stream(self, request):
+        """Потоковый расклад Таро: карты сразу, интерпретация частями"""
+        charge = None
+        try:
+            data = await request.json()
+            spread_type = data.get('spread_type')
+            
+            if not spread_type:
                 return web.json_response({
                     "success": False,
-                    "error": "Ошибка списания средств"
-                }, status=500)
-                
+                    "error": "Не указан тип расклада"
+                }, status=400)
+            
+            # Данные проверяются до списания: отказ не должен стоить списания и возврата
+            error = self.validate_service_data('tarot', data)
+            if error is not None:
+                return web.json_response({"success": False, "error": error}, status=400)
+            
+            cost = 888
+            service_name = f"tarot_{spread_type}"
+            error_response, charge = await self.charge_for_stream(data, cost, service_name)
+            if error_response is not None:
+                return error_response
+            if charge.duplicate:
+                return await self.replay_stream(request, charge, "interpretation")
+            
+            cards, positions = tarot_deck.create_reading(spread_type, data.get('user_id'), purchase=charge.key)
+            
+            formatted_cards = []
+            for i, card in enumerate(cards):
+                position_name = positions[i] if i < len(positions) else f"Позиция {i+1}"
+                formatted_cards.append({
+                    "name": card.name,
+                    "position": card.position,
+                    "meaning": tarot_deck.get_card_meaning(card),
+                    "position_name": position_name
+                })
+            
         except Exception as e:
-            logger.error(f"Error in handle_natal_chart: {e}")
+            logger.error(f"Error in handle_tarot_stream: {e}")
+            if charge is not None and charge.success and not charge.duplicate:
+                await self.refund_for_stream(data, cost, service_name, charge)()
             return web.json_response({
                 "success": False,
                 "error": str(e)
             }, status=500)
+        
+        meta = {"cost": cost, "new_balance": charge.balance, "cards": formatted_cards}
+        return await self.stream_text(
+            request,
+            tarot_interpretations.stream(spread_type, cards, positions),
+            meta,
+            on_error=self.refund_for_stream(data, cost, service_name, charge),
+            on_complete=self.remember_stream(data, charge, meta, "interpretation")
+        )
+
+    async def handle_natal_chart_stream(self, request):
+        """Потоковая натальная карта"""
+        try:
+            data = await request.json()
+            birth_data = data.get('birth_data', {})
+            
+            # Данные проверяются до списания: отказ не должен стоить списания и возврата
+            error = self.validate_service_data('natal_chart', data)
+            if error is not None:
+                return web.json_response({"success": False, "error": error}, status=400)
+            
+            cost = 999
+            service_name = "natal_chart"
+            error_response, charge = await self.charge_for_stream(data, cost, service_name)
+            if error_response is not None:
+                return error_response
+            
+        except Exception as e:
+            logger.error(f"Error in handle_natal_chart_stream: {e}")
+            return web.json_response({
+                "success": False,
+                "error": str(e)
+            }, status=500)
+        
+        if charge.duplicate:
+            return await self.replay_stream(request, charge, "content")
+        
+        meta = {"cost": cost, "new_balance": charge.balance}
+        return await self.stream_text(
+            request,
+            gemini_service.stream_natal_chart_interpretation(birth_data),
+            meta,
+            on_error=self.refund_for_stream(data, cost, service_name, charge),
+            on_complete=self.remember_stream(data, charge, meta, "content")
+        )
 
     async def handle_check_payment(self, request):
         """Проверка возможности оплаты услуги"""
@@ -366,8 +660,14 @@ class MiniAppAPI:
                 'natal_chart': 999
             }
             
-            cost = service_costs.get(service_type, 0)
-            user_balance = db.get_user_balance(user_id)
+            if service_type not in service_costs:
+                return web.json_response({
+                    "success": False,
+                    "error": "Неизвестная услуга"
+                }, status=400)
+            
+            cost = service_costs[service_type]
+            user_balance = await db.get_user_balance(user_id)
             
             can_afford = user_balance >= cost
             
@@ -388,11 +688,13 @@ class MiniAppAPI:
 
     async def handle_confirm_payment(self, request):
         """Подтверждение оплаты и предоставление услуги"""
+        charge = None
         try:
             data = await request.json()
             user_id = data.get('user_id')
             service_type = data.get('service_type')
             service_data = data.get('service_data', {})
+            idempotency_key = data.get('idempotency_key')
             
             service_costs = {
                 'weekly_horoscope': 333,
@@ -401,46 +703,47 @@ class MiniAppAPI:
                 'natal_chart': 999
             }
             
-            cost = service_costs.get(service_type, 0)
-            user_balance = db.get_user_balance(user_id)
-            
-            if user_balance < cost:
+            if service_type not in service_costs:
                 return web.json_response({
                     "success": False,
-                    "error": f"Недостаточно средств. Нужно {cost} Stars, у вас {user_balance} Stars."
-                }, status=402)
+                    "error": "Неизвестная услуга"
+                }, status=400)
             
-            # Списываем средства
-            if not db.update_balance(user_id, -cost):
-                return web.json_response({
-                    "success": False,
-                    "error": "Ошибка списания средств"
-                }, status=500)
+            # Данные проверяются до списания: отказ не должен стоить списания и возврата
+            error = self.validate_service_data(service_type, service_data)
+            if error is not None:
+                return web.json_response({"success": False, "error": error}, status=400)
+            
+            cost = service_costs[service_type]
+            
+            # Название услуги для статистики
+            if service_type == 'compatibility':
+                service_name = f"compatibility_{service_data.get('sign1', '')}_{service_data.get('sign2', '')}"
+            elif service_type == 'weekly_horoscope':
+                service_name = f"weekly_horoscope_{service_data.get('zodiac_sign', '')}"
+            elif service_type == 'tarot':
+                service_name = f"tarot_{service_data.get('spread_type', '')}"
+            else:
+                service_name = service_type
+            
+            # Списываем средства одной транзакцией
+            charge = await db.charge(user_id, service_name, cost, idempotency_key)
+            
+            if not charge.success:
+                return self.charge_failed_response(cost, charge)
+            if charge.duplicate:
+                return self.duplicate_response(charge)
             
             # Предоставляем услугу
-            result = await self.provide_service(service_type, service_data, user_id)
+            result = await self.provide_service(service_type, service_data, user_id, charge.key)
             
             if result["success"]:
-                # Логируем запрос
-                if service_type == 'compatibility':
-                    sign1 = service_data.get('sign1', '')
-                    sign2 = service_data.get('sign2', '')
-                    db.log_request(user_id, f"compatibility_{sign1}_{sign2}", cost)
-                elif service_type == 'weekly_horoscope':
-                    zodiac_sign = service_data.get('zodiac_sign', '')
-                    db.log_request(user_id, f"weekly_horoscope_{zodiac_sign}", cost)
-                elif service_type == 'tarot':
-                    spread_type = service_data.get('spread_type', '')
-                    db.log_request(user_id, f"tarot_{spread_type}", cost)
-                elif service_type == 'natal_chart':
-                    db.log_request(user_id, "natal_chart", cost)
-                
                 result["cost"] = cost
-                result["new_balance"] = db.get_user_balance(user_id)
-                return web.json_response(result)
+                result["new_balance"] = charge.balance
+                return await self.paid_response(user_id, charge, result)
             else:
                 # Возвращаем средства при ошибке
-                db.update_balance(user_id, cost)
+                await db.refund(user_id, cost, service_name, charge.key)
                 return web.json_response({
                     "success": False,
                     "error": result.get("error", "Ошибка предоставления услуги")
@@ -448,14 +751,39 @@ class MiniAppAPI:
                     
         except Exception as e:
             logger.error(f"Error in handle_confirm_payment: {e}")
-            # Возвращаем средства при исключении
-            db.update_balance(user_id, cost)
+            # Возвращаем средства, если услуга не была предоставлена
+            if charge is not None and charge.success and not charge.duplicate:
+                await db.refund(user_id, cost, service_name, charge.key)
             return web.json_response({
                 "success": False,
                 "error": str(e)
             }, status=500)
 
-    async def provide_service(self, service_type: str, service_data: dict, user_id: int):
+    def validate_service_data(self, service_type: str, service_data: dict) -> Optional[str]:
+        """Проверка данных услуги: текст ошибки или None"""
+        if not isinstance(service_data, dict):
+            return "Некорректные данные услуги"
+        
+        signs = {sign for sign, _ in ZODIAC_SIGNS}
+        if service_type == 'compatibility':
+            if service_data.get('sign1') not in signs or service_data.get('sign2') not in signs:
+                return "Не указаны знаки зодиака"
+        elif service_type == 'weekly_horoscope':
+            if service_data.get('zodiac_sign') not in signs:
+                return "Не указан знак зодиака"
+        elif service_type == 'tarot':
+            if service_data.get('spread_type', 'daily') not in SPREADS:
+                return "Неизвестный тип расклада"
+        elif service_type == 'natal_chart':
+            birth_data = service_data.get('birth_data')
+            if not isinstance(birth_data, dict):
+                return "Не указаны данные рождения"
+            for field in ('birth_date', 'birth_time', 'birth_place'):
+                if not birth_data.get(field):
+                    return f"Не указано поле: {field}"
+        return None
+
+    async def provide_service(self, service_type: str, service_data: dict, user_id: int, purchase: str = None):
         """Предоставление оплаченной услуги"""
         try:
             if service_type == 'compatibility':
@@ -464,7 +792,7 @@ class MiniAppAPI:
                 if not sign1 or not sign2:
                     return {"success": False, "error": "Не указаны знаки зодиака"}
                 
-                content = await gemini_service.generate_compatibility(sign1, sign2)
+                content = await compatibility_matrix.get(sign1, sign2)
                 return {
                     "success": True,
                     "content": content,
@@ -485,21 +813,14 @@ class MiniAppAPI:
                 
             elif service_type == 'tarot':
                 spread_type = service_data.get('spread_type', 'daily')
-                cards, positions = tarot_deck.create_spread(spread_type)
-                
-                spread_description = ""
-                for i, card in enumerate(cards):
-                    position_name = positions[i] if i < len(positions) else f"Позиция {i+1}"
-                    orientation = "прямое" if card["position"] == "upright" else "перевернутое"
-                    spread_description += f"{position_name}: {card['name']} ({orientation})\n"
-                
-                interpretation = await gemini_service.generate_tarot_reading(spread_type, spread_description)
+                cards, positions = tarot_deck.create_reading(spread_type, user_id, purchase=purchase)
+                interpretation = await tarot_interpretations.interpret(spread_type, cards, positions)
                 
                 formatted_cards = []
                 for i, card in enumerate(cards):
                     formatted_cards.append({
-                        "name": card["name"],
-                        "position": card["position"],
+                        "name": card.name,
+                        "position": card.position,
                         "meaning": tarot_deck.get_card_meaning(card),
                         "position_name": positions[i] if i < len(positions) else f"Позиция {i+1}"
                     })
@@ -532,13 +853,41 @@ class MiniAppAPI:
             logger.error(f"Error in provide_service: {e}")
             return {"success": False, "error": str(e)}
 
+    async def handle_fulfilment_status(self, request):
+        """Состояние заказов, оплаченных через Telegram Stars: конкретного по job_id или последних"""
+        try:
+            data = await request.json()
+            user_id = data.get('user_id')
+            job_id = data.get('job_id')
+            
+            if job_id is not None:
+                job = await fulfilment_queue.get_job(int(job_id), user_id)
+                if job is None:
+                    return web.json_response({
+                        "success": False,
+                        "error": "Заказ не найден"
+                    }, status=404)
+                return web.json_response({"success": True, "job": job})
+            
+            return web.json_response({
+                "success": True,
+                "jobs": await fulfilment_queue.get_user_jobs(user_id)
+            })
+            
+        except Exception as e:
+            logger.error(f"Error in handle_fulfilment_status: {e}")
+            return web.json_response({
+                "success": False,
+                "error": str(e)
+            }, status=500)
+
     async def handle_request_history(self, request):
         """Получение истории запросов"""
         try:
             data = await request.json()
             user_id = data.get('user_id')
             
-            history = db.get_user_requests(user_id, limit=10)
+            history = await db.get_user_requests(user_id, limit=10)
             
             formatted_history = []
             for req in history:
@@ -564,16 +913,39 @@ class MiniAppAPI:
                 "error": str(e)
             }, status=500)
 
-    async def start(self):
-        """Запуск API сервера"""
+    def setup_webhook(self, dispatcher, bot, path: str, secret_token: str):
+        """
+        Прием апдейтов Telegram на том же сервере, что и API.
+        Вызывается до start(): после запуска маршруты приложения менять нельзя.
+        """
+        from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+        
+        # Ответ Telegram сразу, обработка апдейта - в фоновой задаче
+        SimpleRequestHandler(
+            dispatcher=dispatcher,
+            bot=bot,
+            secret_token=secret_token
+        ).register(self.app, path=path)
+        logger.info(f"✅ Вебхук зарегистрирован на {path}")
+
+    async def start(self, host: str = WEB_SERVER_HOST, port: int = WEB_SERVER_PORT, reuse_port: bool = False):
+        """Запуск API сервера; reuse_port - порт делят несколько процессов-воркеров"""
         try:
-            runner = web.AppRunner(self.app)
-            await runner.setup()
-            site = web.TCPSite(runner, '0.0.0.0', 8080)
+            self.runner = web.AppRunner(self.app)
+            await self.runner.setup()
+            site = web.TCPSite(self.runner, host, port, reuse_port=reuse_port or None)
             await site.start()
-            logger.info("✅ API сервер запущен на порту 8080")
+            logger.info(f"✅ API сервер запущен на порту {port}")
         except Exception as e:
             logger.error(f"❌ Ошибка запуска API сервера: {e}")
+            raise
+
+    async def stop(self):
+        """Остановка API сервера"""
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+            logger.info("⏹️ API сервер остановлен")
 
 # Создаем экземпляр API
 miniapp_api = MiniAppAPI()
\ No newline at end of file
@@ -0,0 +1,467 @@
+# benchmarks/bench_load.py
+"""
+Нагрузочный тест: виртуальные пользователи одновременно работают с ботом
+(настоящий main_router) и с MiniApp API (настоящее MiniAppAPI.app).
+
+Сеть не нужна: Bot API заменен локальным aiohttp-сервером с задержкой
+--bot-api-latency, модели Gemini - заглушкой с логнормальной задержкой
+(медиана --gemini-latency, разброс --gemini-sigma) и долей ошибок
+--gemini-error-rate. База, хранилище FSM и кэш моделей - во временном каталоге.
+
+Отчет: пропускная способность, p50/p95/p99 по обработчикам и маршрутам API,
+задержка event loop и ожидание соединений SQLite.
+
+Запуск из корня проекта:
+    python benchmarks/bench_load.py --users 200 --duration 30 --api-share 0.3
+    python benchmarks/bench_load.py --no-cache --gemini-error-rate 0.2 --json result.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TOKEN = "123456:LOADTEST"
+
+SIGNS = ["Овен", "Телец", "Близнецы", "Рак", "Лев", "Дева",
+         "Весы", "Скорпион", "Стрелец", "Козерог", "Водолей", "Рыбы"]
+
+def percentile(values, q):
+    """Перцентиль по отсортированной копии"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+class Recorder:
+    """Задержки и ошибки по именам операций"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+
+    def add(self, name, started, ok=True):
+        self.latencies[name].append(time.perf_counter() - started)
+        if not ok:
+            self.errors[name] += 1
+
+    def summary(self, duration):
+        rows = {}
+        for name in sorted(self.latencies):
+            values = self.latencies[name]
+            rows[name] = {
+                "count": len(values),
+                "errors": self.errors[name],
+                "rps": len(values) / duration,
+                "p50_ms": percentile(values, 0.5) * 1000,
+                "p95_ms": percentile(values, 0.95) * 1000,
+                "p99_ms": percentile(values, 0.99) * 1000
+            }
+        return rows
+
+class FakeGemini:
+    """Заглушка моделей Gemini: задержка, ошибки и потоковая выдача по частям"""
+
+    CHUNKS = 8
+
+    def __init__(self, latency, sigma, error_rate):
+        self.latency = latency
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.calls = 0
+        self.errors = 0
+
+    def delay(self):
+        return random.lognormvariate(math.log(self.latency), self.sigma) if self.latency > 0 else 0.0
+
+    def text(self, prompt):
+        return "Звезды благоприятствуют спокойным решениям. " * 20
+
+    def install(self):
+        import google.generativeai as genai
+
+        fake = self
+
+        class Response:
+            def __init__(self, text):
+                self.text = text
+
+        class Stream:
+            def __init__(self, text, delay):
+                self._parts = [text[i::FakeGemini.CHUNKS] for i in range(FakeGemini.CHUNKS)]
+                self._delay = delay / FakeGemini.CHUNKS
+
+            async def __aiter__(self):
+                for part in self._parts:
+                    await asyncio.sleep(self._delay)
+                    yield Response(part)
+
+        async def generate_content_async(model, prompt, generation_config=None, stream=False, **kwargs):
+            fake.calls += 1
+            delay = fake.delay()
+            if random.random() < fake.error_rate:
+                fake.errors += 1
+                await asyncio.sleep(delay / 2)
+                raise RuntimeError("503 fake upstream error")
+            if stream:
+                # Первый фрагмент через треть задержки, остальное - по частям
+                await asyncio.sleep(delay / 3)
+                return Stream(fake.text(prompt), delay * 2 / 3)
+            await asyncio.sleep(delay)
+            return Response(fake.text(prompt))
+
+        genai.GenerativeModel.generate_content_async = generate_content_async
+
+class FakeBotAPI:
+    """Локальный сервер Bot API: отвечает на любые методы с задержкой latency"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = Counter()
+        self._message_id = 0
+        self.runner = None
+        self.url = None
+
+    async def handle(self, request):
+        from aiohttp import web
+
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        data = await request.post()
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+        if method in ("sendMessage", "editMessageText", "sendInvoice"):
+            self._message_id += 1
+            result = {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": int(data.get("chat_id", 0)), "type": "private"},
+                "text": data.get("text", "")
+            }
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self):
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+class LoopLagMonitor:
+    """Насколько позже запланированного просыпается задача - задержка event loop"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - started - self.interval))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+class PoolProbe:
+    """Ожидание свободного соединения SQLite и время запросов в пуле"""
+
+    def __init__(self, pool):
+        self.waits = []
+        self.queries = []
+        self.locked = 0
+        original_acquire = pool._acquire
+        original_run = pool.run
+
+        async def acquire():
+            started = time.perf_counter()
+            conn = await original_acquire()
+            self.waits.append(time.perf_counter() - started)
+            return conn
+
+        async def run(func, *args):
+            started = time.perf_counter()
+            try:
+                return await original_run(func, *args)
+            except Exception as e:
+                if "locked" in str(e):
+                    self.locked += 1
+                raise
+            finally:
+                self.queries.append(time.perf_counter() - started)
+
+        pool._acquire = acquire
+        pool.run = run
+
+    def summary(self):
+        contended = [w for w in self.waits if w > 0.001]
+        return {
+            "queries": len(self.queries),
+            "query_p50_ms": (percentile(self.queries, 0.5) or 0) * 1000,
+            "query_p99_ms": (percentile(self.queries, 0.99) or 0) * 1000,
+            "acquire_p99_ms": (percentile(self.waits, 0.99) or 0) * 1000,
+            "contended_share": len(contended) / len(self.waits) if self.waits else 0.0,
+            "locked_errors": self.locked
+        }
+
+def message_update(update_id, user_id, text):
+    from aiogram.types import Chat, Message, Update, User
+
+    return Update(update_id=update_id, message=Message(
+        message_id=update_id,
+        date=datetime.now(),
+        chat=Chat(id=user_id, type="private"),
+        from_user=User(id=user_id, is_bot=False, first_name=f"User{user_id}"),
+        text=text
+    ))
+
+def callback_update(update_id, user_id, data):
+    from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+    user = User(id=user_id, is_bot=False, first_name=f"User{user_id}")
+    return Update(update_id=update_id, callback_query=CallbackQuery(
+        id=str(update_id),
+        from_user=user,
+        chat_instance=str(user_id),
+        data=data,
+        message=Message(message_id=update_id, date=datetime.now(),
+                        chat=Chat(id=user_id, type="private"), text="Меню")
+    ))
+
+async def run_load(args):
+    from aiogram import Bot, Dispatcher
+    from aiogram.client.default import DefaultBotProperties
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiogram.enums import ParseMode
+    from aiohttp import ClientSession
+    from aiohttp.test_utils import TestServer
+
+    from api.server import miniapp_api
+    from config import FLOOD_CONTROL_ENABLED
+    from database import db
+    from handlers import main_router
+    from services.fsm_storage import create_storage
+    from services.gemini_service import gemini_service
+
+    gemini = FakeGemini(args.gemini_latency, args.gemini_sigma, args.gemini_error_rate)
+    gemini.install()
+    bot_api = FakeBotAPI(args.bot_api_latency)
+    await bot_api.start()
+
+    bot = Bot(
+        token=TOKEN,
+        session=AiohttpSession(api=TelegramAPIServer.from_base(bot_api.url)),
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+    )
+    dp = Dispatcher(storage=create_storage())
+    dp.include_router(main_router)
+    if FLOOD_CONTROL_ENABLED:
+        from utils.flood_control import FloodControlMiddleware
+        flood_control = FloodControlMiddleware()
+        dp.message.middleware(flood_control)
+        dp.callback_query.middleware(flood_control)
+
+    db.request_log.start()
+    gemini_service.start()
+    await gemini_service.wait_ready()
+
+    pool_probe = PoolProbe(db.pool)
+    api_server = TestServer(miniapp_api.app)
+    await api_server.start_server()
+    http = ClientSession(base_url=str(api_server.make_url("/")))
+
+    recorder = Recorder()
+    update_ids = iter(range(1, 10 ** 9))
+    deadline = time.perf_counter() + args.duration
+
+    async def feed(name, update):
+        started = time.perf_counter()
+        try:
+            await dp.feed_update(bot, update)
+        except Exception:
+            recorder.add(name, started, ok=False)
+            return
+        recorder.add(name, started)
+
+    async def post(name, path, payload):
+        started = time.perf_counter()
+        try:
+            async with http.post(path, json=payload) as response:
+                await response.read()
+                # 402 - нормальный отказ при нехватке баланса
+                ok = response.status < 500
+        except Exception:
+            ok = False
+        recorder.add(f"api {name}", started, ok)
+
+    async def bot_user(user_id):
+        await feed("/start", message_update(next(update_ids), user_id, "/start"))
+        while time.perf_counter() < deadline:
+            action = random.choices(
+                ["horoscope", "info", "tarot", "compatibility"], weights=[5, 2, 1, 1]
+            )[0]
+            sign = random.choice(SIGNS)
+            if action == "horoscope":
+                await feed("daily menu", message_update(next(update_ids), user_id, "♈ Ежедневный гороскоп"))
+                await feed("horoscope_", callback_update(next(update_ids), user_id, f"horoscope_{sign}"))
+            elif action == "info":
+                await feed("general info", message_update(next(update_ids), user_id, "📚 Общая информация"))
+            elif action == "tarot":
+                await feed("tarot menu", message_update(next(update_ids), user_id, "🃏 Расклад Таро (888 Stars)"))
+                await feed("tarot_ invoice", callback_update(next(update_ids), user_id, "tarot_three"))
+            else:
+                await feed("compat menu", message_update(next(update_ids), user_id, "💑 Совместимость (55 Stars)"))
+                await feed("compat_first_", callback_update(next(update_ids), user_id, f"compat_first_{sign}"))
+                await feed("compat_second_", callback_update(
+                    next(update_ids), user_id, f"compat_second_{random.choice(SIGNS)}"
+                ))
+            await asyncio.sleep(random.expovariate(1 / args.think_time) if args.think_time > 0 else 0)
+
+    async def api_user(user_id):
+        await post("user", f"/api/user/{user_id}", {})
+        while time.perf_counter() < deadline:
+            action = random.choices(["daily", "history", "user", "tarot"], weights=[5, 2, 2, 1])[0]
+            if action == "daily":
+                await post("daily_horoscope", "/api/daily_horoscope",
+                           {"user_id": user_id, "zodiac_sign": random.choice(SIGNS)})
+            elif action == "history":
+                await post("request_history", "/api/request_history", {"user_id": user_id})
+            elif action == "user":
+                await post("user", f"/api/user/{user_id}", {})
+            else:
+                await post("tarot", "/api/tarot", {"user_id": user_id, "spread_type": "three"})
+            await asyncio.sleep(random.expovariate(1 / args.think_time) if args.think_time > 0 else 0)
+
+    lag = LoopLagMonitor()
+    lag.start()
+    started = time.perf_counter()
+    api_users = int(args.users * args.api_share)
+    await asyncio.gather(*(
+        api_user(user_id) if user_id < api_users else bot_user(user_id)
+        for user_id in range(1, args.users + 1)
+    ))
+    duration = time.perf_counter() - started
+    await lag.stop()
+
+    await http.close()
+    await api_server.close()
+    await gemini_service.stop()
+    await dp.storage.close()
+    await db.close()
+    await bot.session.close()
+    await bot_api.stop()
+
+    operations = recorder.summary(duration)
+    total = sum(row["count"] for row in operations.values())
+    return {
+        "duration_s": duration,
+        "operations": total,
+        "throughput_rps": total / duration,
+        "per_operation": operations,
+        "loop_lag_ms": {
+            "p50": (percentile(lag.samples, 0.5) or 0) * 1000,
+            "p99": (percentile(lag.samples, 0.99) or 0) * 1000,
+            "max": max(lag.samples, default=0) * 1000
+        },
+        "sqlite": pool_probe.summary(),
+        "gemini": {"calls": gemini.calls, "errors": gemini.errors, "router": gemini_service.get_stats()["router"]},
+        "bot_api_calls": dict(bot_api.calls)
+    }
+
+def print_report(result):
+    print(f"\n{'operation':<22} | {'count':>6} | {'err':>4} | {'rps':>7} | {'p50 ms':>8} | {'p95 ms':>8} | {'p99 ms':>8}")
+    print("-" * 80)
+    for name, row in result["per_operation"].items():
+        print(f"{name:<22} | {row['count']:>6} | {row['errors']:>4} | {row['rps']:>7.1f} | "
+              f"{row['p50_ms']:>8.1f} | {row['p95_ms']:>8.1f} | {row['p99_ms']:>8.1f}")
+    print("-" * 80)
+    print(f"Всего: {result['operations']} операций за {result['duration_s']:.1f} с, "
+          f"{result['throughput_rps']:.1f} оп/с")
+
+    lag = result["loop_lag_ms"]
+    print(f"Задержка event loop: p50 {lag['p50']:.2f} мс, p99 {lag['p99']:.2f} мс, max {lag['max']:.1f} мс")
+
+    sqlite = result["sqlite"]
+    print(f"SQLite: {sqlite['queries']} запросов, p50 {sqlite['query_p50_ms']:.2f} мс, "
+          f"p99 {sqlite['query_p99_ms']:.2f} мс; ожидание соединения p99 {sqlite['acquire_p99_ms']:.2f} мс, "
+          f"с ожиданием {sqlite['contended_share']:.1%}, database is locked: {sqlite['locked_errors']}")
+
+    gemini = result["gemini"]
+    router = gemini["router"]
+    print(f"Gemini: {gemini['calls']} вызовов, {gemini['errors']} ошибок; "
+          f"переключений {router['failovers']}, страховочных {router['hedged']}")
+    print(f"Bot API: {sum(result['bot_api_calls'].values())} вызовов {result['bot_api_calls']}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100, help='Виртуальных пользователей')
+    parser.add_argument('--duration', type=float, default=20, help='Длительность, с')
+    parser.add_argument('--api-share', type=float, default=0.3, help='Доля пользователей MiniApp API')
+    parser.add_argument('--think-time', type=float, default=0.5, help='Средняя пауза пользователя между действиями, с')
+    parser.add_argument('--gemini-latency', type=float, default=1.0, help='Медиана задержки Gemini, с')
+    parser.add_argument('--gemini-sigma', type=float, default=0.5, help='Разброс логнормальной задержки Gemini')
+    parser.add_argument('--gemini-error-rate', type=float, default=0.02, help='Доля ошибок Gemini')
+    parser.add_argument('--bot-api-latency', type=float, default=0.03, help='Задержка ответа Bot API, с')
+    parser.add_argument('--no-cache', action='store_true', help='Без кэша гороскопов: каждый запрос идет в Gemini')
+    parser.add_argument('--flood-control', action='store_true', help='Включить ограничение частоты запросов')
+    parser.add_argument('--seed', type=int, default=1, help='Зерно генератора случайных чисел')
+    parser.add_argument('--json', help='Сохранить результат в JSON-файл')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    with tempfile.TemporaryDirectory() as workdir:
+        # Настройки читаются при импорте модулей бота - задаем их заранее
+        os.environ.update({
+            "BOT_TOKEN": TOKEN,
+            "GEMINI_API_KEY": os.environ.get("GEMINI_API_KEY", "loadtest"),
+            "DB_PATH": os.path.join(workdir, "load.db"),
+            "STORAGE_PATH": os.path.join(workdir, "state.db"),
+            "GEMINI_MODEL_CACHE_PATH": os.path.join(workdir, "gemini_models.json"),
+            "PREGENERATION_ENABLED": "0",
+            "COMPATIBILITY_MATRIX_ENABLED": "0",
+            "FLOOD_CONTROL_ENABLED": "1" if args.flood_control else "0"
+        })
+        if args.no_cache:
+            os.environ.update({"HOROSCOPE_CACHE_SIZE": "0", "HOROSCOPE_CACHE_PERSIST": "0"})
+        sys.path.insert(0, ROOT)
+
+        import logging
+        logging.disable(logging.CRITICAL)
+
+        result = asyncio.run(run_load(args))
+
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+# benchmarks/bench_messages.py
+"""
+Бенчмарк исходящих сообщений: прежний split_message (срез остатка текста
+на каждую часть - квадратичное время) против однопроходного разбиения с
+учетом HTML-тегов, и MessageSender на фейковом боте - скорость отправки
+с ограничениями по чату и общим лимитом, повторы после RetryAfter и задержки.
+
+Запуск из корня проекта:
+    python benchmarks/bench_messages.py --sizes 100000,1000000,4000000 --chats 50 --messages 5
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from utils.message_utils import MessageSender, split_message
+
+def legacy_split_message(text: str, max_length: int = 4096) -> list:
+    """Прежняя реализация split_message"""
+    if len(text) <= max_length:
+        return [text]
+
+    parts = []
+    while text:
+        if len(text) <= max_length:
+            parts.append(text)
+            break
+        split_index = text.rfind('\n\n', 0, max_length)
+        if split_index == -1:
+            split_index = text.rfind('\n', 0, max_length)
+        if split_index == -1:
+            split_index = text.rfind('. ', 0, max_length)
+        if split_index == -1:
+            split_index = text.rfind(' ', 0, max_length)
+        if split_index == -1:
+            split_index = max_length
+        parts.append(text[:split_index].strip())
+        text = text[split_index:].strip()
+    return parts
+
+def make_text(size: int) -> str:
+    """Текст, похожий на ответ модели: абзацы с жирными и курсивными вставками"""
+    paragraph = ("Карта говорит о <b>переменах</b> и о том, что <i>терпение</i> "
+                 "принесет плоды. Доверьтесь интуиции. ") * 6 + "\n\n"
+    return (paragraph * (size // len(paragraph) + 1))[:size]
+
+class FakeBot:
+    """Bot API с задержкой ответа и случайными RetryAfter"""
+
+    def __init__(self, latency: float, retry_rate: float):
+        self.latency = latency
+        self.retry_rate = retry_rate
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+        if random.random() < self.retry_rate:
+            raise TelegramRetryAfter(method=SendMessage(chat_id=chat_id, text=text),
+                                     message="Too Many Requests", retry_after=1)
+        return text
+
+async def bench_sender(args):
+    bot = FakeBot(args.latency, args.retry_rate)
+    sender = MessageSender(rate=args.rate, chat_interval=args.chat_interval)
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        sender.send(bot, chat_id, f"Сообщение {i}")
+        for chat_id in range(args.chats) for i in range(args.messages)
+    ))
+    elapsed = time.perf_counter() - started
+    stats = sender.get_stats()
+    total = args.chats * args.messages
+    print(f"\nОтправка: {total} сообщений в {args.chats} чатов за {elapsed:.2f} с "
+          f"({total / elapsed:.1f}/с при лимите {args.rate:g}/с)")
+    print(f"  повторов после RetryAfter: {stats['retried']}, ошибок: {stats['failed']}")
+    print(f"  задержка Bot API p50/p95/max: {stats['latency_p50'] * 1000:.0f}/"
+          f"{stats['latency_p95'] * 1000:.0f}/{stats['latency_max'] * 1000:.0f} мс")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='100000,1000000,4000000', help='Размеры текста через запятую')
+    parser.add_argument('--chats', type=int, default=50, help='Чатов для отправки')
+    parser.add_argument('--messages', type=int, default=5, help='Сообщений в каждый чат')
+    parser.add_argument('--rate', type=float, default=30, help='Общий лимит, сообщений в секунду')
+    parser.add_argument('--chat-interval', type=float, default=1, help='Секунд между сообщениями в чат')
+    parser.add_argument('--latency', type=float, default=0.05, help='Средняя задержка Bot API, с')
+    parser.add_argument('--retry-rate', type=float, default=0.02, help='Доля ответов RetryAfter')
+    args = parser.parse_args()
+
+    random.seed(1)
+    print(f"{'size':>9} | {'parts':>5} | {'legacy ms':>10} | {'new ms':>8}")
+    for size in (int(x) for x in args.sizes.split(',')):
+        text = make_text(size)
+        started = time.perf_counter()
+        legacy = legacy_split_message(text)
+        old = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        parts = split_message(text)
+        new = (time.perf_counter() - started) * 1000
+        assert all(len(part) <= 4096 for part in parts)
+        print(f"{size:>9} | {len(parts):>5} | {old:>10.1f} | {new:>8.1f}  (legacy parts: {len(legacy)})")
+
+    asyncio.run(bench_sender(args))
+
+if __name__ == '__main__':
+    main()
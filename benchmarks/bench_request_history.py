@@ -0,0 +1,81 @@
+# benchmarks/bench_request_history.py
+"""
+Бенчмарк истории запросов: задержка Database.get_user_requests
+до и после индексов из миграции 4 при росте таблицы requests.
+
+Запуск из корня проекта:
+    python benchmarks/bench_request_history.py --sizes 10000,100000,1000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrations import MIGRATIONS, run_migrations
+
+# Тот же запрос, что в Database.get_user_requests
+HISTORY_QUERY = '''
+    SELECT service_type, request_date, cost 
+    FROM requests 
+    WHERE user_id = ? 
+    ORDER BY request_date DESC 
+    LIMIT ?
+'''
+
+INDEX_VERSION = 4
+
+def fill_requests(conn, rows, users):
+    """Заполнить таблицу requests случайными запросами"""
+    start = datetime(2025, 1, 1)
+    batch = []
+    for i in range(rows):
+        request_date = start + timedelta(seconds=random.randrange(365 * 24 * 3600))
+        batch.append((random.randrange(users), "daily_horoscope", request_date.strftime('%Y-%m-%d %H:%M:%S'), 0))
+        if len(batch) == 50000:
+            conn.executemany('INSERT INTO requests (user_id, service_type, request_date, cost) VALUES (?, ?, ?, ?)', batch)
+            batch.clear()
+    if batch:
+        conn.executemany('INSERT INTO requests (user_id, service_type, request_date, cost) VALUES (?, ?, ?, ?)', batch)
+    conn.commit()
+
+def measure(conn, users, queries):
+    """Задержки запроса истории в миллисекундах"""
+    latencies = []
+    for _ in range(queries):
+        user_id = random.randrange(users)
+        started = time.perf_counter()
+        conn.execute(HISTORY_QUERY, (user_id, 10)).fetchall()
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.95) - 1]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10000,100000,1000000', help='Размеры таблицы requests через запятую')
+    parser.add_argument('--users', type=int, default=10000, help='Число пользователей')
+    parser.add_argument('--queries', type=int, default=200, help='Запросов истории на замер')
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} | {'no index p50':>12} | {'no index p95':>12} | {'index p50':>10} | {'index p95':>10}  (ms)")
+    for size in (int(value) for value in args.sizes.split(',')):
+        with tempfile.TemporaryDirectory() as tmp:
+            conn = sqlite3.connect(os.path.join(tmp, 'bench.db'))
+            run_migrations(conn, [m for m in MIGRATIONS if m[0] < INDEX_VERSION])
+            fill_requests(conn, size, args.users)
+            plain = measure(conn, args.users, args.queries)
+
+            run_migrations(conn)
+            indexed = measure(conn, args.users, args.queries)
+            conn.close()
+
+        print(f"{size:>10} | {plain[0]:>12.3f} | {plain[1]:>12.3f} | {indexed[0]:>10.3f} | {indexed[1]:>10.3f}")
+
+if __name__ == '__main__':
+    main()
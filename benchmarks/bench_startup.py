@@ -0,0 +1,173 @@
+# benchmarks/bench_startup.py
+"""
+Бенчмарк запуска: время от старта процесса до импорта обработчиков,
+до обработки первого апдейта и до выбора модели Gemini.
+
+Сеть не нужна: тестовые запросы к моделям заменены задержкой --probe-latency,
+первые --failing-models моделей из списка отвечают ошибкой.
+Сценарии:
+    legacy - прежняя последовательная проверка моделей при импорте;
+    cold   - фоновая параллельная проверка, файла с результатами нет;
+    warm   - модель берется из файла с результатами прошлой проверки.
+
+Запуск из корня проекта:
+    python benchmarks/bench_startup.py --runs 5 --probe-latency 1.5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def child(scenario: str, probe_latency: float, failing_models: int):
+    """Один запуск бота с фиктивной сетью, результат - JSON в stdout"""
+    started = time.perf_counter()
+    sys.path.insert(0, ROOT)
+
+    import asyncio
+    import logging
+    from datetime import datetime
+
+    import google.generativeai as genai
+
+    logging.disable(logging.CRITICAL)
+
+    def failing(model_name: str) -> bool:
+        from services.gemini_service import gemini_service
+        return gemini_service.model_priority.index(model_name.split('/')[-1]) < failing_models
+
+    def fake_generate_content(self, *args, **kwargs):
+        time.sleep(probe_latency)
+        if failing(self.model_name):
+            raise RuntimeError("404 model not found")
+
+    async def fake_generate_content_async(self, *args, **kwargs):
+        await asyncio.sleep(probe_latency)
+        if failing(self.model_name):
+            raise RuntimeError("404 model not found")
+
+    genai.GenerativeModel.generate_content = fake_generate_content
+    genai.GenerativeModel.generate_content_async = fake_generate_content_async
+
+    if scenario == "legacy":
+        # Прежний GeminiService.__init__: блокирующие запросы по очереди до первой доступной модели
+        from services.gemini_service import gemini_service
+        for model_name in gemini_service.model_priority:
+            try:
+                gemini_service.model = genai.GenerativeModel(model_name)
+                gemini_service.model.generate_content("Тест")
+                gemini_service.model_name = model_name
+                break
+            except Exception:
+                continue
+
+    from aiogram import Bot, Dispatcher
+    from aiogram.client.session.base import BaseSession
+    from aiogram.types import Chat, Message, Update, User
+
+    from handlers import main_router
+    from services.gemini_service import gemini_service
+
+    imported = time.perf_counter()
+
+    class FakeSession(BaseSession):
+        """Bot API без сети"""
+
+        async def make_request(self, bot, method, timeout=None):
+            return None
+
+        async def stream_content(self, *args, **kwargs):
+            yield b""
+
+        async def close(self):
+            pass
+
+    async def run():
+        bot = Bot(token="123456:TEST", session=FakeSession())
+        dp = Dispatcher()
+        dp.include_router(main_router)
+
+        if scenario != "legacy":
+            gemini_service.start()
+
+        update = Update(update_id=1, message=Message(
+            message_id=1,
+            date=datetime.now(),
+            chat=Chat(id=1, type="private"),
+            from_user=User(id=1, is_bot=False, first_name="Bench"),
+            text="📚 Общая информация"
+        ))
+        await dp.feed_update(bot, update)
+        first_update = time.perf_counter()
+
+        if scenario == "legacy":
+            return first_update, first_update
+
+        await gemini_service.wait_ready()
+        model_ready = time.perf_counter()
+        await gemini_service.stop()
+
+        return first_update, model_ready
+
+    first_update, model_ready = asyncio.run(run())
+    print(json.dumps({
+        "import": imported - started,
+        "first_update": first_update - started,
+        "model_ready": model_ready - started,
+        "model": gemini_service.model_name
+    }))
+
+def run_scenario(scenario: str, args, workdir: str) -> dict:
+    """Несколько запусков сценария в отдельных процессах"""
+    env = dict(os.environ)
+    env.setdefault("BOT_TOKEN", "123456:TEST")
+    env.setdefault("GEMINI_API_KEY", "bench")
+    env["DB_PATH"] = os.path.join(workdir, "bench.db")
+    env["GEMINI_MODEL_CACHE_PATH"] = os.path.join(workdir, "gemini_models.json")
+    env["PREGENERATION_ENABLED"] = "0"
+    env["COMPATIBILITY_MATRIX_ENABLED"] = "0"
+
+    results = []
+    for _ in range(args.runs):
+        if scenario != "warm" and os.path.exists(env["GEMINI_MODEL_CACHE_PATH"]):
+            os.remove(env["GEMINI_MODEL_CACHE_PATH"])
+
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", scenario,
+             "--probe-latency", str(args.probe_latency), "--failing-models", str(args.failing_models)],
+            cwd=workdir, env=env, capture_output=True, text=True, check=True
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    return {
+        key: statistics.median(result[key] for result in results)
+        for key in ("import", "first_update", "model_ready")
+    } | {"model": results[-1]["model"]}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3, help='Запусков на сценарий')
+    parser.add_argument('--probe-latency', type=float, default=1.5, help='Задержка тестового запроса к модели, с')
+    parser.add_argument('--failing-models', type=int, default=2, help='Сколько первых моделей недоступно')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.probe_latency, args.failing_models)
+        return
+
+    print(f"{'scenario':>8} | {'import':>8} | {'first update':>12} | {'model ready':>11} | model  (s, median of {args.runs})")
+    with tempfile.TemporaryDirectory() as workdir:
+        # warm идет после cold: файл с результатами проверки остается от cold
+        for scenario in ("legacy", "cold", "warm"):
+            result = run_scenario(scenario, args, workdir)
+            print(f"{scenario:>8} | {result['import']:>8.3f} | {result['first_update']:>12.3f} | "
+                  f"{result['model_ready']:>11.3f} | {result['model']}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+# benchmarks/bench_tarot.py
+"""
+Микробенчмарк колоды Таро: прежняя колода из словарей (копия и полное
+тасование колоды на каждый расклад, копия каждой карты, словарь мастей
+при каждом запросе значения) против компактной TarotDeck
+(random.sample по индексам и заранее созданные карты).
+
+Одиночные расклады - create_spread + значения всех карт, как в обработчиках;
+пакетные - --bulk раскладов подряд, в цикле create_spread и одним вызовом
+create_spreads (с NumPy, если он установлен, и без него), плюс карты дня
+для --bulk пользователей. Дополнительно - память одной колоды.
+
+Запуск из корня проекта:
+    python benchmarks/bench_tarot.py --repeat 20000 --bulk 100000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import services.tarot_deck as tarot_module
+from services.tarot_deck import MAJOR_ARCANA, RANKS, SPREADS, SUITS, TarotDeck
+
+class LegacyTarotDeck:
+    """Прежняя реализация TarotDeck: колода из словарей"""
+
+    def __init__(self):
+        self.major_arcana = [
+            {"name": name, "number": number, "upright": upright, "reversed": reversed_}
+            for number, (name, upright, reversed_) in enumerate(MAJOR_ARCANA)
+        ]
+        self.minor_arcana = [
+            {"name": f"{rank} {genitive}", "suit": suit, "number": rank}
+            for suit, genitive, _, _ in SUITS for rank in RANKS
+        ]
+        for card in self.minor_arcana:
+            suit_meanings = {suit: {"upright": upright, "reversed": reversed_}
+                             for suit, _, upright, reversed_ in SUITS}
+            card["upright"] = suit_meanings[card["suit"]]["upright"]
+            card["reversed"] = suit_meanings[card["suit"]]["reversed"]
+        self.full_deck = self.major_arcana + self.minor_arcana
+
+    def shuffle_deck(self):
+        shuffled = self.full_deck.copy()
+        random.shuffle(shuffled)
+        return shuffled
+
+    def draw_cards(self, count=1):
+        deck = self.shuffle_deck()
+        drawn_cards = []
+        for i in range(count):
+            if i < len(deck):
+                card = deck[i].copy()
+                card["position"] = random.choice(["upright", "reversed"])
+                drawn_cards.append(card)
+        return drawn_cards
+
+    def get_card_meaning(self, card):
+        if "upright" in card and "reversed" in card:
+            if card["position"] == "upright":
+                return card["upright"]
+            else:
+                return card["reversed"]
+        suit_meanings = {
+            "Жезлы": "энергия, творчество, действие",
+            "Кубки": "эмоции, отношения, интуиция",
+            "Мечи": "интеллект, конфликт, правда",
+            "Пентакли": "материальное, работа, стабильность"
+        }
+        base_meaning = suit_meanings.get(card.get("suit", ""), "влияние, изменение")
+        if card["position"] == "upright":
+            return f"Позитивное влияние: {base_meaning}"
+        return f"Вызов или сложность: {base_meaning}"
+
+    def create_spread(self, spread_type):
+        # Прежде словарь определений раскладов строился заново на каждый вызов
+        spread_definitions = {name: {"count": spread.count, "positions": list(spread.positions)}
+                              for name, spread in SPREADS.items()}
+        spread_info = spread_definitions.get(spread_type, spread_definitions["daily"])
+        return self.draw_cards(spread_info["count"]), spread_info["positions"]
+
+def spread_with_meanings(deck, spread_type):
+    """Расклад и значения карт - как при ответе пользователю"""
+    cards, _ = deck.create_spread(spread_type)
+    return [deck.get_card_meaning(card) for card in cards]
+
+def measure(func, repeat):
+    """Микросекунд на вызов"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat * 1e6
+
+def deck_memory(factory):
+    """Байт на одну колоду со всеми картами"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    deck = factory()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del deck
+    return size
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=20000, help='Повторов для одиночных раскладов')
+    parser.add_argument('--bulk', type=int, default=100000, help='Раскладов в пакетном прогоне')
+    args = parser.parse_args()
+
+    random.seed(1)
+    legacy = LegacyTarotDeck()
+    compact = TarotDeck()
+
+    print(f"{'spread':>8} | {'legacy us':>10} | {'compact us':>10} | speedup")
+    for spread_type in ("daily", "three", "four", "celtic"):
+        old = measure(lambda: spread_with_meanings(legacy, spread_type), args.repeat)
+        new = measure(lambda: spread_with_meanings(compact, spread_type), args.repeat)
+        print(f"{spread_type:>8} | {old:>10.2f} | {new:>10.2f} | {old / new:>6.1f}x")
+
+    print(f"\nПакет: {args.bulk} раскладов celtic")
+    for name, deck in (("legacy", legacy), ("compact", compact)):
+        started = time.perf_counter()
+        spreads = [deck.create_spread("celtic")[0] for _ in range(args.bulk)]
+        elapsed = time.perf_counter() - started
+        del spreads
+
+        # Память хранимых раскладов отдельным прогоном: трассировка замедляет выполнение
+        tracemalloc.start()
+        spreads = [deck.create_spread("celtic")[0] for _ in range(args.bulk)]
+        held = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del spreads
+        print(f"{name:>8}: {elapsed:.3f} с, {args.bulk / elapsed:,.0f} раскладов/с, "
+              f"{held / args.bulk:,.0f} Б на расклад")
+
+    print(f"\nПакетный API: {args.bulk} раскладов celtic одним вызовом")
+    numpy_module = tarot_module.np
+    backends = (("numpy", numpy_module), ("python", None)) if numpy_module is not None else (("python", None),)
+    for name, module in backends:
+        tarot_module.np = module
+        started = time.perf_counter()
+        batch = compact.create_spreads("celtic", args.bulk)
+        elapsed = time.perf_counter() - started
+        print(f"{name:>8}: {elapsed:.3f} с, {args.bulk / elapsed:,.0f} раскладов/с, "
+              f"{batch.nbytes / args.bulk:,.0f} Б на расклад")
+    tarot_module.np = numpy_module
+
+    started = time.perf_counter()
+    compact.cards_of_the_day(range(args.bulk), date.today())
+    elapsed = time.perf_counter() - started
+    print(f"\nКарты дня: {args.bulk} пользователей за {elapsed:.3f} с")
+
+    print(f"\nПамять колоды: legacy {deck_memory(LegacyTarotDeck):,} Б, compact {deck_memory(TarotDeck):,} Б")
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,4 @@
+import hashlib
 import os
 from dotenv import load_dotenv
 
@@ -8,6 +9,112 @@ GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 ADMIN_ID = os.getenv('ADMIN_ID', '123456789')
 PAYMENT_PROVIDER_TOKEN = os.getenv('PAYMENT_PROVIDER_TOKEN')  # Добавьте эту строку
 
+# Режим получения апдейтов: поллинг или вебхук на общем с MiniApp API сервере
+WEBHOOK_ENABLED = os.getenv('WEBHOOK_ENABLED', '0') == '1'  # 0 - long polling
+WEBHOOK_BASE_URL = os.getenv('WEBHOOK_BASE_URL', '').rstrip('/')  # Публичный адрес, например https://bot.example.com
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+# Секрет заголовка X-Telegram-Bot-Api-Secret-Token; по умолчанию выводится из токена,
+# чтобы совпадать у всех экземпляров за балансировщиком
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or (hashlib.sha256(BOT_TOKEN.encode()).hexdigest() if BOT_TOKEN else '')
+WEB_SERVER_HOST = os.getenv('WEB_SERVER_HOST', '0.0.0.0')
+WEB_SERVER_PORT = int(os.getenv('PORT', '8080'))
+
+# Несколько процессов-воркеров на одном порту (только в режиме вебхука)
+WORKERS = max(1, int(os.getenv('WORKERS', '1')))
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'sqlite')  # memory | sqlite | redis
+STORAGE_PATH = os.getenv('STORAGE_PATH', 'bot_state.db')  # Файл состояний FSM для sqlite
+FSM_STATE_TTL = int(os.getenv('FSM_STATE_TTL', str(24 * 3600)))  # Секунд до удаления брошенного состояния
+FSM_PURGE_INTERVAL = float(os.getenv('FSM_PURGE_INTERVAL', '3600'))  # Секунд между очистками
+# Память и отложенная запись только для одного процесса: воркеры должны сразу видеть чужие изменения
+FSM_CACHE_SIZE = int(os.getenv('FSM_CACHE_SIZE', '10000' if WORKERS == 1 else '0'))  # Ключей в памяти
+FSM_FLUSH_INTERVAL = float(os.getenv('FSM_FLUSH_INTERVAL', '0.5' if WORKERS == 1 else '0'))  # Секунд между записями, 0 - сразу
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
+DB_PATH = os.getenv('DB_PATH', 'zodiac_bot.db')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '4'))  # Соединений в пуле
+DB_CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', '16384'))  # Кэш страниц на соединение
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', str(256 * 1024 * 1024)))  # Байт
+DB_STATEMENT_CACHE = int(os.getenv('DB_STATEMENT_CACHE', '256'))  # Подготовленных запросов на соединение
+REQUEST_LOG_BATCH_SIZE = int(os.getenv('REQUEST_LOG_BATCH_SIZE', '200'))  # Строк статистики в одной транзакции
+REQUEST_LOG_FLUSH_INTERVAL = float(os.getenv('REQUEST_LOG_FLUSH_INTERVAL', '1'))  # Секунд между записями
+REQUEST_LOG_MAX_BUFFER = int(os.getenv('REQUEST_LOG_MAX_BUFFER', '10000'))  # Строк в памяти до ожидания записи
+# Баланс меняют все воркеры, поэтому при нескольких процессах кэш профилей по умолчанию выключен
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000' if WORKERS == 1 else '0'))  # Профилей пользователей в памяти
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', '300'))  # Секунд
+
+# Ограничения запросов к Gemini
+GEMINI_MAX_CONCURRENCY = int(os.getenv('GEMINI_MAX_CONCURRENCY', '8'))  # Одновременных генераций
+GEMINI_REQUEST_TIMEOUT = float(os.getenv('GEMINI_REQUEST_TIMEOUT', '60'))  # Секунд на один запрос
+GEMINI_RPM = float(os.getenv('GEMINI_RPM', '300'))  # Запросов в минуту по квоте, 0 - без ограничения
+GEMINI_TPM = float(os.getenv('GEMINI_TPM', '1000000'))  # Токенов в минуту по квоте, 0 - без ограничения
+UPSTREAM_MAX_QUEUE = int(os.getenv('UPSTREAM_MAX_QUEUE', '200'))  # Запросов в очереди к Gemini
+UPSTREAM_MAX_WAIT_PAID = float(os.getenv('UPSTREAM_MAX_WAIT_PAID', '60'))  # Секунд ожидания для платных услуг
+UPSTREAM_MAX_WAIT_INTERACTIVE = float(os.getenv('UPSTREAM_MAX_WAIT_INTERACTIVE', '10'))  # Секунд для бесплатных запросов
+
+# Выбор модели Gemini
+GEMINI_PROBE_TIMEOUT = float(os.getenv('GEMINI_PROBE_TIMEOUT', '15'))  # Секунд на проверку одной модели
+GEMINI_MODEL_CACHE_PATH = os.getenv('GEMINI_MODEL_CACHE_PATH', 'gemini_models.json')  # Результаты проверки моделей
+GEMINI_MODEL_CACHE_TTL = int(os.getenv('GEMINI_MODEL_CACHE_TTL', str(24 * 3600)))  # Секунд до повторной проверки
+
+# Маршрутизация запросов между моделями
+GEMINI_FREE_MODELS = [name.strip() for name in os.getenv('GEMINI_FREE_MODELS', 'gemini-2.0-flash-lite-001').split(',') if name.strip()]  # Дешевые модели для бесплатного контента
+GEMINI_HEDGE_DELAY = float(os.getenv('GEMINI_HEDGE_DELAY', '10'))  # Секунд до страховочного запроса, 0 - выключено
+GEMINI_STATS_WINDOW = int(os.getenv('GEMINI_STATS_WINDOW', '100'))  # Последних запросов для p50/p95 и доли ошибок
+GEMINI_BREAKER_FAILURES = int(os.getenv('GEMINI_BREAKER_FAILURES', '3'))  # Ошибок подряд до отключения модели
+GEMINI_BREAKER_ERROR_RATE = float(os.getenv('GEMINI_BREAKER_ERROR_RATE', '0.5'))  # Доля ошибок в окне до отключения
+GEMINI_BREAKER_COOLDOWN = float(os.getenv('GEMINI_BREAKER_COOLDOWN', '30'))  # Секунд до пробного запроса
+GEMINI_BREAKER_MAX_COOLDOWN = float(os.getenv('GEMINI_BREAKER_MAX_COOLDOWN', '600'))  # Предел паузы при повторных ошибках
+
+# Очередь выполнения оплаченных услуг
+FULFILMENT_CONCURRENCY = int(os.getenv('FULFILMENT_CONCURRENCY', '4'))  # Заказов одновременно на процесс
+FULFILMENT_MAX_ATTEMPTS = int(os.getenv('FULFILMENT_MAX_ATTEMPTS', '5'))  # Попыток до отказа
+FULFILMENT_RETRY_DELAY = float(os.getenv('FULFILMENT_RETRY_DELAY', '5'))  # Секунд до первого повтора, дальше вдвое больше
+FULFILMENT_MAX_RETRY_DELAY = float(os.getenv('FULFILMENT_MAX_RETRY_DELAY', '600'))  # Предел задержки повтора
+FULFILMENT_LEASE = float(os.getenv('FULFILMENT_LEASE', '300'))  # Секунд, после которых заказ упавшего воркера выполнит другой
+FULFILMENT_POLL_INTERVAL = float(os.getenv('FULFILMENT_POLL_INTERVAL', '5'))  # Секунд между проверками очереди
+
+# Потоковая выдача текста
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.5'))  # Секунд между правками сообщения
+
+# Отправка сообщений в Telegram
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '30'))  # Сообщений в секунду на бота
+TELEGRAM_CHAT_INTERVAL = float(os.getenv('TELEGRAM_CHAT_INTERVAL', '1'))  # Секунд между сообщениями в один чат
+TELEGRAM_SEND_RETRIES = int(os.getenv('TELEGRAM_SEND_RETRIES', '3'))  # Повторов после RetryAfter
+
+# Ограничение частоты запросов: "запросов/секунд"
+FLOOD_CONTROL_ENABLED = os.getenv('FLOOD_CONTROL_ENABLED', '1') == '1'
+FLOOD_DEFAULT_LIMIT = tuple(float(x) for x in os.getenv('FLOOD_DEFAULT_LIMIT', '30/60').split('/'))  # Обычные действия пользователя
+FLOOD_HEAVY_LIMIT = tuple(float(x) for x in os.getenv('FLOOD_HEAVY_LIMIT', '6/60').split('/'))  # Генерация и выставление счетов
+FLOOD_API_IP_LIMIT = tuple(float(x) for x in os.getenv('FLOOD_API_IP_LIMIT', '120/60').split('/'))  # Все запросы к API с одного IP
+FLOOD_TRUST_FORWARDED = os.getenv('FLOOD_TRUST_FORWARDED', '0') == '1'  # Брать IP из X-Forwarded-For
+
+# Кэш гороскопов
+HOROSCOPE_TIMEZONE = os.getenv('HOROSCOPE_TIMEZONE', 'Europe/Moscow')  # Часовой пояс для смены дня
+HOROSCOPE_CACHE_SIZE = int(os.getenv('HOROSCOPE_CACHE_SIZE', '256'))  # Записей в памяти
+HOROSCOPE_CACHE_TTL = int(os.getenv('HOROSCOPE_CACHE_TTL', str(36 * 3600)))  # Секунд
+HOROSCOPE_CACHE_PERSIST = os.getenv('HOROSCOPE_CACHE_PERSIST', '1') == '1'  # Хранить кэш в SQLite
+
+# Расклады Таро
+TAROT_SEEDED_READINGS = os.getenv('TAROT_SEEDED_READINGS', '1') == '1'  # Карты зависят от пользователя, дня, вопроса и оплаты
+TAROT_CACHE_SIZE = int(os.getenv('TAROT_CACHE_SIZE', '512'))  # Толкований в памяти
+TAROT_CACHE_TTL = int(os.getenv('TAROT_CACHE_TTL', str(7 * 24 * 3600)))  # Секунд
+TAROT_CACHE_PERSIST = os.getenv('TAROT_CACHE_PERSIST', '1') == '1'  # Хранить толкования в SQLite
+TAROT_FRAGMENTS_ENABLED = os.getenv('TAROT_FRAGMENTS_ENABLED', '1') == '1'  # Заранее толковать карты по позициям
+TAROT_FRAGMENT_SPREADS = os.getenv('TAROT_FRAGMENT_SPREADS', 'daily,three,four,celtic').split(',')  # Расклады для заполнения
+
+# Заблаговременная генерация гороскопов
+PREGENERATION_ENABLED = os.getenv('PREGENERATION_ENABLED', '1') == '1'
+PREGENERATION_WINDOW = int(os.getenv('PREGENERATION_WINDOW', '60'))  # Минут до полуночи
+PREGENERATION_CONCURRENCY = int(os.getenv('PREGENERATION_CONCURRENCY', '2'))  # Параллельных генераций
+PREGENERATION_INTERVAL = float(os.getenv('PREGENERATION_INTERVAL', '2'))  # Секунд между запусками
+PREGENERATION_RETRIES = int(os.getenv('PREGENERATION_RETRIES', '3'))  # Попыток на один знак
+
+# Матрица совместимости знаков
+COMPATIBILITY_MATRIX_ENABLED = os.getenv('COMPATIBILITY_MATRIX_ENABLED', '1') == '1'
+COMPATIBILITY_VARIANTS = int(os.getenv('COMPATIBILITY_VARIANTS', '3'))  # Вариантов текста на пару
+COMPATIBILITY_REFRESH_INTERVAL = int(os.getenv('COMPATIBILITY_REFRESH_INTERVAL', str(6 * 3600)))  # Секунд
+COMPATIBILITY_REFRESH_BATCH = int(os.getenv('COMPATIBILITY_REFRESH_BATCH', '6'))  # Вариантов за обновление
+
 # Проверяем обязательные переменные
 if not BOT_TOKEN:
     print("❌ ОШИБКА: BOT_TOKEN не найден в .env файле")
@@ -1,204 +1,535 @@
+import asyncio
 import sqlite3
 import logging
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
+from typing import NamedTuple, Optional
+
+from migrations import run_migrations
+from config import (
+    DB_PATH,
+    DB_POOL_SIZE,
+    DB_CACHE_SIZE_KB,
+    DB_MMAP_SIZE,
+    DB_STATEMENT_CACHE,
+    REQUEST_LOG_BATCH_SIZE,
+    REQUEST_LOG_FLUSH_INTERVAL,
+    REQUEST_LOG_MAX_BUFFER,
+    USER_CACHE_SIZE,
+    USER_CACHE_TTL
+)
+
+class ChargeResult(NamedTuple):
+    """
+    Результат списания: успех, баланс после операции, повтор по ключу
+    идемпотентности, ключ операции для возврата, отказ из-за того, что ключ
+    уже использован для другой услуги, суммы или возвращенного списания,
+    отказ из-за ошибки БД - баланс в этом случае неизвестен, и для повтора -
+    сохраненный ответ первого запроса (None, пока он не выполнен).
+    """
+    success: bool
+    balance: int
+    duplicate: bool = False
+    key: Optional[str] = None
+    conflict: bool = False
+    error: bool = False
+    result: Optional[str] = None
+
+class ConnectionPool:
+    """Пул соединений SQLite: запросы выполняются в потоках, не блокируя event loop"""
+
+    def __init__(self, db_path, size=DB_POOL_SIZE):
+        self.db_path = db_path
+        self.size = max(1, size)
+        self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="sqlite")
+        self._idle = asyncio.Queue()
+        self._created = 0
+        self._connections = []
+
+    def _connect(self):
+        """Новое соединение с настроенными PRAGMA"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=30,
+            check_same_thread=False,  # Соединение используется одним потоком за раз
+            cached_statements=DB_STATEMENT_CACHE
+        )
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA cache_size=-{DB_CACHE_SIZE_KB}')
+        conn.execute(f'PRAGMA mmap_size={DB_MMAP_SIZE}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA busy_timeout=30000')
+        return conn
+
+    async def _acquire(self):
+        """Взять свободное соединение или создать новое в пределах размера пула"""
+        if self._idle.empty() and self._created < self.size:
+            self._created += 1
+            try:
+                loop = asyncio.get_running_loop()
+                conn = await loop.run_in_executor(self._executor, self._connect)
+            except BaseException:
+                self._created -= 1
+                raise
+            self._connections.append(conn)
+            return conn
+        return await self._idle.get()
+
+    def _release(self, conn, future=None):
+        """Вернуть соединение в пул"""
+        self._idle.put_nowait(conn)
+
+    async def run(self, func, *args):
+        """Выполнить func(conn, *args) в потоке пула"""
+        conn = await self._acquire()
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, partial(func, conn, *args))
+        try:
+            result = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Поток еще работает с соединением - вернем его в пул по завершении
+            future.add_done_callback(partial(self._release, conn))
+            raise
+        except BaseException:
+            self._release(conn)
+            raise
+        self._release(conn)
+        return result
+
+    async def close(self):
+        """Дождаться завершения запросов и закрыть все соединения пула"""
+        for _ in range(len(self._connections)):
+            await self._idle.get()
+        for conn in self._connections:
+            conn.close()
+        self._connections.clear()
+        self._created = 0
+
+class RequestLogWriter:
+    """Отложенная пакетная запись бесплатных запросов в статистику"""
+
+    def __init__(self, pool, batch_size=REQUEST_LOG_BATCH_SIZE,
+                 flush_interval=REQUEST_LOG_FLUSH_INTERVAL, max_buffer=REQUEST_LOG_MAX_BUFFER):
+        self.pool = pool
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        # Заполненный буфер заставляет вызывающих ждать записи
+        self._queue = asyncio.Queue(maxsize=max_buffer)
+        self._batch_ready = asyncio.Event()
+        self._task = None
+
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+
+    def start(self):
+        """Запуск фоновой записи"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановка с записью всего накопленного"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def add(self, telegram_id, service_type, cost=0):
+        """Поставить строку статистики в очередь на запись"""
+        row = (telegram_id, service_type, cost, datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'))
+        
+        if self._task is None:
+            # Фоновая запись не запущена - пишем сразу
+            await self._write([row])
+            return
+        
+        await self._queue.put(row)
+        if self._queue.qsize() >= self.batch_size:
+            self._batch_ready.set()
+
+    async def _run(self):
+        """Запись по заполнению пакета или по таймеру"""
+        while True:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Записать все накопленные строки пакетами"""
+        while not self._queue.empty():
+            batch = []
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            await self._write(batch)
+
+    async def _write(self, batch):
+        """Записать пакет одной транзакцией"""
+        def run(conn):
+            with conn:
+                conn.executemany('''
+                    INSERT INTO requests (user_id, service_type, cost, request_date)
+                    VALUES (?, ?, ?, ?)
+                ''', batch)
+
+        try:
+            await self.pool.run(run)
+            self.written += len(batch)
+            self.batches += 1
+        except sqlite3.Error as e:
+            self.dropped += len(batch)
+            logging.error(f"Ошибка пакетной записи статистики ({len(batch)} строк): {e}")
+
+    def get_stats(self):
+        """Статистика отложенной записи"""
+        return {
+            "buffered": self._queue.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped
+        }
+
+class UserCache:
+    """Кэш профилей пользователей (баланс, знак, подписка) с вытеснением LRU"""
+
+    def __init__(self, max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        # telegram_id -> (expires_at, профиль или None для неизвестного пользователя)
+        self._entries = OrderedDict()
+        # Растет при каждом изменении: загрузка, начатая до изменения, не попадет в кэш
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, telegram_id):
+        """(найдено, профиль)"""
+        entry = self._entries.get(telegram_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(telegram_id)
+            self.hits += 1
+            return True, entry[1]
+        if entry is not None:
+            del self._entries[telegram_id]
+        self.misses += 1
+        return False, None
+
+    def put(self, telegram_id, profile, generation):
+        """Сохранить загруженный профиль, если он не устарел за время загрузки"""
+        if self.max_size <= 0 or generation != self.generation:
+            return
+        self._entries[telegram_id] = (time.monotonic() + self.ttl, profile)
+        self._entries.move_to_end(telegram_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def update(self, telegram_id, **fields):
+        """Обновить поля закэшированного профиля"""
+        self.generation += 1
+        entry = self._entries.get(telegram_id)
+        if entry is not None and entry[1] is not None:
+            entry[1].update(fields)
+
+    def invalidate(self, telegram_id):
+        """Удалить профиль из кэша"""
+        self.generation += 1
+        self._entries.pop(telegram_id, None)
+
+    def get_stats(self):
+        """Статистика попаданий в кэш"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
 
 class Database:
-    def __init__(self, db_path='zodiac_bot.db'):
+    def __init__(self, db_path=DB_PATH):
         self.db_path = db_path
+        self.pool = ConnectionPool(db_path)
+        self.request_log = RequestLogWriter(self.pool)
+        self.user_cache = UserCache()
         self.init_db()
 
     def init_db(self):
-        """Инициализация базы данных"""
+        """Инициализация базы данных: применение миграций схемы"""
         try:
             with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Таблица пользователей
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS users (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        telegram_id INTEGER UNIQUE NOT NULL,
-                        username TEXT,
-                        first_name TEXT,
-                        last_name TEXT,
-                        zodiac_sign TEXT,
-                        birth_date TEXT,
-                        birth_time TEXT,
-                        birth_place TEXT,
-                        balance INTEGER DEFAULT 0,
-                        subscription_type TEXT DEFAULT 'free',
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-                
-                # Таблица платежей
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS payments (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER NOT NULL,
-                        service_type TEXT NOT NULL,
-                        amount_stars INTEGER NOT NULL,
-                        status TEXT DEFAULT 'completed',
-                        payment_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        payment_data TEXT,
-                        FOREIGN KEY (user_id) REFERENCES users (telegram_id)
-                    )
-                ''')
-                
-                # Таблица запросов (для статистики)
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS requests (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER NOT NULL,
-                        service_type TEXT NOT NULL,
-                        request_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        cost INTEGER DEFAULT 0,
-                        FOREIGN KEY (user_id) REFERENCES users (telegram_id)
-                    )
-                ''')
-                
-                # Таблица истории операций
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS transactions (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER NOT NULL,
-                        type TEXT NOT NULL,
-                        amount INTEGER NOT NULL,
-                        description TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (user_id) REFERENCES users (telegram_id)
-                    )
-                ''')
-                
-                conn.commit()
-                logging.info("База данных успешно инициализирована")
+                version = run_migrations(conn)
+                logging.info(f"База данных успешно инициализирована (версия схемы {version})")
                 
         except sqlite3.Error as e:
             logging.error(f"Ошибка инициализации БД: {e}")
 
     def get_connection(self):
-        """Получить соединение с БД"""
+        """Получить соединение с БД (синхронно, для инициализации и скриптов)"""
         return sqlite3.connect(self.db_path)
 
-    def add_user(self, telegram_id, username, first_name, last_name):
+    async def execute(self, query, params=()):
+        """Выполнить запрос с фиксацией, вернуть число измененных строк"""
+        def run(conn):
+            with conn:
+                return conn.execute(query, params).rowcount
+        return await self.pool.run(run)
+
+    async def fetchone(self, query, params=()):
+        """Выполнить запрос и вернуть одну строку"""
+        return await self.pool.run(lambda conn: conn.execute(query, params).fetchone())
+
+    async def fetchall(self, query, params=()):
+        """Выполнить запрос и вернуть все строки"""
+        return await self.pool.run(lambda conn: conn.execute(query, params).fetchall())
+
+    async def close(self):
+        """Дописать статистику и закрыть соединения пула"""
+        await self.request_log.stop()
+        await self.pool.close()
+
+    async def add_user(self, telegram_id, username, first_name, last_name):
         """Добавить пользователя с начальным балансом"""
         try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT OR IGNORE INTO users 
-                    (telegram_id, username, first_name, last_name, balance) 
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (telegram_id, username, first_name, last_name, 100))
-                conn.commit()
-                return True
+            await self.execute('''
+                INSERT OR IGNORE INTO users 
+                (telegram_id, username, first_name, last_name, balance) 
+                VALUES (?, ?, ?, ?, ?)
+            ''', (telegram_id, username, first_name, last_name, 100))
+            self.user_cache.invalidate(telegram_id)
+            return True
         except sqlite3.Error as e:
             logging.error(f"Ошибка добавления пользователя: {e}")
             return False
 
-    def get_user(self, telegram_id):
+    async def get_user(self, telegram_id):
         """Получить данные пользователя"""
         try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT * FROM users WHERE telegram_id = ?
-                ''', (telegram_id,))
-                return cursor.fetchone()
+            return await self.fetchone('''
+                SELECT * FROM users WHERE telegram_id = ?
+            ''', (telegram_id,))
         except sqlite3.Error as e:
             logging.error(f"Ошибка получения пользователя: {e}")
             return None
 
-    def get_user_balance(self, telegram_id):
-        """Получить баланс пользователя"""
+    async def get_user_profile(self, telegram_id):
+        """Профиль пользователя из кэша или одной выборкой из БД"""
+        found, profile = self.user_cache.get(telegram_id)
+        if found:
+            return dict(profile) if profile else None
+        
+        generation = self.user_cache.generation
         try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT balance FROM users WHERE telegram_id = ?
-                ''', (telegram_id,))
-                result = cursor.fetchone()
-                return result[0] if result else 0
+            row = await self.fetchone('''
+                SELECT first_name, zodiac_sign, balance, subscription_type
+                FROM users WHERE telegram_id = ?
+            ''', (telegram_id,))
         except sqlite3.Error as e:
-            logging.error(f"Ошибка получения баланса: {e}")
-            return 0
+            logging.error(f"Ошибка получения профиля: {e}")
+            return None
+        
+        profile = None
+        if row:
+            profile = {
+                "first_name": row[0],
+                "zodiac_sign": row[1],
+                "balance": row[2],
+                "subscription_type": row[3]
+            }
+        self.user_cache.put(telegram_id, profile, generation)
+        return dict(profile) if profile else None
+
+    async def get_user_balance(self, telegram_id):
+        """Получить баланс пользователя"""
+        profile = await self.get_user_profile(telegram_id)
+        return profile["balance"] if profile else 0
 
-    def update_balance(self, telegram_id, amount):
+    async def update_balance(self, telegram_id, amount):
         """Обновить баланс пользователя"""
         try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    UPDATE users SET balance = balance + ?, updated_at = CURRENT_TIMESTAMP
-                    WHERE telegram_id = ?
-                ''', (amount, telegram_id))
-                conn.commit()
-                return True
+            await self.execute('''
+                UPDATE users SET balance = balance + ?, updated_at = CURRENT_TIMESTAMP
+                WHERE telegram_id = ?
+            ''', (amount, telegram_id))
+            self.user_cache.invalidate(telegram_id)
+            return True
         except sqlite3.Error as e:
             logging.error(f"Ошибка обновления баланса: {e}")
             return False
 
-    def log_request(self, telegram_id, service_type, cost=0):
+    async def log_request(self, telegram_id, service_type, cost=0):
         """Записать запрос в статистику"""
-        try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
+        if telegram_id is None:
+            logging.error(f"Ошибка записи запроса: не указан пользователь ({service_type})")
+            return False
+        
+        # Бесплатные запросы пишутся пакетами в фоне, платные - сразу и надежно
+        if cost <= 0:
+            await self.request_log.add(telegram_id, service_type, cost)
+            return True
+        
+        result = await self.charge(telegram_id, service_type, cost)
+        return result.success
+
+    async def charge(self, telegram_id, service_type, cost, idempotency_key=None):
+        """Атомарно списать стоимость услуги и записать запрос и операцию"""
+        # Без ключа от клиента операция все равно получает ключ - по нему делается возврат
+        key = idempotency_key if idempotency_key is not None else uuid.uuid4().hex
+        
+        def run(conn):
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                
+                # Ключ действует только для своего пользователя
+                existing = conn.execute('''
+                    SELECT service_type, amount, result FROM transactions
+                    WHERE user_id = ? AND idempotency_key = ? AND type = 'spend'
+                ''', (telegram_id, key)).fetchone()
+                if existing:
+                    balance = conn.execute('''
+                        SELECT balance FROM users WHERE telegram_id = ?
+                    ''', (telegram_id,)).fetchone()
+                    balance = balance[0] if balance else 0
+                    refunded = conn.execute('''
+                        SELECT 1 FROM transactions WHERE user_id = ? AND idempotency_key = ?
+                    ''', (telegram_id, f"{key}:refund")).fetchone()
+                    # Повтор того же запроса не списывает повторно; ключ другой услуги
+                    # или уже возвращенного списания использовать нельзя
+                    if refunded or tuple(existing[:2]) != (service_type, cost):
+                        return ChargeResult(False, balance, key=key, conflict=True)
+                    return ChargeResult(True, balance, True, key, result=existing[2])
+                
+                row = conn.execute('''
+                    UPDATE users SET balance = balance - ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE telegram_id = ? AND balance >= ?
+                    RETURNING balance
+                ''', (cost, telegram_id, cost)).fetchone()
+                
+                if row is None:
+                    current = conn.execute('''
+                        SELECT balance FROM users WHERE telegram_id = ?
+                    ''', (telegram_id,)).fetchone()
+                    return ChargeResult(False, current[0] if current else 0, key=key)
+                
+                conn.execute('''
                     INSERT INTO requests (user_id, service_type, cost) 
                     VALUES (?, ?, ?)
                 ''', (telegram_id, service_type, cost))
+                conn.execute('''
+                    INSERT INTO transactions (user_id, type, amount, description, idempotency_key, service_type)
+                    VALUES (?, 'spend', ?, ?, ?, ?)
+                ''', (telegram_id, cost, f"Оплата услуги: {service_type}", key, service_type))
                 
-                # Если услуга платная, списываем средства
-                if cost > 0:
-                    cursor.execute('''
-                        UPDATE users SET balance = balance - ? 
-                        WHERE telegram_id = ? AND balance >= ?
-                    ''', (cost, telegram_id, cost))
-                    
-                    # Логируем транзакцию
-                    cursor.execute('''
-                        INSERT INTO transactions (user_id, type, amount, description)
-                        VALUES (?, 'spend', ?, ?)
-                    ''', (telegram_id, cost, f"Оплата услуги: {service_type}"))
+                return ChargeResult(True, row[0], key=key)
+
+        try:
+            result = await self.pool.run(run)
+        except sqlite3.Error as e:
+            logging.error(f"Ошибка списания средств: {e}")
+            self.user_cache.invalidate(telegram_id)
+            return ChargeResult(False, 0, key=key, error=True)
+        
+        # Баланс после списания известен - обновляем кэш без повторного чтения
+        self.user_cache.update(telegram_id, balance=result.balance)
+        return result
+
+    async def save_charge_result(self, telegram_id, idempotency_key, result):
+        """Сохранить ответ на оплаченный запрос: повтор с тем же ключом получит его без генерации"""
+        try:
+            await self.execute('''
+                UPDATE transactions SET result = ?
+                WHERE user_id = ? AND idempotency_key = ? AND type = 'spend'
+            ''', (result, telegram_id, idempotency_key))
+            return True
+        except sqlite3.Error as e:
+            logging.error(f"Ошибка сохранения ответа на оплаченный запрос: {e}")
+            return False
+
+    async def refund(self, telegram_id, amount, service_type, idempotency_key):
+        """
+        Вернуть средства за непредоставленную услугу. idempotency_key - ключ
+        списания (ChargeResult.key); без списания с тем же пользователем,
+        услугой и суммой возврат не делается.
+        """
+        if idempotency_key is None:
+            logging.error(f"Возврат без ключа списания отклонен: {telegram_id}, {service_type}")
+            return False
+        refund_key = f"{idempotency_key}:refund"
+        
+        def run(conn):
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
                 
-                conn.commit()
+                charged = conn.execute('''
+                    SELECT 1 FROM transactions
+                    WHERE user_id = ? AND idempotency_key = ? AND type = 'spend'
+                      AND service_type = ? AND amount = ?
+                ''', (telegram_id, idempotency_key, service_type, amount)).fetchone()
+                if not charged:
+                    logging.error(f"Возврат отклонен: нет списания {amount} за {service_type} у {telegram_id}")
+                    return False
+                
+                existing = conn.execute('''
+                    SELECT 1 FROM transactions WHERE user_id = ? AND idempotency_key = ?
+                ''', (telegram_id, refund_key)).fetchone()
+                if existing:
+                    return True
+                
+                conn.execute('''
+                    UPDATE users SET balance = balance + ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE telegram_id = ?
+                ''', (amount, telegram_id))
+                conn.execute('''
+                    INSERT INTO transactions (user_id, type, amount, description, idempotency_key, service_type)
+                    VALUES (?, 'refund', ?, ?, ?, ?)
+                ''', (telegram_id, amount, f"Возврат за услугу: {service_type}", refund_key, service_type))
                 return True
+
+        try:
+            return await self.pool.run(run)
         except sqlite3.Error as e:
-            logging.error(f"Ошибка записи запроса: {e}")
+            logging.error(f"Ошибка возврата средств: {e}")
             return False
+        finally:
+            self.user_cache.invalidate(telegram_id)
 
-    def get_user_requests(self, telegram_id, limit=10):
+    async def get_user_requests(self, telegram_id, limit=10):
         """Получить историю запросов пользователя"""
         try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT service_type, request_date, cost 
-                    FROM requests 
-                    WHERE user_id = ? 
-                    ORDER BY request_date DESC 
-                    LIMIT ?
-                ''', (telegram_id, limit))
-                return cursor.fetchall()
+            return await self.fetchall('''
+                SELECT service_type, request_date, cost 
+                FROM requests 
+                WHERE user_id = ? 
+                ORDER BY request_date DESC 
+                LIMIT ?
+            ''', (telegram_id, limit))
         except sqlite3.Error as e:
             logging.error(f"Ошибка получения истории запросов: {e}")
             return []
 
-    def update_user_zodiac(self, telegram_id, zodiac_sign):
+    async def update_user_zodiac(self, telegram_id, zodiac_sign):
         """Обновить знак зодиака пользователя"""
         try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    UPDATE users SET zodiac_sign = ?, updated_at = CURRENT_TIMESTAMP
-                    WHERE telegram_id = ?
-                ''', (zodiac_sign, telegram_id))
-                conn.commit()
-                return True
+            await self.execute('''
+                UPDATE users SET zodiac_sign = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE telegram_id = ?
+            ''', (zodiac_sign, telegram_id))
+            self.user_cache.update(telegram_id, zodiac_sign=zodiac_sign)
+            return True
         except sqlite3.Error as e:
             logging.error(f"Ошибка обновления знака зодиака: {e}")
             return False
 
 # Создаем глобальный экземпляр БД
-db = Database()
\ No newline at end of file
+db = Database()
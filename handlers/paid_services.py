@@ -57,7 +57,7 @@ async def process_first_sign(callback: CallbackQuery, state: FSMContext):
     except Exception as e:
         logger.error(f"❌ Ошибка в process_first_sign: {e}")
 
-@router.callback_query(F.data.startswith("compat_second_"))
+@router.callback_query(F.data.startswith("compat_second_"), flags={"rate_limit": "heavy"})
 async def process_second_sign(callback: CallbackQuery, state: FSMContext):
     """Обработчик второго знака с отправкой инвойса"""
     try:
@@ -111,7 +111,7 @@ async def weekly_horoscope_handler(message: Message):
     except Exception as e:
         logger.error(f"❌ Ошибка в weekly_horoscope_handler: {e}")
 
-@router.callback_query(F.data.startswith("weekly_paid_"))
+@router.callback_query(F.data.startswith("weekly_paid_"), flags={"rate_limit": "heavy"})
 async def process_weekly_horoscope(callback: CallbackQuery):
     """Обработчик недельного гороскопа с отправкой инвойса"""
     try:
@@ -157,7 +157,7 @@ async def tarot_handler(message: Message):
         logger.error(f"❌ Ошибка в tarot_handler: {e}")
         await message.answer("❌ Произошла ошибка. Попробуйте позже.")
 
-@router.callback_query(F.data.startswith("tarot_"))
+@router.callback_query(F.data.startswith("tarot_"), flags={"rate_limit": "heavy"})
 async def process_tarot_spread(callback: CallbackQuery):
     """Обработчик расклада Таро с отправкой инвойса"""
     try:
@@ -238,7 +238,7 @@ async def process_birth_time(message: Message, state: FSMContext):
     await state.set_state(NatalChartStates.waiting_birth_place)
     await message.answer("✅ Время сохранено. Теперь введите место рождения (город, страна):")
 
-@router.message(NatalChartStates.waiting_birth_place)
+@router.message(NatalChartStates.waiting_birth_place, flags={"rate_limit": "heavy"})
 async def process_birth_place(message: Message, state: FSMContext):
     """Обработка места рождения и отправка инвойса"""
     birth_place = message.text.strip()
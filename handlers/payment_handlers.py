@@ -1,13 +1,19 @@
 # handlers/payment_handlers.py
-from aiogram import Router, F
+from aiogram import Bot, Router, F
 from aiogram.types import Message, PreCheckoutQuery, SuccessfulPayment
 from aiogram.filters import Command
+from aiogram.fsm.context import FSMContext
+from datetime import date
+from typing import AsyncIterator, Optional
 import logging
 
 from database import db
-from services.stars_payment_service import stars_payment_service
+from services.fulfilment_queue import FulfilmentJob, fulfilment_queue
 from services.gemini_service import gemini_service
-from services.tarot_deck import tarot_deck
+from services.tarot_deck import tarot_deck, today
+from services.tarot_interpretations import tarot_interpretations
+from services.compatibility_matrix import compatibility_matrix
+from utils.message_utils import ThrottledMessageEditor, message_sender
 
 logger = logging.getLogger(__name__)
 
@@ -24,108 +30,160 @@ async def pre_checkout_handler(pre_checkout_query: PreCheckoutQuery):
         logger.error(f"❌ Ошибка pre-checkout: {e}")
         await pre_checkout_query.answer(ok=False, error_message="Ошибка обработки платежа")
 
-@router.message(F.successful_payment)
-async def successful_payment_handler(message: Message):
-    """Обработчик успешного платежа"""
+# Подтверждение оплаты от Telegram не ограничиваем
+@router.message(F.successful_payment, flags={"rate_limit": False})
+async def successful_payment_handler(message: Message, state: FSMContext):
+    """Обработчик успешного платежа: услуга ставится в очередь, генерация идет вне обработчика"""
     try:
         payment = message.successful_payment
         user_id = message.from_user.id
         
         logger.info(f"💰 Успешный платеж: {payment.total_amount} Stars от пользователя {user_id}")
         
-        # Обрабатываем платеж в сервисе
-        success = await stars_payment_service.process_successful_payment(
-            user_id, 
-            payment.invoice_payload, 
-            payment.total_amount
+        # Данные рождения собраны до оплаты и лежат в состоянии FSM
+        params = {}
+        service_type = payment.invoice_payload.split("_")[0]
+        if service_type == "natal":
+            user_data = await state.get_data()
+            params["birth_data"] = user_data.get("birth_data", {})
+            await state.clear()
+        elif service_type == "tarot":
+            # День оплаты: повтор заказа после полуночи даст тот же расклад
+            params["day"] = today().isoformat()
+        
+        # Повторное уведомление о том же платеже заказ не дублирует
+        job_id, created = await fulfilment_queue.enqueue(
+            charge_id=payment.telegram_payment_charge_id,
+            user_id=user_id,
+            chat_id=message.chat.id,
+            payload=payment.invoice_payload,
+            amount=payment.total_amount,
+            params=params
         )
         
-        if success:
-            # Предоставляем услугу в зависимости от типа
-            await provide_paid_service(user_id, payment.invoice_payload, message)
-        else:
-            await message.answer("❌ Ошибка при обработке платежа. Обратитесь в поддержку.")
+        if created:
+            await message.answer(
+                f"✅ Оплата получена! Готовлю услугу, результат придет в этот чат.\n"
+                f"<i>Номер заказа: {job_id}</i>"
+            )
             
     except Exception as e:
         logger.error(f"❌ Ошибка обработки успешного платежа: {e}")
         await message.answer("❌ Произошла ошибка. Обратитесь в поддержку.")
 
-async def provide_paid_service(user_id: int, payload: str, message: Message):
-    """Предоставление оплаченной услуги"""
-    try:
-        parts = payload.split("_")
-        service_type = parts[0]
-        
-        if service_type == "compatibility":
-            if len(parts) >= 3:
-                sign1 = parts[1]
-                sign2 = parts[2]
-                compatibility_text = await gemini_service.generate_compatibility(sign1, sign2)
-                
-                await message.answer(
-                    f"💑 <b>Совместимость: {sign1} и {sign2}</b>\n\n"
-                    f"{compatibility_text}\n\n"
-                    f"<i>✅ Услуга оплачена • 55 Stars</i>"
-                )
-                
-        elif service_type == "weekly_horoscope":
-            if len(parts) >= 2:
-                zodiac_sign = parts[1]
-                horoscope_text = await gemini_service.generate_weekly_horoscope(zodiac_sign)
-                
-                await message.answer(
-                    f"📅 <b>Гороскоп на неделю для {zodiac_sign}</b>\n\n"
-                    f"{horoscope_text}\n\n"
-                    f"<i>✅ Услуга оплачена • 333 Stars</i>"
-                )
-                
-        elif service_type == "tarot":
-            if len(parts) >= 2:
-                spread_type = parts[1]
-                
-                spread_names = {
-                    "celtic": "Кельтский крест",
-                    "three": "Прошлое-Настоящее-Будущее", 
-                    "four": "Ситуация-Вызовы-Совет-Результат",
-                    "daily": "Карта дня"
-                }
-                
-                spread_name = spread_names.get(spread_type, "Выбранный расклад")
-                
-                cards, positions = tarot_deck.create_spread(spread_type)
-                
-                # Форматируем результат
-                cards_text = "🎴 Ваш расклад:\n\n"
-                for i, card in enumerate(cards):
-                    position_name = positions[i] if i < len(positions) else f"Позиция {i+1}"
-                    orientation = "🔼" if card["position"] == "upright" else "🔽"
-                    cards_text += f"{orientation} <b>{position_name}:</b>\n"
-                    cards_text += f"   🃏 {card['name']}\n"
-                    cards_text += f"   📖 {tarot_deck.get_card_meaning(card)}\n\n"
-                
-                interpretation = await gemini_service.generate_tarot_reading(spread_type, "")
-                
-                full_content = f"{cards_text}\n💫 <b>Интерпретация:</b>\n\n{interpretation}"
-                
-                await message.answer(
-                    f"🃏 <b>{spread_name}</b>\n\n"
-                    f"{full_content}\n\n"
-                    f"<i>✅ Услуга оплачена • 888 Stars</i>"
-                )
-                
-        elif service_type == "natal":
-            # Для натальной карты нужно получить данные из базы или запросить заново
-            natal_chart_text = await gemini_service.generate_natal_chart_interpretation({})
+async def deliver_stream(bot: Bot, job: FulfilmentJob, header: str, footer: str, progress: str,
+                         chunks: AsyncIterator[str]) -> str:
+    """
+    Доставка длинного текста. Первая попытка показывает заглушку и дописывает
+    ее по мере генерации; повтор заглушку заново не шлет - пользователь получает
+    только итоговый текст. Перед каждой отправкой проверяется, что заказ все еще
+    за этой попыткой.
+    """
+    await fulfilment_queue.ensure_owner(job)
+    if job.attempts == 1:
+        placeholder = await message_sender.send(bot, job.chat_id, f"{header}<em>{progress}</em>")
+        editor = ThrottledMessageEditor(placeholder, header=header, footer=footer)
+        return await editor.stream(chunks)
+
+    text = "".join([chunk async for chunk in chunks])
+    await fulfilment_queue.ensure_owner(job)
+    await message_sender.send_text(bot, job.chat_id, f"{header}{text}{footer}")
+    return text
+
+async def fulfil_paid_service(bot: Bot, job: FulfilmentJob) -> Optional[str]:
+    """
+    Генерация и доставка оплаченной услуги воркером очереди.
+    Ошибка пробрасывается - очередь повторит заказ.
+    """
+    parts = job.payload.split("_")
+    service_type = parts[0]
+    
+    if service_type == "compatibility":
+        if len(parts) >= 3:
+            sign1 = parts[1]
+            sign2 = parts[2]
+            compatibility_text = await compatibility_matrix.get(sign1, sign2)
             
-            await message.answer(
-                f"🌌 <b>Ваша натальная карта</b>\n\n"
-                f"{natal_chart_text}\n\n"
-                f"<i>✅ Услуга оплачена • 999 Stars</i>"
+            await fulfilment_queue.ensure_owner(job)
+            await message_sender.send_text(
+                bot,
+                job.chat_id,
+                f"💑 <b>Совместимость: {sign1} и {sign2}</b>\n\n"
+                f"{compatibility_text}\n\n"
+                f"<i>✅ Услуга оплачена • 55 Stars</i>"
             )
+            return compatibility_text
             
-    except Exception as e:
-        logger.error(f"❌ Ошибка предоставления услуги: {e}")
-        await message.answer("❌ Ошибка при предоставлении услуги. Обратитесь в поддержку.")
+    elif service_type == "weekly_horoscope":
+        if len(parts) >= 2:
+            zodiac_sign = parts[1]
+            header = f"📅 <b>Гороскоп на неделю для {zodiac_sign}</b>\n\n"
+            
+            # Длинный текст показываем по мере генерации
+            return await deliver_stream(
+                bot, job, header,
+                footer="\n\n<i>✅ Услуга оплачена • 333 Stars</i>",
+                progress="Составляю прогноз...",
+                chunks=gemini_service.stream_weekly_horoscope(zodiac_sign)
+            )
+            
+    elif service_type == "tarot":
+        if len(parts) >= 2:
+            spread_type = parts[1]
+            
+            spread_names = {
+                "celtic": "Кельтский крест",
+                "three": "Прошлое-Настоящее-Будущее", 
+                "four": "Ситуация-Вызовы-Совет-Результат",
+                "daily": "Карта дня"
+            }
+            
+            spread_name = spread_names.get(spread_type, "Выбранный расклад")
+            
+            day = date.fromisoformat(job.params["day"]) if "day" in job.params else None
+            cards, positions = tarot_deck.create_reading(spread_type, job.user_id, day, purchase=job.charge_id)
+            
+            # Форматируем результат
+            cards_text = "🎴 Ваш расклад:\n\n"
+            for i, card in enumerate(cards):
+                position_name = positions[i] if i < len(positions) else f"Позиция {i+1}"
+                orientation = "🔼" if card.position == "upright" else "🔽"
+                cards_text += f"{orientation} <b>{position_name}:</b>\n"
+                cards_text += f"   🃏 {card.name}\n"
+                cards_text += f"   📖 {tarot_deck.get_card_meaning(card)}\n\n"
+            
+            header = f"🃏 <b>{spread_name}</b>\n\n{cards_text}\n💫 <b>Интерпретация:</b>\n\n"
+            
+            # Карты видны сразу, интерпретация дописывается по мере генерации
+            interpretation = await deliver_stream(
+                bot, job, header,
+                footer="\n\n<i>✅ Услуга оплачена • 888 Stars</i>",
+                progress="Толкую расклад...",
+                chunks=tarot_interpretations.stream(spread_type, cards, positions)
+            )
+            return f"{cards_text}{interpretation}"
+            
+    elif service_type == "natal":
+        header = "🌌 <b>Ваша натальная карта</b>\n\n"
+        
+        return await deliver_stream(
+            bot, job, header,
+            footer="\n\n<i>✅ Услуга оплачена • 999 Stars</i>",
+            progress="Составляю натальную карту...",
+            chunks=gemini_service.stream_natal_chart_interpretation(job.params.get("birth_data", {}))
+        )
+    
+    logger.warning(f"⚠️ Неизвестная услуга в заказе {job.id}: {job.payload}")
+    return None
+
+async def notify_fulfilment_failed(bot: Bot, job: FulfilmentJob, error: str):
+    """Сообщение пользователю, если все попытки выполнить заказ исчерпаны"""
+    await message_sender.send(
+        bot,
+        job.chat_id,
+        f"❌ Ошибка при предоставлении услуги. Обратитесь в поддержку.\n"
+        f"<i>Номер заказа: {job.id}</i>"
+    )
 
 @router.message(Command("balance"))
 async def check_balance(message: Message):
@@ -10,6 +10,7 @@ import logging
 from database import db
 from keyboards import main_menu, zodiac_keyboard, web_app_keyboard, get_webapp_url
 from services.gemini_service import gemini_service
+from utils.message_utils import ThrottledMessageEditor
 
 # УБЕДИТЕСЬ ЧТО ЭТИХ СТРОК НЕТ:
 # from .paid_services import router as paid_router
@@ -27,14 +28,14 @@ async def cmd_start(message: Message):
     """Обработчик команды /start"""
     
     # Добавляем пользователя в БД
-    db.add_user(
+    await db.add_user(
         telegram_id=message.from_user.id,
         username=message.from_user.username,
         first_name=message.from_user.first_name,
         last_name=message.from_user.last_name
     )
     
-    user_balance = db.get_user_balance(message.from_user.id)
+    user_balance = await db.get_user_balance(message.from_user.id)
     
     welcome_text = f"""
 🌟 <b>Добро пожаловать в АстроБот!</b> 🌟
@@ -76,14 +77,14 @@ async def daily_horoscope_handler(message: Message, state: FSMContext):
     """Обработчик ежедневного гороскопа"""
     
     # Логируем запрос
-    db.log_request(message.from_user.id, "daily_horoscope")
+    await db.log_request(message.from_user.id, "daily_horoscope")
     
     await message.answer(
         "Выберите ваш знак зодиака:",
         reply_markup=zodiac_keyboard("horoscope")
     )
 
-@router.callback_query(F.data.startswith("horoscope_"))
+@router.callback_query(F.data.startswith("horoscope_"), flags={"rate_limit": "heavy"})
 async def process_zodiac_selection(callback: CallbackQuery, state: FSMContext):
     """Обработчик выбора знака зодиака"""
     
@@ -92,20 +93,17 @@ async def process_zodiac_selection(callback: CallbackQuery, state: FSMContext):
     zodiac_sign = callback.data.split("_")[1]
     
     # Сохраняем знак зодиака пользователя
-    db.update_user_zodiac(callback.from_user.id, zodiac_sign)
+    await db.update_user_zodiac(callback.from_user.id, zodiac_sign)
     
     # Показываем "в процессе" сообщение
-    processing_msg = await callback.message.edit_text(
+    await callback.message.edit_text(
         f"♈ Генерирую гороскоп для {zodiac_sign}...\n\n<em>Это может занять несколько секунд</em>"
     )
     
     try:
-        # Генерируем гороскоп через Gemini
-        horoscope_text = await gemini_service.safe_generate_horoscope(zodiac_sign)
-        
-        final_text = f"♈ <b>Гороскоп для {zodiac_sign}</b>\n\n{horoscope_text}"
-        
-        await callback.message.edit_text(final_text)
+        # Показываем гороскоп по мере генерации
+        editor = ThrottledMessageEditor(callback.message, header=f"♈ <b>Гороскоп для {zodiac_sign}</b>\n\n")
+        await editor.stream(gemini_service.stream_horoscope(zodiac_sign))
         
     except Exception as e:
         error_text = f"""
@@ -182,7 +180,7 @@ async def handle_web_app_data(message: Message):
             # Синхронизация данных пользователя
             zodiac_sign = data.get('zodiac_sign')
             if zodiac_sign:
-                db.update_user_zodiac(user_id, zodiac_sign)
+                await db.update_user_zodiac(user_id, zodiac_sign)
                 await message.answer(f"✅ Знак зодиака обновлен: {zodiac_sign}")
                 
         else:
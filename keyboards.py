@@ -30,19 +30,19 @@ def web_app_keyboard():
         resize_keyboard=True
     )
 
+ZODIAC_SIGNS = [
+    ("Овен", "♈"), ("Телец", "♉"), ("Близнецы", "♊"),
+    ("Рак", "♋"), ("Лев", "♌"), ("Дева", "♍"),
+    ("Весы", "♎"), ("Скорпион", "♏"), ("Стрелец", "♐"),
+    ("Козерог", "♑"), ("Водолей", "♒"), ("Рыбы", "♓")
+]
+
 def zodiac_keyboard(prefix="horoscope"):
     """Клавиатура выбора знака зодиака"""
-    zodiac_signs = [
-        ("Овен", "♈"), ("Телец", "♉"), ("Близнецы", "♊"),
-        ("Рак", "♋"), ("Лев", "♌"), ("Дева", "♍"),
-        ("Весы", "♎"), ("Скорпион", "♏"), ("Стрелец", "♐"),
-        ("Козерог", "♑"), ("Водолей", "♒"), ("Рыбы", "♓")
-    ]
-    
     buttons = []
     row = []
     
-    for sign, emoji in zodiac_signs:
+    for sign, emoji in ZODIAC_SIGNS:
         row.append(InlineKeyboardButton(
             text=f"{emoji} {sign}", 
             callback_data=f"{prefix}_{sign}"
@@ -40,9 +40,44 @@ def import_modules():
         logger.error(f"❌ Traceback: {traceback.format_exc()}")
         sys.exit(1)
 
-async def main():
-    """Основная функция запуска бота"""
-    logger.info("🚀 Запуск бота...")
+async def run_polling(bot, dp, miniapp_api):
+    """Long polling; MiniApp API работает рядом на том же event loop"""
+    try:
+        await miniapp_api.start()
+    except Exception:
+        logger.warning("⚠️ Бот продолжит работу без MiniApp API")
+    
+    logger.info("🔄 Запуск поллинга...")
+    await bot.delete_webhook(drop_pending_updates=True)
+    await dp.start_polling(bot)
+
+async def run_webhook(bot, dp, miniapp_api, primary: bool = True):
+    """Апдейты и MiniApp API принимает одно aiohttp-приложение"""
+    from config import WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WORKERS
+    
+    if not WEBHOOK_BASE_URL:
+        raise RuntimeError("WEBHOOK_BASE_URL не задан - вебхук некуда направить")
+    
+    miniapp_api.setup_webhook(dp, bot, WEBHOOK_PATH, WEBHOOK_SECRET)
+    # Воркеры слушают один порт, соединения между ними распределяет ядро
+    await miniapp_api.start(reuse_port=WORKERS > 1)
+    
+    if primary:
+        # Telegram присылает только используемые обработчиками типы апдейтов
+        await bot.set_webhook(
+            url=f"{WEBHOOK_BASE_URL}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types()
+        )
+        logger.info(f"✅ Вебхук установлен: {WEBHOOK_BASE_URL}{WEBHOOK_PATH}")
+    
+    # Вебхук не снимаем при остановке: другие экземпляры за балансировщиком продолжают работу
+    await asyncio.Event().wait()
+
+async def main(worker_id: int = 0):
+    """Основная функция запуска бота; фоновые задачи выполняет только воркер 0"""
+    logger.info(f"🚀 Запуск бота (воркер {worker_id})...")
+    primary = worker_id == 0
     
     # Настройка окружения и импорт модулей
     setup_environment()
@@ -63,27 +98,109 @@ async def main():
             token=BOT_TOKEN,
             default=DefaultBotProperties(parse_mode=ParseMode.HTML)
         )
-        dp = Dispatcher()
+        # Состояния FSM в хранилище, общем для всех воркеров
+        from services.fsm_storage import create_storage
+        dp = Dispatcher(storage=create_storage())
         
         # Регистрируем роутер
         dp.include_router(main_router)
         
+        # Ограничение частоты запросов до работы с БД и Gemini
+        from config import FLOOD_CONTROL_ENABLED
+        if FLOOD_CONTROL_ENABLED:
+            from utils.flood_control import FloodControlMiddleware
+            flood_control = FloodControlMiddleware()
+            dp.message.middleware(flood_control)
+            dp.callback_query.middleware(flood_control)
+        
         logger.info("✅ Бот инициализирован")
-        logger.info("🔄 Запуск поллинга...")
+        
+        # Модель Gemini выбирается в фоне, до этого работают резервные тексты
+        from services.gemini_service import gemini_service
+        gemini_service.start()
+        
+        # Пакетная запись статистики запросов
+        db.request_log.start()
+        
+        # Фоновая генерация гороскопов, матрицы совместимости и толкований Таро заранее
+        from config import PREGENERATION_ENABLED, COMPATIBILITY_MATRIX_ENABLED, TAROT_FRAGMENTS_ENABLED
+        from services.pregeneration_scheduler import pregeneration_scheduler
+        from services.compatibility_matrix import compatibility_matrix
+        from services.tarot_interpretations import tarot_interpretations
+        if PREGENERATION_ENABLED and primary:
+            pregeneration_scheduler.start()
+        if COMPATIBILITY_MATRIX_ENABLED and primary:
+            compatibility_matrix.start()
+        if TAROT_FRAGMENTS_ENABLED and primary:
+            tarot_interpretations.start()
+        
+        # Оплаченные услуги выполняют воркеры очереди, а не обработчик платежа
+        from functools import partial
+        from handlers.payment_handlers import fulfil_paid_service, notify_fulfilment_failed
+        from services.fulfilment_queue import fulfilment_queue
+        fulfilment_queue.start(partial(fulfil_paid_service, bot), partial(notify_fulfilment_failed, bot))
         
         # Запуск бота
-        await bot.delete_webhook(drop_pending_updates=True)
-        await dp.start_polling(bot)
+        from api.server import miniapp_api
+        from config import WEBHOOK_ENABLED
+        try:
+            if WEBHOOK_ENABLED:
+                await run_webhook(bot, dp, miniapp_api, primary)
+            else:
+                await run_polling(bot, dp, miniapp_api)
+        finally:
+            await miniapp_api.stop()
+            await fulfilment_queue.stop()
+            await gemini_service.stop()
+            await pregeneration_scheduler.stop()
+            await compatibility_matrix.stop()
+            await tarot_interpretations.stop()
+            await dp.storage.close()
+            await db.close()
         
     except Exception as e:
         logger.error(f"❌ Ошибка запуска бота: {e}")
         import traceback
         logger.error(f"❌ Traceback: {traceback.format_exc()}")
 
-if __name__ == "__main__":
+def run_worker(worker_id: int = 0):
+    """Точка входа процесса-воркера"""
     try:
-        asyncio.run(main())
+        asyncio.run(main(worker_id))
     except KeyboardInterrupt:
-        logger.info("⏹️ Бот остановлен пользователем")
+        logger.info(f"⏹️ Воркер {worker_id} остановлен пользователем")
     except Exception as e:
-        logger.error(f"💥 Критическая ошибка: {e}")
\ No newline at end of file
+        logger.error(f"💥 Критическая ошибка: {e}")
+
+def run_workers(count: int):
+    """Запуск нескольких процессов-воркеров на общем порту вебхука"""
+    import multiprocessing
+    
+    # spawn: каждый воркер заново создает пул соединений, event loop и сессию бота
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(target=run_worker, args=(worker_id,), name=f"worker-{worker_id}")
+        for worker_id in range(count)
+    ]
+    for worker in workers:
+        worker.start()
+    logger.info(f"✅ Запущено воркеров: {count}")
+    
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        # SIGINT получила вся группа процессов - дожидаемся штатной остановки воркеров
+        for worker in workers:
+            worker.join()
+        logger.info("⏹️ Бот остановлен пользователем")
+
+if __name__ == "__main__":
+    from config import WEBHOOK_ENABLED, WORKERS
+    
+    if WORKERS > 1 and WEBHOOK_ENABLED:
+        run_workers(WORKERS)
+    else:
+        if WORKERS > 1:
+            logger.warning("⚠️ Несколько воркеров поддерживаются только в режиме вебхука, запускаем один")
+        run_worker()
\ No newline at end of file
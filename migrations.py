@@ -0,0 +1,188 @@
+# migrations.py
+import logging
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+# Версионированные миграции схемы: (версия, описание, SQL-запросы).
+# Текущая версия хранится в PRAGMA user_version. Новые миграции
+# только добавляются в конец списка, уже выпущенные не меняются.
+MIGRATIONS = [
+    (1, "Базовые таблицы", [
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE NOT NULL,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            zodiac_sign TEXT,
+            birth_date TEXT,
+            birth_time TEXT,
+            birth_place TEXT,
+            balance INTEGER DEFAULT 0,
+            subscription_type TEXT DEFAULT 'free',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            service_type TEXT NOT NULL,
+            amount_stars INTEGER NOT NULL,
+            status TEXT DEFAULT 'completed',
+            payment_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            payment_data TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (telegram_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            service_type TEXT NOT NULL,
+            request_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            cost INTEGER DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users (telegram_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            amount INTEGER NOT NULL,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (telegram_id)
+        )
+        ''',
+    ]),
+    (2, "Постоянный кэш гороскопов", [
+        '''
+        CREATE TABLE IF NOT EXISTS horoscope_cache (
+            zodiac_sign TEXT NOT NULL,
+            period TEXT NOT NULL,
+            period_date TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (zodiac_sign, period, period_date)
+        )
+        ''',
+    ]),
+    (3, "Матрица совместимости", [
+        '''
+        CREATE TABLE IF NOT EXISTS compatibility_matrix (
+            sign1 TEXT NOT NULL,
+            sign2 TEXT NOT NULL,
+            variant INTEGER NOT NULL,
+            prompt_version TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (sign1, sign2, variant)
+        )
+        ''',
+    ]),
+    (4, "Индексы для истории запросов, операций и платежей", [
+        'CREATE INDEX IF NOT EXISTS idx_requests_user_date ON requests (user_id, request_date DESC)',
+        'CREATE INDEX IF NOT EXISTS idx_transactions_user_date ON transactions (user_id, created_at DESC)',
+        'CREATE INDEX IF NOT EXISTS idx_payments_user_date ON payments (user_id, payment_date)',
+        'ANALYZE',
+    ]),
+    (5, "Ключи идемпотентности списаний и возвратов", [
+        'ALTER TABLE transactions ADD COLUMN idempotency_key TEXT',
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_idempotency
+        ON transactions (idempotency_key) WHERE idempotency_key IS NOT NULL
+        ''',
+    ]),
+    (6, "Очередь выполнения оплаченных услуг", [
+        '''
+        CREATE TABLE IF NOT EXISTS fulfilment_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            charge_id TEXT UNIQUE NOT NULL,
+            user_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            payload TEXT NOT NULL,
+            params TEXT NOT NULL DEFAULT '{}',
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_run_at REAL NOT NULL,
+            locked_until REAL,
+            result TEXT,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (telegram_id)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_fulfilment_jobs_due ON fulfilment_jobs (status, next_run_at)',
+        'CREATE INDEX IF NOT EXISTS idx_fulfilment_jobs_user ON fulfilment_jobs (user_id, created_at DESC)',
+    ]),
+    (7, "Кэш толкований раскладов Таро", [
+        '''
+        CREATE TABLE IF NOT EXISTS tarot_readings (
+            key TEXT PRIMARY KEY,
+            spread_type TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_tarot_readings_created ON tarot_readings (created_at)',
+    ]),
+    (8, "Толкования карт Таро по позициям раскладов", [
+        '''
+        CREATE TABLE IF NOT EXISTS tarot_fragments (
+            spread_type TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            card INTEGER NOT NULL,
+            reversed INTEGER NOT NULL,
+            prompt_version TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (spread_type, position, card, reversed)
+        )
+        ''',
+    ]),
+    (9, "Ключи идемпотентности в пределах пользователя и услуга операции", [
+        'ALTER TABLE transactions ADD COLUMN service_type TEXT',
+        'DROP INDEX IF EXISTS idx_transactions_idempotency',
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_user_idempotency
+        ON transactions (user_id, idempotency_key) WHERE idempotency_key IS NOT NULL
+        ''',
+    ]),
+    (10, "Ответ на оплаченный запрос для повторов с тем же ключом", [
+        'ALTER TABLE transactions ADD COLUMN result TEXT',
+    ]),
+]
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Текущая версия схемы"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def run_migrations(conn: sqlite3.Connection, migrations=MIGRATIONS) -> int:
+    """Применить недостающие миграции, каждую в своей транзакции"""
+    current = get_schema_version(conn)
+
+    for version, description, statements in migrations:
+        if version <= current:
+            continue
+
+        try:
+            conn.execute('BEGIN')
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            logger.error(f"❌ Ошибка миграции {version}: {description}")
+            raise
+
+        current = version
+        logger.info(f"✅ Применена миграция {version}: {description}")
+
+    return current
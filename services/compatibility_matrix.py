@@ -0,0 +1,221 @@
+# services/compatibility_matrix.py
+import asyncio
+import hashlib
+import logging
+import random
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+
+from config import (
+    COMPATIBILITY_REFRESH_BATCH,
+    COMPATIBILITY_REFRESH_INTERVAL,
+    COMPATIBILITY_VARIANTS,
+    PREGENERATION_CONCURRENCY,
+    PREGENERATION_INTERVAL,
+    PREGENERATION_RETRIES
+)
+from database import Database, db
+from keyboards import ZODIAC_SIGNS
+from utils.async_utils import Throttle, retry_with_jitter
+from .fallback_service import fallback_service
+from .gemini_service import gemini_service
+from .upstream_scheduler import PRIORITY_PAID
+
+logger = logging.getLogger(__name__)
+
+class CompatibilityMatrix:
+    """Предрассчитанная совместимость для всех пар знаков"""
+
+    def __init__(self, database: Database = None, variants: int = COMPATIBILITY_VARIANTS,
+                 refresh_interval: int = COMPATIBILITY_REFRESH_INTERVAL,
+                 refresh_batch: int = COMPATIBILITY_REFRESH_BATCH,
+                 concurrency: int = PREGENERATION_CONCURRENCY,
+                 interval: float = PREGENERATION_INTERVAL,
+                 retries: int = PREGENERATION_RETRIES):
+        self.db = database or db
+        self.variants = max(1, variants)
+        self.refresh_interval = refresh_interval
+        self.refresh_batch = refresh_batch
+        self.concurrency = concurrency
+        self.interval = interval
+        self.retries = retries
+
+        self._order = {sign: i for i, (sign, _) in enumerate(ZODIAC_SIGNS)}
+
+        # Версия промпта: при его изменении старые тексты считаются устаревшими
+        template = "".join(
+            gemini_service.compatibility_prompt("{sign1}", "{sign2}", variant)
+            for variant in range(len(gemini_service.COMPATIBILITY_ACCENTS))
+        )
+        self.prompt_version = hashlib.sha1(template.encode()).hexdigest()[:12]
+
+        self._task: Optional[asyncio.Task] = None
+        self._throttle = Throttle(interval)
+
+        self.hits = 0
+        self.misses = 0
+
+    def pair_key(self, sign1: str, sign2: str) -> Tuple[str, str]:
+        """Совместимость не зависит от порядка знаков"""
+        order1 = self._order.get(sign1, len(self._order))
+        order2 = self._order.get(sign2, len(self._order))
+        if (order1, sign1) <= (order2, sign2):
+            return sign1, sign2
+        return sign2, sign1
+
+    def pairs(self) -> List[Tuple[str, str]]:
+        """Все 78 неупорядоченных пар знаков"""
+        signs = [sign for sign, _ in ZODIAC_SIGNS]
+        return [(a, b) for i, a in enumerate(signs) for b in signs[i:]]
+
+    async def get(self, sign1: str, sign2: str) -> str:
+        """Текст совместимости: из матрицы, а при промахе - генерация с сохранением"""
+        pair = self.pair_key(sign1, sign2)
+
+        variants = await self._load_variants(*pair)
+        if variants:
+            self.hits += 1
+            return random.choice(variants)
+
+        self.misses += 1
+        if gemini_service.model is None:
+            return fallback_service.generate_compatibility(*pair)
+
+        try:
+            # Пользователь уже заплатил и ждет ответа
+            content = await gemini_service.pregenerate_compatibility(*pair, 0, priority=PRIORITY_PAID)
+        except Exception as e:
+            logger.error(f"Ошибка генерации совместимости: {e}")
+            return fallback_service.generate_compatibility(*pair)
+
+        await self._store(pair[0], pair[1], 0, content)
+        return content
+
+    async def _load_variants(self, sign1: str, sign2: str) -> List[str]:
+        """Актуальные варианты текста для пары"""
+        try:
+            rows = await self.db.fetchall('''
+                SELECT content FROM compatibility_matrix
+                WHERE sign1 = ? AND sign2 = ? AND prompt_version = ? AND variant < ?
+            ''', (sign1, sign2, self.prompt_version, self.variants))
+            return [row[0] for row in rows]
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка чтения матрицы совместимости: {e}")
+            return []
+
+    async def _store(self, sign1: str, sign2: str, variant: int, content: str):
+        """Сохранить вариант текста"""
+        try:
+            await self.db.execute('''
+                INSERT OR REPLACE INTO compatibility_matrix
+                (sign1, sign2, variant, prompt_version, content, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (sign1, sign2, variant, self.prompt_version, content, time.time()))
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка записи матрицы совместимости: {e}")
+
+    async def _stale_slots(self) -> List[Tuple[str, str, int]]:
+        """Отсутствующие варианты и варианты от старой версии промпта"""
+        try:
+            rows = await self.db.fetchall('''
+                SELECT sign1, sign2, variant FROM compatibility_matrix
+                WHERE prompt_version = ?
+            ''', (self.prompt_version,))
+            fresh = set(rows)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка чтения матрицы совместимости: {e}")
+            return []
+
+        return [
+            (a, b, variant)
+            for variant in range(self.variants)
+            for a, b in self.pairs()
+            if (a, b, variant) not in fresh
+        ]
+
+    async def _oldest_slots(self, limit: int) -> List[Tuple[str, str, int]]:
+        """Самые старые варианты - кандидаты на обновление формулировок"""
+        try:
+            return await self.db.fetchall('''
+                SELECT sign1, sign2, variant FROM compatibility_matrix
+                WHERE variant < ?
+                ORDER BY created_at
+                LIMIT ?
+            ''', (self.variants, limit))
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка чтения матрицы совместимости: {e}")
+            return []
+
+    def start(self):
+        """Запуск фонового заполнения и обновления матрицы"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"✅ Матрица совместимости запущена (версия промпта {self.prompt_version})")
+
+    async def stop(self):
+        """Остановка фоновых задач"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        """Заполнение недостающих пар, затем периодическая ротация вариантов"""
+        # Модель выбирается в фоне при запуске
+        await gemini_service.wait_ready()
+        try:
+            await self.fill(await self._stale_slots())
+        except Exception as e:
+            logger.error(f"❌ Ошибка заполнения матрицы совместимости: {e}")
+
+        # Ошибка одного обновления не останавливает ротацию, цикл прерывает только отмена
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                # Заодно дозаполняем то, что не удалось сгенерировать раньше
+                await self.fill(await self._stale_slots() or await self._oldest_slots(self.refresh_batch))
+            except Exception as e:
+                logger.error(f"❌ Ошибка обновления матрицы совместимости: {e}")
+
+    async def fill(self, slots: List[Tuple[str, str, int]]):
+        """Сгенерировать тексты для указанных вариантов пар"""
+        if not slots or gemini_service.model is None:
+            return
+
+        logger.info(f"🔄 Генерация {len(slots)} вариантов матрицы совместимости")
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run_slot(sign1: str, sign2: str, variant: int) -> bool:
+            async with semaphore:
+                try:
+                    content = await retry_with_jitter(
+                        lambda: gemini_service.pregenerate_compatibility(sign1, sign2, variant),
+                        retries=self.retries,
+                        base_delay=self.interval,
+                        throttle=self._throttle,
+                        description=f"совместимость {sign1}/{sign2}"
+                    )
+                except Exception:
+                    return False
+                await self._store(sign1, sign2, variant, content)
+                return True
+
+        results = await asyncio.gather(*(run_slot(*slot) for slot in slots))
+        logger.info(f"✅ Матрица совместимости: обновлено {sum(results)}/{len(slots)} вариантов")
+
+    def get_stats(self) -> Dict[str, float]:
+        """Статистика обращений к матрице"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "prompt_version": self.prompt_version
+        }
+
+# Создаем глобальный экземпляр матрицы
+compatibility_matrix = CompatibilityMatrix()
@@ -0,0 +1,265 @@
+# services/fsm_storage.py
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from config import (
+    FSM_CACHE_SIZE,
+    FSM_FLUSH_INTERVAL,
+    FSM_PURGE_INTERVAL,
+    FSM_STATE_TTL,
+    REDIS_URL,
+    STORAGE_BACKEND,
+    STORAGE_PATH
+)
+from database import ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+# Данные пустой записи в сериализованном виде
+EMPTY_DATA = "{}"
+
+class _Record:
+    """Состояние и данные одного ключа; данные хранятся строкой JSON - компактно и без общих ссылок"""
+    __slots__ = ("state", "data", "updated_at")
+
+    def __init__(self, state: Optional[str] = None, data: str = EMPTY_DATA, updated_at: float = 0.0):
+        self.state = state
+        self.data = data
+        self.updated_at = updated_at
+
+    @property
+    def empty(self) -> bool:
+        return self.state is None and self.data == EMPTY_DATA
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище состояний FSM в файле SQLite: переживает перезапуск и общее
+    для всех процессов-воркеров на одной машине.
+
+    Недавние ключи держатся в памяти (не больше max_size, вытеснение LRU),
+    изменения пишутся пакетами раз в flush_interval секунд. Брошенные
+    состояния старше ttl считаются пустыми и периодически удаляются.
+    """
+
+    def __init__(self, path: str = STORAGE_PATH, max_size: int = FSM_CACHE_SIZE,
+                 ttl: float = FSM_STATE_TTL, flush_interval: float = FSM_FLUSH_INTERVAL,
+                 purge_interval: float = FSM_PURGE_INTERVAL, pool_size: int = 2):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.purge_interval = purge_interval
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+        self._init_db()
+        self.pool = ConnectionPool(path, size=pool_size)
+
+        # Горячий уровень: ключ -> запись, порядок = порядок последнего использования
+        self._hot: "OrderedDict[str, _Record]" = OrderedDict()
+        # Измененные и еще не записанные ключи; из памяти не вытесняются
+        self._dirty: Set[str] = set()
+        self._flushing: Set[str] = set()
+        # Пакеты пишутся по одному, чтобы более старое значение не перезаписало новое
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self.written = 0
+        self.purged = 0
+
+    def _init_db(self):
+        with sqlite3.connect(self.path) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS fsm_storage (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data TEXT NOT NULL DEFAULT '{}',
+                    updated_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_fsm_storage_updated ON fsm_storage (updated_at)')
+
+    def start(self):
+        """Запуск фоновой записи и очистки; без нее каждое изменение пишется сразу"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Остановка с записью всех изменений"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        await self.pool.close()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record_key = self.key_builder.build(key)
+        record = await self._get(record_key)
+        record.state = state.state if isinstance(state, State) else state
+        await self._changed(record_key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._get(self.key_builder.build(key))).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record_key = self.key_builder.build(key)
+        record = await self._get(record_key)
+        record.data = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+        await self._changed(record_key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return json.loads((await self._get(self.key_builder.build(key))).data)
+
+    async def _get(self, record_key: str) -> _Record:
+        """Запись из памяти или из БД; отсутствующая или просроченная - пустая"""
+        now = time.time()
+        record = self._hot.get(record_key)
+        if record is not None:
+            self._hot.move_to_end(record_key)
+            self.hits += 1
+        else:
+            self.misses += 1
+            row = await self.pool.run(lambda conn: conn.execute(
+                'SELECT state, data, updated_at FROM fsm_storage WHERE key = ?', (record_key,)
+            ).fetchone())
+            # Запись могла появиться в памяти, пока шло чтение
+            record = self._hot.get(record_key) or (_Record(*row) if row else _Record())
+            self._remember(record_key, record)
+
+        if not record.empty and record.updated_at + self.ttl < now:
+            record.state, record.data = None, EMPTY_DATA
+        return record
+
+    def _remember(self, record_key: str, record: _Record):
+        """Положить запись в память с вытеснением давно не используемых записанных ключей"""
+        self._hot[record_key] = record
+        self._hot.move_to_end(record_key)
+        self._trim()
+
+    def _trim(self):
+        if len(self._hot) <= self.max_size:
+            return
+        for record_key in list(self._hot):
+            if len(self._hot) <= self.max_size:
+                break
+            if record_key not in self._dirty and record_key not in self._flushing:
+                del self._hot[record_key]
+
+    async def _changed(self, record_key: str, record: _Record):
+        """Отметить запись измененной и записать сразу или с ближайшим пакетом"""
+        record.updated_at = time.time()
+        self._hot[record_key] = record
+        self._dirty.add(record_key)
+        if self._task is None or self.flush_interval <= 0:
+            await self.flush()
+
+    async def _run(self):
+        """Запись изменений по таймеру и периодическое удаление брошенных состояний"""
+        next_purge = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval if self.flush_interval > 0 else self.purge_interval)
+            await self.flush()
+            if time.monotonic() >= next_purge:
+                await self.purge()
+                next_purge = time.monotonic() + self.purge_interval
+
+    async def flush(self):
+        """Записать все изменения одной транзакцией"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            keys, self._dirty = self._dirty, set()
+            self._flushing = keys
+            # Снимок значений: изменения во время записи попадут в следующий пакет
+            batch = [(key, self._hot[key].state, self._hot[key].data, self._hot[key].updated_at) for key in keys]
+
+            def run(conn):
+                with conn:
+                    conn.executemany('DELETE FROM fsm_storage WHERE key = ?', [
+                        (key,) for key, state, data, _ in batch if state is None and data == EMPTY_DATA
+                    ])
+                    conn.executemany('''
+                        INSERT OR REPLACE INTO fsm_storage (key, state, data, updated_at)
+                        VALUES (?, ?, ?, ?)
+                    ''', [row for row in batch if row[1] is not None or row[2] != EMPTY_DATA])
+
+            try:
+                await self.pool.run(run)
+            except sqlite3.Error as e:
+                # Не записанное вернется в следующий пакет
+                self._dirty |= keys
+                logger.error(f"Ошибка записи состояний FSM ({len(batch)} ключей): {e}")
+                return
+            except asyncio.CancelledError:
+                self._dirty |= keys
+                raise
+            finally:
+                self._flushing = set()
+
+            self.flushes += 1
+            self.written += len(batch)
+            self._trim()
+
+    async def purge(self):
+        """Удалить из БД состояния, брошенные дольше ttl"""
+        def run(conn):
+            with conn:
+                return conn.execute('DELETE FROM fsm_storage WHERE updated_at < ?', (time.time() - self.ttl,)).rowcount
+
+        try:
+            removed = await self.pool.run(run)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка очистки состояний FSM: {e}")
+            return
+        self.purged += removed
+        if removed:
+            logger.info(f"🧹 Удалено брошенных состояний FSM: {removed}")
+
+    def get_stats(self) -> Dict[str, int]:
+        """Статистика хранилища состояний"""
+        return {
+            "hot": len(self._hot),
+            "dirty": len(self._dirty),
+            "hits": self.hits,
+            "misses": self.misses,
+            "flushes": self.flushes,
+            "written": self.written,
+            "purged": self.purged
+        }
+
+def create_storage(backend: str = STORAGE_BACKEND) -> BaseStorage:
+    """
+    Хранилище состояний FSM по настройке STORAGE_BACKEND:
+    sqlite - файл, общий для воркеров одной машины, memory - в памяти
+    процесса (теряется при перезапуске), redis - для воркеров на разных машинах.
+    Вызывается внутри работающего event loop.
+    """
+    if backend == "sqlite":
+        storage = SQLiteStorage()
+        storage.start()
+        logger.info(f"✅ Состояния FSM хранятся в SQLite: {STORAGE_PATH}")
+        return storage
+    if backend == "redis":
+        # Требует пакет redis, который не входит в обязательные зависимости
+        from aiogram.fsm.storage.redis import RedisStorage
+        logger.info("✅ Состояния FSM хранятся в Redis")
+        return RedisStorage.from_url(REDIS_URL, state_ttl=FSM_STATE_TTL, data_ttl=FSM_STATE_TTL)
+    if backend != "memory":
+        logger.warning(f"⚠️ Неизвестное хранилище {backend}, используем память процесса")
+    return MemoryStorage()
@@ -0,0 +1,310 @@
+# services/fulfilment_queue.py
+import asyncio
+import json
+import logging
+import random
+import sqlite3
+import time
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from config import (
+    FULFILMENT_CONCURRENCY,
+    FULFILMENT_LEASE,
+    FULFILMENT_MAX_ATTEMPTS,
+    FULFILMENT_MAX_RETRY_DELAY,
+    FULFILMENT_POLL_INTERVAL,
+    FULFILMENT_RETRY_DELAY
+)
+from database import Database, db
+
+logger = logging.getLogger(__name__)
+
+# Статусы заказа
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+class FulfilmentJob(NamedTuple):
+    """Оплаченная услуга, которую нужно сгенерировать и доставить"""
+    id: int
+    charge_id: str
+    user_id: int
+    chat_id: int
+    payload: str
+    params: Dict[str, Any]
+    attempts: int
+
+class LeaseLostError(Exception):
+    """Аренда заказа истекла и его забрала следующая попытка"""
+
+JobHandler = Callable[[FulfilmentJob], Awaitable[Optional[str]]]
+
+class FulfilmentQueue:
+    """
+    Очередь выполнения оплаченных услуг в SQLite.
+    Платеж записывается вместе с заказом одной транзакцией, повтор того же
+    telegram_payment_charge_id новый заказ не создает. Воркеры забирают заказы
+    с арендой на lease секунд, которая продлевается, пока заказ выполняется:
+    заказ процесса, упавшего посреди генерации, после окончания аренды
+    выполнит другой воркер. Ошибки повторяются с экспоненциальной задержкой,
+    после max_attempts заказ помечается failed.
+    """
+
+    def __init__(self, database: Database = None, concurrency: int = FULFILMENT_CONCURRENCY,
+                 max_attempts: int = FULFILMENT_MAX_ATTEMPTS, retry_delay: float = FULFILMENT_RETRY_DELAY,
+                 max_retry_delay: float = FULFILMENT_MAX_RETRY_DELAY, lease: float = FULFILMENT_LEASE,
+                 poll_interval: float = FULFILMENT_POLL_INTERVAL):
+        self.db = database or db
+        self.concurrency = max(1, concurrency)
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.lease = lease
+        self.poll_interval = poll_interval
+
+        self.handler: Optional[JobHandler] = None
+        self.on_failed: Optional[Callable[[FulfilmentJob, str], Awaitable[None]]] = None
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+
+    def start(self, handler: JobHandler, on_failed: Callable[[FulfilmentJob, str], Awaitable[None]] = None):
+        """
+        Запуск воркеров. handler генерирует и доставляет услугу, возвращает текст
+        для MiniApp или бросает исключение; on_failed вызывается после последней попытки.
+        """
+        self.handler = handler
+        self.on_failed = on_failed
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+            logger.info(f"✅ Очередь оплаченных услуг запущена, воркеров: {self.concurrency}")
+
+    async def stop(self):
+        """Остановка воркеров; незавершенные заказы выполнятся после перезапуска"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def enqueue(self, charge_id: str, user_id: int, chat_id: int, payload: str,
+                      amount: int, params: Dict[str, Any] = None) -> Tuple[int, bool]:
+        """Записать платеж и заказ: (id заказа, создан ли он сейчас)"""
+        service_type = payload.split("_")[0]
+        now = time.time()
+
+        def run(conn):
+            with conn:
+                cursor = conn.execute('''
+                    INSERT OR IGNORE INTO fulfilment_jobs
+                    (charge_id, user_id, chat_id, payload, params, status, next_run_at, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (charge_id, user_id, chat_id, payload, json.dumps(params or {}, ensure_ascii=False),
+                      JOB_PENDING, now, now, now))
+                created = cursor.rowcount == 1
+                if created:
+                    conn.execute('''
+                        INSERT INTO payments (user_id, service_type, amount_stars, status, payment_data)
+                        VALUES (?, ?, ?, 'completed', ?)
+                    ''', (user_id, service_type, amount, charge_id))
+                job_id = conn.execute(
+                    'SELECT id FROM fulfilment_jobs WHERE charge_id = ?', (charge_id,)
+                ).fetchone()[0]
+                return job_id, created
+
+        job_id, created = await self.db.pool.run(run)
+        if created:
+            logger.info(f"📥 Заказ {job_id} поставлен в очередь: {payload} для {user_id}")
+            self._wakeup.set()
+        else:
+            logger.info(f"🔁 Повторное уведомление о платеже {charge_id}, заказ {job_id} уже есть")
+        return job_id, created
+
+    async def _worker(self):
+        """Выполнение заказов по мере поступления и наступления времени повтора"""
+        while True:
+            try:
+                job = await self._claim()
+            except sqlite3.Error as e:
+                logger.error(f"Ошибка выборки заказа: {e}")
+                job = None
+
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+
+            await self._execute(job)
+
+    async def _claim(self) -> Optional[FulfilmentJob]:
+        """Забрать первый готовый к выполнению заказ под аренду"""
+        def run(conn):
+            now = time.time()
+            # IMMEDIATE: два воркера разных процессов не заберут один заказ
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('''
+                    SELECT id, charge_id, user_id, chat_id, payload, params, attempts
+                    FROM fulfilment_jobs
+                    WHERE (status = ? AND next_run_at <= ?) OR (status = ? AND locked_until < ?)
+                    ORDER BY next_run_at LIMIT 1
+                ''', (JOB_PENDING, now, JOB_RUNNING, now)).fetchone()
+                if row:
+                    conn.execute('''
+                        UPDATE fulfilment_jobs
+                        SET status = ?, attempts = attempts + 1, locked_until = ?, updated_at = ?
+                        WHERE id = ?
+                    ''', (JOB_RUNNING, now + self.lease, now, row[0]))
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            return row
+
+        row = await self.db.pool.run(run)
+        if row is None:
+            return None
+        job_id, charge_id, user_id, chat_id, payload, params, attempts = row
+        return FulfilmentJob(job_id, charge_id, user_id, chat_id, payload, json.loads(params), attempts + 1)
+
+    async def _execute(self, job: FulfilmentJob):
+        """Выполнить заказ и записать результат"""
+        task = asyncio.ensure_future(self.handler(job))
+        heartbeat = asyncio.create_task(self._heartbeat(job, task))
+        try:
+            result = await task
+        except asyncio.CancelledError:
+            if heartbeat.done() and not heartbeat.cancelled() and heartbeat.result() is False:
+                logger.warning(f"⚠️ Аренда заказа {job.id} потеряна, попытка {job.attempts} прервана")
+                return
+            # Остановка процесса: заказ вернется в очередь и выполнится после перезапуска
+            await self._update(job, status=JOB_PENDING, locked_until=None)
+            raise
+        except LeaseLostError as e:
+            logger.warning(f"⚠️ {e}, попытка прервана")
+            return
+        except Exception as e:
+            await self._record_failure(job, e)
+            return
+        finally:
+            heartbeat.cancel()
+
+        await self._update(job, status=JOB_DONE, result=result, last_error=None, locked_until=None)
+        self.completed += 1
+        logger.info(f"✅ Заказ {job.id} выполнен ({job.payload}, попытка {job.attempts})")
+
+    async def _heartbeat(self, job: FulfilmentJob, task: asyncio.Future) -> bool:
+        """Продление аренды, пока выполняется заказ; при потере аренды выполнение прерывается"""
+        while not task.done():
+            await asyncio.sleep(self.lease / 3)
+            try:
+                renewed = await self._renew(job)
+            except sqlite3.Error as e:
+                # Аренда еще действует - попробуем на следующем шаге
+                logger.error(f"Ошибка продления аренды заказа {job.id}: {e}")
+                continue
+            if not renewed:
+                task.cancel()
+                return False
+        return True
+
+    async def _renew(self, job: FulfilmentJob) -> bool:
+        """Продлить аренду, если заказ все еще выполняется этой попыткой"""
+        now = time.time()
+        updated = await self.db.execute('''
+            UPDATE fulfilment_jobs SET locked_until = ?, updated_at = ?
+            WHERE id = ? AND status = ? AND attempts = ?
+        ''', (now + self.lease, now, job.id, JOB_RUNNING, job.attempts))
+        return updated == 1
+
+    async def ensure_owner(self, job: FulfilmentJob):
+        """
+        Проверка перед отправкой пользователю: заказ все еще выполняется этой
+        попыткой. Иначе LeaseLostError - заказ доставит следующая попытка.
+        """
+        if not await self._renew(job):
+            raise LeaseLostError(f"Заказ {job.id} больше не принадлежит попытке {job.attempts}")
+
+    async def _record_failure(self, job: FulfilmentJob, error: Exception):
+        """Повтор с экспоненциальной задержкой или окончательная ошибка"""
+        if job.attempts < self.max_attempts:
+            delay = min(self.max_retry_delay, self.retry_delay * 2 ** (job.attempts - 1))
+            # Разброс, чтобы повторы многих заказов не совпадали по времени
+            delay *= random.uniform(0.8, 1.2)
+            await self._update(job, status=JOB_PENDING, next_run_at=time.time() + delay,
+                               last_error=str(error), locked_until=None)
+            self.retried += 1
+            logger.warning(f"⚠️ Заказ {job.id} не выполнен (попытка {job.attempts}): {error}. "
+                           f"Повтор через {delay:.0f} с")
+            return
+
+        await self._update(job, status=JOB_FAILED, last_error=str(error), locked_until=None)
+        self.failed += 1
+        logger.error(f"❌ Заказ {job.id} не выполнен после {job.attempts} попыток: {error}")
+        if self.on_failed is not None:
+            try:
+                await self.on_failed(job, str(error))
+            except Exception as e:
+                logger.error(f"❌ Ошибка уведомления о невыполненном заказе {job.id}: {e}")
+
+    async def _update(self, job: FulfilmentJob, **fields):
+        """Обновить поля заказа, если его не забрала следующая попытка"""
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        try:
+            await self.db.execute(
+                f'UPDATE fulfilment_jobs SET {columns} WHERE id = ? AND attempts = ?',
+                (*fields.values(), job.id, job.attempts)
+            )
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка обновления заказа {job.id}: {e}")
+
+    async def get_job(self, job_id: int, user_id: int) -> Optional[Dict[str, Any]]:
+        """Состояние заказа пользователя"""
+        row = await self.db.fetchone('''
+            SELECT id, payload, status, attempts, result, last_error, created_at, updated_at
+            FROM fulfilment_jobs WHERE id = ? AND user_id = ?
+        ''', (job_id, user_id))
+        return self._job_dict(row) if row else None
+
+    async def get_user_jobs(self, user_id: int, limit: int = 10) -> List[Dict[str, Any]]:
+        """Последние заказы пользователя"""
+        rows = await self.db.fetchall('''
+            SELECT id, payload, status, attempts, result, last_error, created_at, updated_at
+            FROM fulfilment_jobs WHERE user_id = ?
+            ORDER BY created_at DESC LIMIT ?
+        ''', (user_id, limit))
+        return [self._job_dict(row) for row in rows]
+
+    @staticmethod
+    def _job_dict(row) -> Dict[str, Any]:
+        job_id, payload, status, attempts, result, last_error, created_at, updated_at = row
+        return {
+            "job_id": job_id,
+            "service": payload,
+            "status": status,
+            "attempts": attempts,
+            "result": result if status == JOB_DONE else None,
+            # Текст ошибки пользователю не показываем, только факт повтора
+            "retrying": status == JOB_PENDING and last_error is not None,
+            "created_at": created_at,
+            "updated_at": updated_at
+        }
+
+    def get_stats(self) -> Dict[str, int]:
+        """Статистика выполнения заказов"""
+        return {
+            "workers": len(self._tasks),
+            "completed": self.completed,
+            "retried": self.retried,
+            "failed": self.failed
+        }
+
+# Создаем глобальный экземпляр очереди
+fulfilment_queue = FulfilmentQueue()
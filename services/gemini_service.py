@@ -1,6 +1,34 @@
+import asyncio
+import json
 import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from functools import partial
+from typing import AsyncIterator, Callable, Dict, Optional
+
 import google.generativeai as genai
-from config import GEMINI_API_KEY
+from config import (
+    GEMINI_API_KEY,
+    GEMINI_MAX_CONCURRENCY,
+    GEMINI_MODEL_CACHE_PATH,
+    GEMINI_MODEL_CACHE_TTL,
+    GEMINI_PROBE_TIMEOUT,
+    GEMINI_REQUEST_TIMEOUT
+)
+from .horoscope_cache import horoscope_cache
+from .model_router import TIER_FREE, TIER_PAID, ModelRouter, NoHealthyModelError
+from .single_flight import SingleFlight
+from .tarot_cache import tarot_cache
+from .upstream_scheduler import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_NAMES,
+    PRIORITY_PAID,
+    UpstreamOverloadedError,
+    UpstreamScheduler
+)
 
 logger = logging.getLogger(__name__)
 
@@ -21,54 +49,171 @@ class GeminiService:
             'gemini-2.5-flash-preview-05-20', # Премиум
         ]
         
+        # Пока модель не выбрана, запросы обслуживаются резервными текстами
         self.model = None
-        self.model_name = None
+        self.model_name = "none"
+        # Результаты последней проверки: имя модели -> доступность и задержка
+        self.model_health: Dict[str, dict] = {}
+        # Каждый запрос уходит самой быстрой доступной модели
+        self._router = ModelRouter(self.model_priority)
+        
+        # Лимиты квоты, параллельность и приоритеты запросов к Gemini
+        self._scheduler = UpstreamScheduler()
+        self._executor = ThreadPoolExecutor(
+            max_workers=GEMINI_MAX_CONCURRENCY,
+            thread_name_prefix="gemini"
+        )
+        # Одинаковые промпты в полете объединяются в один запрос
+        self._single_flight = SingleFlight()
+        self.generation_config = genai.types.GenerationConfig(
+            temperature=0.7,
+            top_p=0.8,
+            max_output_tokens=1500
+        )
+        
+        self._discovery_task: Optional[asyncio.Task] = None
+        self._ready = asyncio.Event()
+
+    def start(self):
+        """Выбор модели: из файла с результатами прошлой проверки или параллельной проверкой в фоне"""
+        if self._ready.is_set() or (self._discovery_task is not None and not self._discovery_task.done()):
+            return
         
-        # Пробуем подключиться к моделям по порядку
-        for model_name in self.model_priority:
+        if self._load_model_cache():
+            logger.info(f"✅ Модель {self.model_name} взята из {GEMINI_MODEL_CACHE_PATH}, проверка пропущена")
+            self._ready.set()
+            return
+        
+        self._discovery_task = asyncio.create_task(self.discover_models())
+
+    async def stop(self):
+        """Остановка фоновой проверки моделей"""
+        if self._discovery_task is not None:
+            self._discovery_task.cancel()
             try:
-                logger.info(f"🔄 Попытка инициализации модели: {model_name}")
-                self.model = genai.GenerativeModel(model_name)
+                await self._discovery_task
+            except asyncio.CancelledError:
+                pass
+            self._discovery_task = None
+
+    async def wait_ready(self, timeout: float = None) -> bool:
+        """Дождаться окончания выбора модели (True, если выбор завершен)"""
+        self.start()
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def discover_models(self):
+        """Параллельная проверка всех моделей: первая доступная включается сразу, затем лучшая по приоритету"""
+        logger.info(f"🔄 Проверка моделей Gemini: {', '.join(self.model_priority)}")
+        try:
+            for probe in asyncio.as_completed([self._probe_model(name) for name in self.model_priority]):
+                model_name, model, health = await probe
+                self.model_health[model_name] = health
+                self._router.add_model(model_name, model, health.get("latency"), healthy=health["ok"])
+                if not health["ok"]:
+                    continue
                 
-                # Простой тестовый запрос
-                test_response = self.model.generate_content(
-                    "Тест", 
-                    generation_config=genai.types.GenerationConfig(max_output_tokens=50)
+                if self.model is None or self._priority(model_name) < self._priority(self.model_name):
+                    self.model = model
+                    self.model_name = model_name
+                    logger.info(f"✅ Используется модель: {model_name}")
+                    self._ready.set()
+            
+            if self.model is None:
+                logger.error("❌ Все модели Gemini недоступны")
+            else:
+                await asyncio.get_running_loop().run_in_executor(self._executor, self._save_model_cache)
+        finally:
+            self._ready.set()
+
+    async def _probe_model(self, model_name: str):
+        """Тестовый запрос к одной модели: (имя, модель, состояние)"""
+        loop = asyncio.get_running_loop()
+        model = genai.GenerativeModel(model_name)
+        config = genai.types.GenerationConfig(max_output_tokens=50)
+        started = loop.time()
+        try:
+            if hasattr(model, "generate_content_async"):
+                call = model.generate_content_async("Тест", generation_config=config)
+            else:
+                call = loop.run_in_executor(
+                    self._executor,
+                    partial(model.generate_content, "Тест", generation_config=config)
                 )
-                
-                self.model_name = model_name
-                logger.info(f"✅ Успешно инициализирована модель: {model_name}")
-                break
-                
-            except Exception as e:
-                logger.warning(f"❌ Модель {model_name} не доступна: {e}")
-                continue
+            await asyncio.wait_for(call, timeout=GEMINI_PROBE_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"❌ Модель {model_name} не доступна: {e}")
+            return model_name, model, {"ok": False, "error": str(e)}
         
-        if self.model is None:
-            logger.error("❌ Все модели Gemini недоступны")
-            # Создаем заглушку чтобы бот мог работать без Gemini
-            self.model = None
-            self.model_name = "none"
+        return model_name, model, {"ok": True, "latency": round(loop.time() - started, 3)}
+
+    def _priority(self, model_name: str) -> int:
+        """Место модели в списке приоритетов"""
+        try:
+            return self.model_priority.index(model_name)
+        except ValueError:
+            return len(self.model_priority)
+
+    def _load_model_cache(self) -> bool:
+        """Взять модель из результатов недавней проверки"""
+        try:
+            with open(GEMINI_MODEL_CACHE_PATH, encoding="utf-8") as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return False
+        
+        model_name = cache.get("model")
+        if model_name not in self.model_priority or time.time() - cache.get("checked_at", 0) > GEMINI_MODEL_CACHE_TTL:
+            return False
+        
+        self.model_health = cache.get("health", {})
+        for name in self.model_priority:
+            health = self.model_health.get(name, {})
+            self._router.add_model(
+                name,
+                genai.GenerativeModel(name),
+                health.get("latency"),
+                healthy=health.get("ok", name == model_name)
+            )
+        
+        self.model = self._router.models[model_name]
+        self.model_name = model_name
+        return True
+
+    def _save_model_cache(self):
+        """Сохранить выбранную модель, чтобы перезапуск обошелся без проверки"""
+        cache = {
+            "model": self.model_name,
+            "checked_at": time.time(),
+            "health": self.model_health
+        }
+        tmp_path = f"{GEMINI_MODEL_CACHE_PATH}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(cache, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, GEMINI_MODEL_CACHE_PATH)
+        except OSError as e:
+            logger.warning(f"⚠️ Не удалось сохранить {GEMINI_MODEL_CACHE_PATH}: {e}")
 
     async def generate_horoscope(self, zodiac_sign: str, period: str = "сегодня") -> str:
         """Генерация гороскопа через Gemini"""
+        # Прогноз зависит только от знака и периода - отдаем общий кэш
+        cached = await horoscope_cache.get(zodiac_sign, period)
+        if cached is not None:
+            return cached
+        
         if self.model is None:
             return await self._get_fallback_horoscope(zodiac_sign, period)
             
-        prompt = f"""
-        Напиши краткий астрологический прогноз для знака зодиака {zodiac_sign} на {period}.
-        Будь позитивным и вдохновляющим. Объем: 100-150 слов.
-        Формат:
-        - Общее описание дня
-        - Энергетика и настроение  
-        - Совет дня
-        - Что стоит учитывать
-        
-        Пиши на русском языке.
-        """
+        prompt = self._horoscope_prompt(zodiac_sign, period)
         
         try:
-            response = await self._make_request(prompt)
+            # Бесплатный контент - на дешевые модели
+            response = await self._make_request(prompt, TIER_FREE, PRIORITY_INTERACTIVE)
+            await horoscope_cache.set(zodiac_sign, period, response)
             return response
         except Exception as e:
             logger.error(f"Ошибка генерации гороскопа: {e}")
@@ -80,8 +225,211 @@ class GeminiService:
             from .fallback_service import fallback_service
             return fallback_service.generate_compatibility(sign1, sign2)
             
-        prompt = f"""
+        prompt = self.compatibility_prompt(sign1, sign2)
+        
+        try:
+            response = await self._make_request(prompt)
+            return response
+        except Exception as e:
+            logger.error(f"Ошибка генерации совместимости: {e}")
+            from .fallback_service import fallback_service
+            return fallback_service.generate_compatibility(sign1, sign2)
+
+    async def generate_weekly_horoscope(self, zodiac_sign: str, user_data: dict = None) -> str:
+        """Генерация расширенного гороскопа на неделю"""
+        # Без персональных данных прогноз общий для знака на всю неделю
+        if not user_data:
+            cached = await horoscope_cache.get(zodiac_sign, "неделю")
+            if cached is not None:
+                return cached
+        
+        if self.model is None:
+            return self._weekly_fallback(zodiac_sign)
+        
+        prompt = self._weekly_prompt(zodiac_sign, user_data)
+        
+        try:
+            response = await self._make_request(prompt)
+            if not user_data:
+                await horoscope_cache.set(zodiac_sign, "неделю", response)
+            return response
+        except Exception as e:
+            logger.error(f"Ошибка генерации недельного гороскопа: {e}")
+            return self._weekly_fallback(zodiac_sign)
+
+    async def generate_natal_chart_interpretation(self, birth_data: dict) -> str:
+        """Генерация интерпретации натальной карты"""
+        if self.model is None:
+            return "Извините, сервис генерации натальных карт временно недоступен."
+            
+        prompt = self._natal_prompt(birth_data)
+        
+        try:
+            response = await self._make_request(prompt)
+            return response
+        except Exception as e:
+            logger.error(f"Ошибка генерации натальной карты: {e}")
+            return "Извините, не удалось сгенерировать натальную карту. Проверьте введенные данные."
+
+    async def generate_tarot_reading(self, spread_type: str, spread_description: str, question: str = None) -> str:
+        """Генерация интерпретации расклада Таро"""
+        return await self._generate_tarot(
+            self._tarot_prompt(spread_type, spread_description, question), spread_type
+        )
+
+    async def generate_tarot_synthesis(self, spread_type: str, spread_description: str, question: str = None) -> str:
+        """Короткий итог расклада, толкования позиций которого уже готовы"""
+        return await self._generate_tarot(
+            self.tarot_synthesis_prompt(spread_type, spread_description, question), spread_type
+        )
+
+    async def _generate_tarot(self, prompt: str, spread_type: str) -> str:
+        """Толкование Таро через кэш толкований"""
+        # Тот же расклад уже толковался: повтор заказа, карта дня
+        cached = await tarot_cache.get(prompt)
+        if cached is not None:
+            return cached
+        
+        if self.model is None:
+            return "Извините, сервис раскладов Таро временно недоступен."
+            
+        try:
+            response = await self._make_request(prompt)
+            await tarot_cache.set(prompt, spread_type, response)
+            return response
+        except Exception as e:
+            logger.error(f"Ошибка генерации расклада Таро: {e}")
+            return "Извините, не удалось получить расклад. Попробуйте позже."
+
+    async def stream_horoscope(self, zodiac_sign: str, period: str = "сегодня") -> AsyncIterator[str]:
+        """Потоковая генерация гороскопа: текст отдается частями по мере готовности"""
+        cached = await horoscope_cache.get(zodiac_sign, period)
+        if cached is not None:
+            yield cached
+            return
+        
+        from .fallback_service import fallback_service
+        
+        async def store(text: str):
+            await horoscope_cache.set(zodiac_sign, period, text)
+        
+        async for chunk in self._stream_or_fallback(
+            self._horoscope_prompt(zodiac_sign, period),
+            lambda: fallback_service.generate_horoscope(zodiac_sign, period),
+            on_complete=store,
+            tier=TIER_FREE,
+            priority=PRIORITY_INTERACTIVE
+        ):
+            yield chunk
+
+    async def stream_weekly_horoscope(self, zodiac_sign: str, user_data: dict = None) -> AsyncIterator[str]:
+        """Потоковая генерация гороскопа на неделю"""
+        if not user_data:
+            cached = await horoscope_cache.get(zodiac_sign, "неделю")
+            if cached is not None:
+                yield cached
+                return
+        
+        async def store(text: str):
+            if not user_data:
+                await horoscope_cache.set(zodiac_sign, "неделю", text)
+        
+        async for chunk in self._stream_or_fallback(
+            self._weekly_prompt(zodiac_sign, user_data),
+            lambda: self._weekly_fallback(zodiac_sign),
+            on_complete=store
+        ):
+            yield chunk
+
+    async def stream_natal_chart_interpretation(self, birth_data: dict) -> AsyncIterator[str]:
+        """Потоковая генерация интерпретации натальной карты"""
+        if self.model is None:
+            yield "Извините, сервис генерации натальных карт временно недоступен."
+            return
+        
+        async for chunk in self._stream_or_fallback(
+            self._natal_prompt(birth_data),
+            lambda: "Извините, не удалось сгенерировать натальную карту. Проверьте введенные данные."
+        ):
+            yield chunk
+
+    async def stream_tarot_reading(self, spread_type: str, spread_description: str,
+                                   question: str = None) -> AsyncIterator[str]:
+        """Потоковая генерация интерпретации расклада Таро"""
+        prompt = self._tarot_prompt(spread_type, spread_description, question)
+        async for chunk in self._stream_tarot(prompt, spread_type):
+            yield chunk
+
+    async def stream_tarot_synthesis(self, spread_type: str, spread_description: str,
+                                     question: str = None) -> AsyncIterator[str]:
+        """Потоковая генерация короткого итога расклада"""
+        prompt = self.tarot_synthesis_prompt(spread_type, spread_description, question)
+        async for chunk in self._stream_tarot(prompt, spread_type):
+            yield chunk
+
+    async def _stream_tarot(self, prompt: str, spread_type: str) -> AsyncIterator[str]:
+        """Потоковое толкование Таро через кэш толкований"""
+        cached = await tarot_cache.get(prompt)
+        if cached is not None:
+            yield cached
+            return
+        
+        if self.model is None:
+            yield "Извините, сервис раскладов Таро временно недоступен."
+            return
+        
+        async def store(text: str):
+            await tarot_cache.set(prompt, spread_type, text)
+        
+        async for chunk in self._stream_or_fallback(
+            prompt,
+            lambda: "Извините, не удалось получить расклад. Попробуйте позже.",
+            on_complete=store
+        ):
+            yield chunk
+
+    async def pregenerate_horoscope(self, zodiac_sign: str, period: str, day: date) -> str:
+        """Заблаговременная генерация гороскопа в кэш (ошибки пробрасываются)"""
+        if period == "неделю":
+            prompt, tier = self._weekly_prompt(zodiac_sign), TIER_PAID
+        else:
+            prompt, tier = self._horoscope_prompt(zodiac_sign, period), TIER_FREE
+        
+        response = await self._make_request(prompt, tier, PRIORITY_BACKGROUND)
+        await horoscope_cache.set(zodiac_sign, period, response, day=day)
+        return response
+
+    async def pregenerate_compatibility(self, sign1: str, sign2: str, variant: int = 0,
+                                        priority: int = PRIORITY_BACKGROUND) -> str:
+        """Генерация варианта совместимости для матрицы (ошибки пробрасываются)"""
+        return await self._make_request(self.compatibility_prompt(sign1, sign2, variant), TIER_PAID, priority)
+
+    async def pregenerate_tarot_fragment(self, spread_type: str, position: str, card_name: str,
+                                         orientation: str, priority: int = PRIORITY_BACKGROUND) -> str:
+        """Генерация толкования карты в позиции для хранилища толкований (ошибки пробрасываются)"""
+        return await self._make_request(
+            self.tarot_fragment_prompt(spread_type, position, card_name, orientation), TIER_PAID, priority
+        )
+
+    # Акценты вариантов матрицы совместимости: одинаковый промпт дал бы одинаковый текст
+    COMPATIBILITY_ACCENTS = (
+        "стихии знаков и их взаимодействие",
+        "управляющие планеты знаков",
+        "эмоциональная близость и быт",
+        "развитие отношений со временем",
+        "типичные ситуации из жизни пары"
+    )
+
+    def compatibility_prompt(self, sign1: str, sign2: str, variant: int = None) -> str:
+        """Промпт анализа совместимости; variant - номер варианта текста для матрицы"""
+        accent = ""
+        if variant is not None:
+            accent = (f"Вариант текста №{variant + 1}. Особый акцент: "
+                      f"{self.COMPATIBILITY_ACCENTS[variant % len(self.COMPATIBILITY_ACCENTS)]}.")
+        
+        return f"""
         Проанализируй астрологическую совместимость между знаками {sign1} и {sign2}.
+        {accent}
         
         Структура анализа:
         1. Общая характеристика пары
@@ -95,32 +443,28 @@ class GeminiService:
         Будь объективным, тактичным и профессиональным.
         Объем: 250-300 слов. На русском языке.
         """
-        
-        try:
-            response = await self._make_request(prompt)
-            return response
-        except Exception as e:
-            logger.error(f"Ошибка генерации совместимости: {e}")
-            from .fallback_service import fallback_service
-            return fallback_service.generate_compatibility(sign1, sign2)
 
-    async def generate_weekly_horoscope(self, zodiac_sign: str, user_data: dict = None) -> str:
-        """Генерация расширенного гороскопа на неделю"""
-        if self.model is None:
-            from .fallback_service import fallback_service
-            return f"""
-📅 Гороскоп на неделю для {zodiac_sign}
-
-{fallback_service.generate_horoscope(zodiac_sign, "неделю")}
-
-<em>Сервис AI временно недоступен. Это упрощенная версия гороскопа.</em>
-"""
+    def _horoscope_prompt(self, zodiac_sign: str, period: str) -> str:
+        """Промпт краткого гороскопа"""
+        return f"""
+        Напиши краткий астрологический прогноз для знака зодиака {zodiac_sign} на {period}.
+        Будь позитивным и вдохновляющим. Объем: 100-150 слов.
+        Формат:
+        - Общее описание дня
+        - Энергетика и настроение  
+        - Совет дня
+        - Что стоит учитывать
         
+        Пиши на русском языке.
+        """
+
+    def _weekly_prompt(self, zodiac_sign: str, user_data: dict = None) -> str:
+        """Промпт гороскопа на неделю"""
         user_context = ""
         if user_data:
             user_context = f"Дополнительная информация о пользователе: {user_data}"
         
-        prompt = f"""
+        return f"""
         Напиши подробный астрологический прогноз на предстоящую неделю для знака {zodiac_sign}.
         {user_context}
         
@@ -135,27 +479,10 @@ class GeminiService:
         
         Будь конкретным и практичным. Объем: 400-500 слов. На русском языке.
         """
-        
-        try:
-            response = await self._make_request(prompt)
-            return response
-        except Exception as e:
-            logger.error(f"Ошибка генерации недельного гороскопа: {e}")
-            from .fallback_service import fallback_service
-            return f"""
-📅 Гороскоп на неделю для {zodiac_sign}
 
-{fallback_service.generate_horoscope(zodiac_sign, "неделю")}
-
-<em>Сервис AI временно недоступен. Это упрощенная версия гороскопа.</em>
-"""
-
-    async def generate_natal_chart_interpretation(self, birth_data: dict) -> str:
-        """Генерация интерпретации натальной карты"""
-        if self.model is None:
-            return "Извините, сервис генерации натальных карт временно недоступен."
-            
-        prompt = f"""
+    def _natal_prompt(self, birth_data: dict) -> str:
+        """Промпт интерпретации натальной карты"""
+        return f"""
         Как профессиональный астролог, проанализируй натальную карту на основе данных:
         - Дата рождения: {birth_data.get('birth_date')}
         - Время рождения: {birth_data.get('birth_time')}
@@ -173,30 +500,22 @@ class GeminiService:
         
         Будь глубоким, тактичным и вдохновляющим. Объем: 500-600 слов. На русском языке.
         """
-        
-        try:
-            response = await self._make_request(prompt)
-            return response
-        except Exception as e:
-            logger.error(f"Ошибка генерации натальной карты: {e}")
-            return "Извините, не удалось сгенерировать натальную карту. Проверьте введенные данные."
 
-    async def generate_tarot_reading(self, spread_type: str, question: str = None) -> str:
-        """Генерация интерпретации расклада Таро"""
-        if self.model is None:
-            return "Извините, сервис раскладов Таро временно недоступен."
-            
-        spreads = {
-            "celtic": "Кельтский крест - глубокий анализ текущей ситуации",
-            "three": "Расклад на 3 карты - прошлое, настоящее, будущее",
-            "four": "Расклад на 4 карты - ситуация, вызовы, совет, результат",
-            "daily": "Карта дня - совет на сегодняшний день"
-        }
-        
-        spread_description = spreads.get(spread_type, spread_type)
+    TAROT_SPREADS = {
+        "celtic": "Кельтский крест - глубокий анализ текущей ситуации",
+        "three": "Расклад на 3 карты - прошлое, настоящее, будущее",
+        "four": "Расклад на 4 карты - ситуация, вызовы, совет, результат",
+        "daily": "Карта дня - совет на сегодняшний день"
+    }
+
+    def _tarot_prompt(self, spread_type: str, spread_description: str, question: str = None) -> str:
+        """Промпт интерпретации расклада Таро"""
+        spread_title = self.TAROT_SPREADS.get(spread_type, spread_type)
         
-        prompt = f"""
-        Как опытный таролог, интерпретируй расклад карт Таро: {spread_description}
+        return f"""
+        Как опытный таролог, интерпретируй расклад карт Таро: {spread_title}
+        Карты по позициям:
+        {spread_description}
         {"Вопрос пользователя: " + question if question else "Общий запрос на insight"}
         
         Структура интерпретации:
@@ -210,30 +529,221 @@ class GeminiService:
         Будь мудрым, поддерживающим и избегай категоричных предсказаний.
         Объем: 300-400 слов. На русском языке.
         """
+
+    def tarot_fragment_prompt(self, spread_type: str, position: str, card_name: str, orientation: str) -> str:
+        """Промпт толкования одной карты в одной позиции расклада"""
+        spread_description = self.TAROT_SPREADS.get(spread_type, spread_type)
+        volume = "150-200 слов" if spread_type == "daily" else "60-80 слов"
         
+        return f"""
+        Как опытный таролог, истолкуй карту {card_name} ({orientation} положение)
+        в позиции «{position}» расклада: {spread_description}
+        
+        Опиши, что карта значит именно в этой позиции, и дай практический совет.
+        Пиши сразу по существу, без приветствий и без повторения названия расклада.
+        Будь мудрым, поддерживающим и избегай категоричных предсказаний.
+        Объем: {volume}. На русском языке.
+        """
+
+    def tarot_synthesis_prompt(self, spread_type: str, spread_description: str, question: str = None) -> str:
+        """Промпт короткого итога расклада"""
+        spread_title = self.TAROT_SPREADS.get(spread_type, spread_type)
+        
+        return f"""
+        Как опытный таролог, подведи итог расклада Таро: {spread_title}
+        Карты по позициям:
+        {spread_description}
+        {"Вопрос пользователя: " + question if question else ""}
+        
+        Толкование каждой позиции пользователь уже получил, не повторяй его.
+        Напиши один абзац: общая энергетика расклада, связь карт между собой
+        и главный практический совет. Избегай категоричных предсказаний.
+        Объем: 80-120 слов. На русском языке.
+        """
+
+    def _weekly_fallback(self, zodiac_sign: str) -> str:
+        """Упрощенный гороскоп на неделю, когда Gemini недоступен"""
+        from .fallback_service import fallback_service
+        return f"""
+📅 Гороскоп на неделю для {zodiac_sign}
+
+{fallback_service.generate_horoscope(zodiac_sign, "неделю")}
+
+<em>Сервис AI временно недоступен. Это упрощенная версия гороскопа.</em>
+"""
+
+    async def _make_request(self, prompt: str, tier: str = TIER_PAID, priority: int = PRIORITY_PAID) -> str:
+        """Базовый метод для запросов к Gemini"""
+        return await self._single_flight.do(
+            self._flight_key(prompt, tier, priority), partial(self._call_model, prompt, tier, priority)
+        )
+
+    def _flight_key(self, prompt: str, tier: str, priority: int) -> tuple:
+        """
+        Ключ объединения одинаковых запросов. Запрос присоединяется только к вызову
+        не ниже своего приоритета: иначе платный запрос ждал бы в очереди вместе с фоновым.
+        """
+        for running in sorted(PRIORITY_NAMES):
+            if running > priority:
+                break
+            key = (prompt, tier, running)
+            if self._single_flight.is_running(key):
+                return key
+        return prompt, tier, priority
+
+    async def _call_model(self, prompt: str, tier: str = TIER_PAID, priority: int = PRIORITY_PAID) -> str:
+        """Запрос через маршрутизатор: лучшая модель, переключение при ошибках"""
         try:
-            response = await self._make_request(prompt)
-            return response
+            return await self._router.execute(partial(self._call_single_model, prompt, priority), tier)
         except Exception as e:
-            logger.error(f"Ошибка генерации расклада Таро: {e}")
-            return "Извините, не удалось получить расклад. Попробуйте позже."
+            logger.error(f"Ошибка запроса к Gemini: {e}")
+            raise
 
-    async def _make_request(self, prompt: str) -> str:
-        """Базовый метод для запросов к Gemini"""
+    async def _call_single_model(self, prompt: str, priority: int, model) -> str:
+        """Один запрос к модели в порядке очереди и с таймаутом"""
         try:
-            response = self.model.generate_content(
-                prompt,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=0.7,
-                    top_p=0.8,
-                    max_output_tokens=1500
+            async with self._scheduler.slot(priority, self._estimate_tokens(prompt)):
+                response = await asyncio.wait_for(
+                    self._generate_content(prompt, model),
+                    timeout=GEMINI_REQUEST_TIMEOUT
                 )
-            )
             return response.text
-        except Exception as e:
-            logger.error(f"Ошибка запроса к Gemini: {e}")
+        except asyncio.TimeoutError:
+            logger.error(f"Таймаут запроса к Gemini ({GEMINI_REQUEST_TIMEOUT} с)")
             raise
 
+    async def _stream_or_fallback(self, prompt: str, fallback: Callable[[], str],
+                                  on_complete: Optional[Callable[[str], object]] = None,
+                                  tier: str = TIER_PAID,
+                                  priority: int = PRIORITY_PAID) -> AsyncIterator[str]:
+        """Поток частей ответа; если модель не ответила ничего - резервный текст целиком"""
+        if self.model is None:
+            yield fallback()
+            return
+        
+        parts = []
+        try:
+            async for chunk in self._stream_request(prompt, tier, priority):
+                parts.append(chunk)
+                yield chunk
+        except Exception as e:
+            logger.error(f"Ошибка потоковой генерации: {e}")
+            # Часть текста уже показана - замена на резервный текст только запутает
+            if parts:
+                raise
+            yield fallback()
+            return
+        
+        if on_complete is not None:
+            await on_complete("".join(parts))
+
+    async def _stream_request(self, prompt: str, tier: str = TIER_PAID,
+                              priority: int = PRIORITY_PAID) -> AsyncIterator[str]:
+        """Потоковый запрос: части текста по мере генерации, до первой части - переключение между моделями"""
+        # Такой же запрос уже выполняется - присоединяемся к нему и отдаем ответ целиком
+        if self._single_flight.is_running(self._flight_key(prompt, tier, priority)) or not hasattr(self.model, "generate_content_async"):
+            yield await self._make_request(prompt, tier, priority)
+            return
+        
+        last_error = None
+        for model_name in self._router.candidates(tier):
+            if not self._router.acquire(model_name):
+                continue
+            
+            started = time.monotonic()
+            streamed = False
+            stream = self._stream_model(prompt, self._router.models[model_name], priority)
+            try:
+                async for text in stream:
+                    streamed = True
+                    yield text
+            except (asyncio.CancelledError, GeneratorExit, UpstreamOverloadedError):
+                self._router.release(model_name)
+                raise
+            except Exception as e:
+                self._router.record(model_name, False, time.monotonic() - started)
+                # Часть текста уже отдана - продолжить на другой модели нельзя
+                if streamed:
+                    raise
+                logger.warning(f"⚠️ Ошибка потоковой генерации на {model_name}: {e}")
+                last_error = e
+                continue
+            finally:
+                # Освобождаем слот параллельности сразу, не дожидаясь сборщика мусора
+                await stream.aclose()
+            
+            self._router.record(model_name, True, time.monotonic() - started)
+            return
+        
+        raise last_error or NoHealthyModelError("Нет доступных моделей Gemini")
+
+    async def _stream_model(self, prompt: str, model, priority: int) -> AsyncIterator[str]:
+        """Потоковый запрос к одной модели"""
+        loop = asyncio.get_running_loop()
+        async with self._scheduler.slot(priority, self._estimate_tokens(prompt)):
+            deadline = loop.time() + GEMINI_REQUEST_TIMEOUT
+            try:
+                response = await asyncio.wait_for(
+                    model.generate_content_async(
+                        prompt,
+                        generation_config=self.generation_config,
+                        stream=True
+                    ),
+                    timeout=GEMINI_REQUEST_TIMEOUT
+                )
+                chunks = response.__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(
+                            chunks.__anext__(),
+                            timeout=max(0.0, deadline - loop.time())
+                        )
+                    except StopAsyncIteration:
+                        break
+                    
+                    try:
+                        text = chunk.text
+                    except ValueError:
+                        # Служебный фрагмент без текста
+                        continue
+                    if text:
+                        yield text
+            except asyncio.TimeoutError:
+                logger.error(f"Таймаут потокового запроса к Gemini ({GEMINI_REQUEST_TIMEOUT} с)")
+                raise
+
+    def _estimate_tokens(self, prompt: str) -> int:
+        """Оценка токенов запроса для лимита TPM: промпт и максимум ответа"""
+        return len(prompt) // 3 + self.generation_config.max_output_tokens
+
+    async def _generate_content(self, prompt: str, model=None):
+        """Вызов модели без блокировки event loop"""
+        model = model or self.model
+        # Нативный async API SDK, иначе - вызов в ограниченном пуле потоков
+        if hasattr(model, "generate_content_async"):
+            return await model.generate_content_async(
+                prompt,
+                generation_config=self.generation_config
+            )
+        
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            partial(model.generate_content, prompt, generation_config=self.generation_config)
+        )
+
+    def get_stats(self) -> dict:
+        """Статистика сервиса генерации"""
+        return {
+            "model": self.model_name,
+            "model_health": self.model_health,
+            "router": self._router.get_stats(),
+            "upstream": self._scheduler.get_stats(),
+            "single_flight": self._single_flight.get_stats(),
+            "horoscope_cache": horoscope_cache.get_stats(),
+            "tarot_cache": tarot_cache.get_stats()
+        }
+
     async def _get_fallback_horoscope(self, zodiac_sign: str, period: str) -> str:
         """Запасной вариант гороскопа при ошибке API"""
         from .fallback_service import fallback_service
@@ -0,0 +1,172 @@
+# services/horoscope_cache.py
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Dict, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from config import HOROSCOPE_TIMEZONE, HOROSCOPE_CACHE_SIZE, HOROSCOPE_CACHE_TTL, HOROSCOPE_CACHE_PERSIST
+from database import Database, db
+
+logger = logging.getLogger(__name__)
+
+# Недельный прогноз должен жить всю неделю, даже если сгенерирован заранее
+WEEKLY_TTL = 8 * 24 * 3600
+
+class HoroscopeCache:
+    """Общий кэш гороскопов по ключу (знак, дата, период)"""
+
+    def __init__(self, database: Database = None, max_size: int = HOROSCOPE_CACHE_SIZE,
+                 ttl: int = HOROSCOPE_CACHE_TTL, timezone: str = HOROSCOPE_TIMEZONE,
+                 persist: bool = HOROSCOPE_CACHE_PERSIST):
+        self.db = database or db
+        self.max_size = max_size
+        self.ttl = ttl
+        self.persist = persist
+
+        try:
+            self.timezone = ZoneInfo(timezone)
+        except ZoneInfoNotFoundError:
+            logger.warning(f"⚠️ Часовой пояс {timezone} не найден, используем UTC")
+            self.timezone = ZoneInfo("UTC")
+
+        # key -> (expires_at, text), порядок = порядок последнего использования
+        self._entries: "OrderedDict[Tuple[str, str, str], Tuple[float, str]]" = OrderedDict()
+
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+        if self.persist:
+            self._purge_expired()
+
+    def _purge_expired(self):
+        """Удаление записей, срок которых давно истек"""
+        try:
+            with self.db.get_connection() as conn:
+                now = time.time()
+                conn.execute('''
+                    DELETE FROM horoscope_cache
+                    WHERE (period != 'неделю' AND created_at < ?) OR created_at < ?
+                ''', (now - self.ttl, now - max(self.ttl, WEEKLY_TTL)))
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка очистки кэша гороскопов: {e}")
+
+    def today(self) -> date:
+        """Текущая дата в настроенном часовом поясе"""
+        return datetime.now(self.timezone).date()
+
+    def period_date(self, period: str, day: date = None) -> date:
+        """Дата, к которой привязан прогноз на указанный период"""
+        day = day or self.today()
+        if period == "завтра":
+            return day + timedelta(days=1)
+        if period == "неделю":
+            # Недельный прогноз привязан к понедельнику
+            return day - timedelta(days=day.weekday())
+        return day
+
+    def make_key(self, zodiac_sign: str, period: str, day: date = None) -> Tuple[str, str, str]:
+        """Ключ кэша"""
+        return (zodiac_sign, period, self.period_date(period, day).isoformat())
+
+    async def get(self, zodiac_sign: str, period: str = "сегодня", day: date = None) -> Optional[str]:
+        """Получить гороскоп из кэша"""
+        text, tier = await self._lookup(self.make_key(zodiac_sign, period, day))
+        if tier == "memory":
+            self.hits += 1
+        elif tier == "persistent":
+            self.persistent_hits += 1
+        else:
+            self.misses += 1
+        return text
+
+    async def has(self, zodiac_sign: str, period: str = "сегодня", day: date = None) -> bool:
+        """Проверить наличие гороскопа без учета в статистике"""
+        text, _ = await self._lookup(self.make_key(zodiac_sign, period, day))
+        return text is not None
+
+    async def _lookup(self, key: Tuple[str, str, str]) -> Tuple[Optional[str], Optional[str]]:
+        """Поиск по уровням кэша: (текст, уровень)"""
+        now = time.time()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, text = entry
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                return text, "memory"
+            del self._entries[key]
+
+        if self.persist:
+            text = await self._load(key, now)
+            if text is not None:
+                self._remember(key, text, now)
+                return text, "persistent"
+
+        return None, None
+
+    async def set(self, zodiac_sign: str, period: str, text: str, day: date = None):
+        """Сохранить гороскоп в кэш"""
+        key = self.make_key(zodiac_sign, period, day)
+        now = time.time()
+        self._remember(key, text, now)
+
+        if self.persist:
+            await self._store(key, text, now)
+
+    def _remember(self, key: Tuple[str, str, str], text: str, created_at: float):
+        """Положить запись в память с вытеснением самых старых"""
+        self._entries[key] = (created_at + self._ttl_for(key), text)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _ttl_for(self, key: Tuple[str, str, str]) -> int:
+        """Время жизни записи с учетом периода"""
+        if key[1] == "неделю":
+            return max(self.ttl, WEEKLY_TTL)
+        return self.ttl
+
+    async def _load(self, key: Tuple[str, str, str], now: float) -> Optional[str]:
+        """Чтение из постоянного кэша"""
+        try:
+            row = await self.db.fetchone('''
+                SELECT content, created_at FROM horoscope_cache
+                WHERE zodiac_sign = ? AND period = ? AND period_date = ?
+            ''', key)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка чтения кэша гороскопов: {e}")
+            return None
+
+        if row and row[1] + self._ttl_for(key) > now:
+            return row[0]
+        return None
+
+    async def _store(self, key: Tuple[str, str, str], text: str, created_at: float):
+        """Запись в постоянный кэш"""
+        try:
+            await self.db.execute('''
+                INSERT OR REPLACE INTO horoscope_cache
+                (zodiac_sign, period, period_date, content, created_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (*key, text, created_at))
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка записи кэша гороскопов: {e}")
+
+    def get_stats(self) -> Dict[str, float]:
+        """Статистика попаданий в кэш"""
+        total = self.hits + self.persistent_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.persistent_hits) / total if total else 0.0
+        }
+
+# Создаем глобальный экземпляр кэша
+horoscope_cache = HoroscopeCache()
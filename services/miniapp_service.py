@@ -46,7 +46,7 @@ class MiniAppService:
     async def get_user_data(self, user_id: int) -> Dict[str, Any]:
         """Получение данных пользователя для MiniApp"""
         try:
-            user = db.get_user(user_id)
+            user = await db.get_user_profile(user_id)
             
             user_data = {
                 "id": user_id,
@@ -56,8 +56,8 @@ class MiniAppService:
             
             if user:
                 user_data.update({
-                    "name": user[3] or "Пользователь",
-                    "zodiac": user[6] or "Не указан"
+                    "name": user["first_name"] or "Пользователь",
+                    "zodiac": user["zodiac_sign"] or "Не указан"
                 })
             
             return user_data
@@ -0,0 +1,297 @@
+# services/model_router.py
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+from config import (
+    GEMINI_BREAKER_COOLDOWN,
+    GEMINI_BREAKER_ERROR_RATE,
+    GEMINI_BREAKER_FAILURES,
+    GEMINI_BREAKER_MAX_COOLDOWN,
+    GEMINI_FREE_MODELS,
+    GEMINI_HEDGE_DELAY,
+    GEMINI_STATS_WINDOW
+)
+
+from .upstream_scheduler import UpstreamOverloadedError
+
+logger = logging.getLogger(__name__)
+
+# Классы запросов: бесплатный контент идет на дешевые модели
+TIER_FREE = "free"
+TIER_PAID = "paid"
+
+class NoHealthyModelError(Exception):
+    """Нет ни одной модели, которой можно отправить запрос"""
+
+class CircuitBreaker:
+    """Автомат отключения модели: closed -> open после ошибок -> half_open с одной пробной попыткой"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = GEMINI_BREAKER_FAILURES,
+                 cooldown: float = GEMINI_BREAKER_COOLDOWN,
+                 max_cooldown: float = GEMINI_BREAKER_MAX_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+
+        self.state = self.CLOSED
+        self.failures = 0
+        self.cooldown = cooldown
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+    def available(self) -> bool:
+        """Можно ли сейчас отправить запрос (без захвата пробной попытки)"""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self._opened_at < self.cooldown:
+            return False
+        return not self._trial_in_flight
+
+    def acquire(self) -> bool:
+        """Разрешение на запрос; в half_open - только одна пробная попытка"""
+        if not self.available():
+            return False
+        if self.state == self.OPEN:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            self._trial_in_flight = True
+        return True
+
+    def release(self):
+        """Запрос отменен, не дождавшись результата"""
+        self._trial_in_flight = False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.cooldown = self.base_cooldown
+        self._trial_in_flight = False
+
+    def record_failure(self, error_rate: float = 0.0, enough_samples: bool = False):
+        self.failures += 1
+        if self.state == self.HALF_OPEN:
+            # Пробная попытка не удалась - ждем дольше
+            self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+            self.trip()
+        elif self.failures >= self.failure_threshold or (enough_samples and error_rate >= GEMINI_BREAKER_ERROR_RATE):
+            self.trip()
+
+    def trip(self):
+        """Отключить модель на cooldown секунд"""
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._trial_in_flight = False
+
+class ModelStats:
+    """Задержки и ошибки модели в скользящем окне последних запросов"""
+
+    def __init__(self, window: int = GEMINI_STATS_WINDOW):
+        self._samples: Deque[Tuple[bool, float]] = deque(maxlen=window)
+
+    def record(self, ok: bool, latency: float):
+        self._samples.append((ok, latency))
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Перцентиль задержки успешных запросов"""
+        latencies = sorted(latency for ok, latency in self._samples if ok)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * q))]
+
+    @property
+    def error_rate(self) -> float:
+        if not self._samples:
+            return 0.0
+        return sum(1 for ok, _ in self._samples if not ok) / len(self._samples)
+
+class ModelRouter:
+    """
+    Выбор модели для каждого запроса: самая быстрая по p50 среди доступных,
+    переключение на следующую при ошибке и страховочный запрос, если основная
+    модель не ответила за hedge_delay секунд.
+    """
+
+    # Меньше стольких запросов в окне доля ошибок не учитывается
+    MIN_SAMPLES = 10
+
+    def __init__(self, priority: List[str], free_models: Iterable[str] = GEMINI_FREE_MODELS,
+                 hedge_delay: float = GEMINI_HEDGE_DELAY):
+        self.priority = list(priority)
+        self.free_models = set(free_models)
+        self.hedge_delay = hedge_delay
+
+        self.models: Dict[str, Any] = {}
+        self.stats: Dict[str, ModelStats] = {name: ModelStats() for name in self.priority}
+        self.breakers: Dict[str, CircuitBreaker] = {name: CircuitBreaker() for name in self.priority}
+
+        self.requests = 0
+        self.failovers = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def add_model(self, name: str, model: Any, latency: Optional[float] = None, healthy: bool = True):
+        """Подключить модель по результатам проверки"""
+        if name not in self.stats:
+            self.priority.append(name)
+            self.stats[name] = ModelStats()
+            self.breakers[name] = CircuitBreaker()
+        self.models[name] = model
+        if latency is not None:
+            self.stats[name].record(True, latency)
+        if not healthy:
+            # Проверка не прошла - модель получит пробный запрос после паузы
+            self.breakers[name].trip()
+
+    def candidates(self, tier: str = TIER_PAID) -> List[str]:
+        """Доступные модели в порядке выбора для класса запроса"""
+        available = [name for name in self.priority if name in self.models and self.breakers[name].available()]
+
+        def key(name: str):
+            # Бесплатный контент - сначала дешевые модели, платный - сначала полноценные
+            preferred = (name in self.free_models) == (tier == TIER_FREE)
+            p50 = self.stats[name].percentile(0.5)
+            return (not preferred, p50 if p50 is not None else float("inf"), self.priority.index(name))
+
+        return sorted(available, key=key)
+
+    def acquire(self, name: str) -> bool:
+        """Разрешение автомата отключения на запрос к модели"""
+        return self.breakers[name].acquire()
+
+    def release(self, name: str):
+        """Запрос к модели отменен без результата"""
+        self.breakers[name].release()
+
+    def record(self, name: str, ok: bool, latency: float):
+        """Учесть результат запроса к модели"""
+        stats = self.stats[name]
+        stats.record(ok, latency)
+        breaker = self.breakers[name]
+        if ok:
+            if breaker.state != CircuitBreaker.CLOSED:
+                logger.info(f"✅ Модель {name} снова доступна")
+            breaker.record_success()
+            return
+
+        was_open = breaker.state == CircuitBreaker.OPEN
+        breaker.record_failure(stats.error_rate, len(stats) >= self.MIN_SAMPLES)
+        if breaker.state == CircuitBreaker.OPEN and not was_open:
+            logger.warning(f"⚠️ Модель {name} отключена на {breaker.cooldown:.0f} с "
+                           f"(ошибок подряд: {breaker.failures}, доля ошибок: {stats.error_rate:.0%})")
+
+    async def execute(self, attempt: Callable[[Any], Awaitable[Any]], tier: str = TIER_PAID) -> Any:
+        """Выполнить attempt(model) на лучшей модели с переключением и страховочным запросом"""
+        self.requests += 1
+        candidates = iter(self.candidates(tier))
+        tasks: Dict[asyncio.Task, str] = {}
+        started: Dict[asyncio.Task, float] = {}
+        hedge_task: Optional[asyncio.Task] = None
+        last_error: Optional[BaseException] = None
+
+        def launch() -> Optional[asyncio.Task]:
+            for name in candidates:
+                if self.acquire(name):
+                    task = asyncio.create_task(self._timed(name, attempt))
+                    # Результат проигравшего запроса никому не нужен
+                    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+                    tasks[task] = name
+                    started[task] = time.monotonic()
+                    return task
+            return None
+
+        hedged = False
+        overloaded = False
+        launch()
+        try:
+            while tasks:
+                can_hedge = not hedged and self.hedge_delay > 0 and len(tasks) == 1
+                done, _ = await asyncio.wait(
+                    tasks,
+                    timeout=self.hedge_delay if can_hedge else None,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+
+                if not done:
+                    # Основная модель отвечает слишком долго - параллельный запрос к следующей
+                    hedged = True
+                    hedge_task = launch()
+                    if hedge_task is not None:
+                        self.hedged += 1
+                    continue
+
+                for task in done:
+                    name = tasks.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        if task is hedge_task:
+                            self.hedge_wins += 1
+                        # Проигравшая модель работала как минимум столько - учитываем в p50/p95
+                        for loser in tasks:
+                            self.stats[tasks[loser]].record(True, time.monotonic() - started[loser])
+                        return task.result()
+                    
+                    last_error = error
+                    if isinstance(error, UpstreamOverloadedError):
+                        # Очередь общая для всех моделей - переключение не поможет
+                        overloaded = True
+                    else:
+                        logger.warning(f"⚠️ Ошибка модели {name}: {error}")
+
+                if not tasks and not overloaded and launch() is not None:
+                    self.failovers += 1
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        if last_error is not None:
+            raise last_error
+        raise NoHealthyModelError("Нет доступных моделей Gemini")
+
+    async def _timed(self, name: str, attempt: Callable[[Any], Awaitable[Any]]) -> Any:
+        """Запрос к модели с учетом задержки и результата"""
+        started = time.monotonic()
+        try:
+            result = await attempt(self.models[name])
+        except (asyncio.CancelledError, UpstreamOverloadedError):
+            # Отмена или перегрузка нашей очереди ничего не говорят о модели
+            self.release(name)
+            raise
+        except Exception:
+            self.record(name, False, time.monotonic() - started)
+            raise
+        self.record(name, True, time.monotonic() - started)
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Состояние моделей и статистика маршрутизации"""
+        models = {}
+        for name in self.priority:
+            if name not in self.models:
+                continue
+            stats = self.stats[name]
+            p50 = stats.percentile(0.5)
+            p95 = stats.percentile(0.95)
+            models[name] = {
+                "state": self.breakers[name].state,
+                "samples": len(stats),
+                "p50": round(p50, 3) if p50 is not None else None,
+                "p95": round(p95, 3) if p95 is not None else None,
+                "error_rate": round(stats.error_rate, 3)
+            }
+        return {
+            "requests": self.requests,
+            "failovers": self.failovers,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "models": models
+        }
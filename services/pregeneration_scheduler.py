@@ -0,0 +1,128 @@
+# services/pregeneration_scheduler.py
+import asyncio
+import logging
+from datetime import date, datetime, time as dt_time, timedelta
+from typing import List, Optional, Tuple
+
+from config import (
+    PREGENERATION_CONCURRENCY,
+    PREGENERATION_INTERVAL,
+    PREGENERATION_RETRIES,
+    PREGENERATION_WINDOW
+)
+from keyboards import ZODIAC_SIGNS
+from utils.async_utils import Throttle, retry_with_jitter
+from .gemini_service import gemini_service
+from .horoscope_cache import horoscope_cache
+
+logger = logging.getLogger(__name__)
+
+# Пауза перед повтором после ошибки в цикле планировщика
+ERROR_RETRY_DELAY = 60
+
+class PregenerationScheduler:
+    """Заблаговременная генерация гороскопов для всех знаков"""
+
+    def __init__(self, window_minutes: int = PREGENERATION_WINDOW,
+                 concurrency: int = PREGENERATION_CONCURRENCY,
+                 interval: float = PREGENERATION_INTERVAL,
+                 retries: int = PREGENERATION_RETRIES):
+        self.window = timedelta(minutes=window_minutes)
+        self.concurrency = concurrency
+        self.interval = interval
+        self.retries = retries
+
+        self._task: Optional[asyncio.Task] = None
+        self._warmed_day: Optional[date] = None
+        self._throttle = Throttle(interval)
+
+    def start(self):
+        """Запуск планировщика в фоне"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"✅ Планировщик генерации гороскопов запущен (окно {self.window})")
+
+    async def stop(self):
+        """Остановка планировщика"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        """Основной цикл: прогрев текущего дня, затем каждую ночь - следующего"""
+        # Модель выбирается в фоне при запуске
+        await gemini_service.wait_ready()
+        try:
+            await self.warm_up(horoscope_cache.today(), include_weekly=True)
+        except Exception as e:
+            logger.error(f"❌ Ошибка прогрева гороскопов на сегодня: {e}")
+
+        # Ошибка одной ночи не останавливает планировщик, цикл прерывает только отмена
+        while True:
+            try:
+                await self._warm_up_next_day()
+            except Exception as e:
+                logger.error(f"❌ Ошибка планировщика генерации: {e}. Повтор через {ERROR_RETRY_DELAY} с")
+                await asyncio.sleep(ERROR_RETRY_DELAY)
+
+    async def _warm_up_next_day(self):
+        """Дождаться окна перед полуночью и прогреть следующий день"""
+        target = horoscope_cache.today() + timedelta(days=1)
+        if self._warmed_day is not None and target <= self._warmed_day:
+            target = self._warmed_day + timedelta(days=1)
+
+        midnight = datetime.combine(target, dt_time.min, tzinfo=horoscope_cache.timezone)
+        delay = (midnight - self.window - datetime.now(horoscope_cache.timezone)).total_seconds()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        # Недельный прогноз готовим на границе недели
+        await self.warm_up(target, include_weekly=target.weekday() == 0)
+
+    async def warm_up(self, day: date, include_weekly: bool = False):
+        """Сгенерировать недостающие гороскопы на указанный день"""
+        if gemini_service.model is None:
+            logger.warning("⚠️ Gemini недоступен, заблаговременная генерация пропущена")
+            return
+
+        jobs: List[Tuple[str, str]] = [(sign, "сегодня") for sign, _ in ZODIAC_SIGNS]
+        if include_weekly:
+            jobs += [(sign, "неделю") for sign, _ in ZODIAC_SIGNS]
+
+        jobs = [(sign, period) for sign, period in jobs if not await horoscope_cache.has(sign, period, day)]
+        if not jobs:
+            self._warmed_day = day
+            return
+
+        logger.info(f"🔄 Генерация {len(jobs)} гороскопов на {day.isoformat()}")
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run_job(sign: str, period: str) -> bool:
+            async with semaphore:
+                return await self._generate_with_retries(sign, period, day)
+
+        results = await asyncio.gather(*(run_job(sign, period) for sign, period in jobs))
+        self._warmed_day = day
+
+        logger.info(f"✅ Заблаговременно сгенерировано {sum(results)}/{len(jobs)} гороскопов на {day.isoformat()}")
+
+    async def _generate_with_retries(self, sign: str, period: str, day: date) -> bool:
+        """Генерация одного гороскопа с повторами и случайной задержкой"""
+        try:
+            await retry_with_jitter(
+                lambda: gemini_service.pregenerate_horoscope(sign, period, day),
+                retries=self.retries,
+                base_delay=self.interval,
+                throttle=self._throttle,
+                description=f"генерацию {sign}/{period}"
+            )
+            return True
+        except Exception:
+            return False
+
+# Создаем глобальный экземпляр планировщика
+pregeneration_scheduler = PregenerationScheduler()
@@ -0,0 +1,67 @@
+# services/single_flight.py
+import asyncio
+import logging
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+class _Call:
+    """Выполняющийся вызов и число его ожидающих"""
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+class SingleFlight:
+    """Объединение одинаковых одновременных запросов в один вызов"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+
+        self.calls = 0
+        self.executions = 0
+        self.deduplicated = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Выполнить func один раз для всех одновременных вызовов с ключом key"""
+        self.calls += 1
+
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(func()))
+            call.task.add_done_callback(partial(self._forget, key, call))
+            self._calls[key] = call
+            self.executions += 1
+        else:
+            self.deduplicated += 1
+
+        call.waiters += 1
+        try:
+            # shield: отмена одного ожидающего не отменяет вызов для остальных,
+            # а результат, ошибка или отмена самого вызова получают все
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Результат больше никому не нужен
+                call.task.cancel()
+
+    def is_running(self, key: Hashable) -> bool:
+        """Выполняется ли сейчас вызов с ключом key"""
+        return key in self._calls
+
+    def _forget(self, key: Hashable, call: _Call, task: asyncio.Future):
+        """Убрать завершенный вызов, чтобы следующий запрос ушел заново"""
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def get_stats(self) -> Dict[str, int]:
+        """Статистика объединения запросов"""
+        return {
+            "calls": self.calls,
+            "executions": self.executions,
+            "deduplicated": self.deduplicated,
+            "in_flight": len(self._calls)
+        }
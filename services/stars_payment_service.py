@@ -62,29 +62,6 @@ class StarsPaymentService:
             "start_parameter": service_type
         }
 
-    async def process_successful_payment(self, user_id: int, payload: str, total_amount: int) -> bool:
-        """Обработка успешного платежа"""
-        try:
-            # Парсим payload для определения типа услуги
-            parts = payload.split("_")
-            service_type = parts[0]
-            
-            # Логируем платеж
-            with db.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT INTO payments (user_id, service_type, amount_stars, status)
-                    VALUES (?, ?, ?, 'completed')
-                ''', (user_id, service_type, total_amount))
-                conn.commit()
-
-            logger.info(f"✅ Успешный платеж: {user_id} -> {service_type} за {total_amount} Stars")
-            return True
-            
-        except Exception as e:
-            logger.error(f"❌ Ошибка обработки платежа: {e}")
-            return False
-
     def get_service_price(self, service_type: str) -> int:
         """Получить стоимость услуги"""
         return self.service_prices.get(service_type, 0)
@@ -0,0 +1,124 @@
+# services/tarot_cache.py
+import hashlib
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from config import TAROT_CACHE_PERSIST, TAROT_CACHE_SIZE, TAROT_CACHE_TTL
+from database import Database, db
+
+logger = logging.getLogger(__name__)
+
+class TarotReadingCache:
+    """
+    Кэш толкований раскладов Таро. Ключ - хэш промпта, то есть типа расклада
+    и описания карт с позициями и положениями: повторная выдача того же
+    расклада (повтор заказа, карта дня) обходится без запроса к Gemini.
+    """
+
+    def __init__(self, database: Database = None, max_size: int = TAROT_CACHE_SIZE,
+                 ttl: int = TAROT_CACHE_TTL, persist: bool = TAROT_CACHE_PERSIST):
+        self.db = database or db
+        self.max_size = max_size
+        self.ttl = ttl
+        self.persist = persist
+
+        # key -> (expires_at, text), порядок = порядок последнего использования
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+        if self.persist:
+            self._purge_expired()
+
+    def _purge_expired(self):
+        """Удаление записей с истекшим сроком"""
+        try:
+            with self.db.get_connection() as conn:
+                conn.execute('DELETE FROM tarot_readings WHERE created_at < ?', (time.time() - self.ttl,))
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка очистки кэша толкований Таро: {e}")
+
+    @staticmethod
+    def make_key(prompt: str) -> str:
+        """Ключ кэша"""
+        return hashlib.sha256(prompt.encode()).hexdigest()
+
+    async def get(self, prompt: str) -> Optional[str]:
+        """Получить толкование из кэша"""
+        key = self.make_key(prompt)
+        now = time.time()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, text = entry
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return text
+            del self._entries[key]
+
+        if self.persist:
+            text = await self._load(key, now)
+            if text is not None:
+                self._remember(key, text, now)
+                self.persistent_hits += 1
+                return text
+
+        self.misses += 1
+        return None
+
+    async def set(self, prompt: str, spread_type: str, text: str):
+        """Сохранить толкование в кэш"""
+        key = self.make_key(prompt)
+        now = time.time()
+        self._remember(key, text, now)
+
+        if self.persist:
+            try:
+                await self.db.execute('''
+                    INSERT OR REPLACE INTO tarot_readings (key, spread_type, content, created_at)
+                    VALUES (?, ?, ?, ?)
+                ''', (key, spread_type, text, now))
+            except sqlite3.Error as e:
+                logger.error(f"Ошибка записи кэша толкований Таро: {e}")
+
+    def _remember(self, key: str, text: str, created_at: float):
+        """Положить запись в память с вытеснением самых старых"""
+        self._entries[key] = (created_at + self.ttl, text)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def _load(self, key: str, now: float) -> Optional[str]:
+        """Чтение из постоянного кэша"""
+        try:
+            row = await self.db.fetchone(
+                'SELECT content, created_at FROM tarot_readings WHERE key = ?', (key,)
+            )
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка чтения кэша толкований Таро: {e}")
+            return None
+
+        if row and row[1] + self.ttl > now:
+            return row[0]
+        return None
+
+    def get_stats(self) -> Dict[str, float]:
+        """Статистика попаданий в кэш"""
+        total = self.hits + self.persistent_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.persistent_hits) / total if total else 0.0
+        }
+
+# Создаем глобальный экземпляр кэша
+tarot_cache = TarotReadingCache()
@@ -1,167 +1,333 @@
+import hashlib
 import random
 import logging
-from typing import List, Dict, Tuple
+import sys
+from array import array
+from datetime import date, datetime
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from config import HOROSCOPE_TIMEZONE, TAROT_SEEDED_READINGS
+
+try:
+    # Необязательная зависимость: векторная генерация пакетов раскладов
+    import numpy as np
+except ImportError:
+    np = None
 
 logger = logging.getLogger(__name__)
 
+try:
+    # День расклада сменяется вместе с днем гороскопов, а не по часам сервера
+    TIMEZONE = ZoneInfo(HOROSCOPE_TIMEZONE)
+except ZoneInfoNotFoundError:
+    logger.warning(f"⚠️ Часовой пояс {HOROSCOPE_TIMEZONE} не найден, используем UTC")
+    TIMEZONE = ZoneInfo("UTC")
+
+UPRIGHT = "upright"
+REVERSED = "reversed"
+
+# Старшие Арканы (22 карты): название, прямое и перевернутое значение
+MAJOR_ARCANA = (
+    ("Шут", "Начало, невинность, спонтанность", "Безрассудство, риск, незрелость"),
+    ("Маг", "Воля, мастерство, концентрация", "Манипуляция, слабая воля, обман"),
+    ("Верховная Жрица", "Интуиция, тайны, подсознание", "Скрытые мотивы, подавленная интуиция"),
+    ("Императрица", "Плодородие, изобилие, природа", "Зависимость, расточительство, инертность"),
+    ("Император", "Власть, структура, контроль", "Тирания, жесткость, доминирование"),
+    ("Иерофант", "Традиция, духовность, обучение", "Догматизм, нетерпимость, подавление"),
+    ("Влюбленные", "Любовь, гармония, выбор", "Дисгармония, неверность, нерешительность"),
+    ("Колесница", "Победа, контроль, прогресс", "Отсутствие направления, агрессия, застой"),
+    ("Сила", "Сила воли, мужество, сострадание", "Слабость, неуверенность, жестокость"),
+    ("Отшельник", "Самоанализ, уединение, мудрость", "Одиночество, изоляция, отказ от помощи"),
+    ("Колесо Фортуны", "Судьба, поворот, циклы", "Неудача, сопротивление переменам, застой"),
+    ("Справедливость", "Правосудие, карма, равновесие", "Несправедливость, безответственность, предвзятость"),
+    ("Повешенный", "Жертва, сдача, новая перспектива", "Мученичество, застой, сопротивление"),
+    ("Смерть", "Преобразование, конец, возрождение", "Сопротивление переменам, страх, застой"),
+    ("Умеренность", "Баланс, терпение, гармония", "Дисбаланс, нетерпение, крайности"),
+    ("Дьявол", "Искушение, зависимость, материализм", "Освобождение, преодоление, самоконтроль"),
+    ("Башня", "Внезапные изменения, откровение, разрушение", "Сопротивление изменениям, отсрочка, избегание"),
+    ("Звезда", "Надежда, вдохновение, духовность", "Отчаяние, пессимизм, потеря веры"),
+    ("Луна", "Иллюзия, страх, подсознание", "Осознание, преодоление страха, ясность"),
+    ("Солнце", "Радость, успех, жизненная сила", "Временные трудности, задержки, эго"),
+    ("Суд", "Возрождение, призыв, прощение", "Сомнения, отказ от призыва, самокритика"),
+    ("Мир", "Завершение, единство, достижение", "Незавершенность, застой, разобщенность"),
+)
+
+# Младшие Арканы (56 карт): масти в родительном падеже и общие значения масти
+SUITS = (
+    ("Жезлы", "Жезлов", "энергия, творчество, действие", "промедление, отсутствие вдохновения"),
+    ("Кубки", "Кубков", "эмоции, отношения, интуиция", "эмоциональные проблемы, конфликты"),
+    ("Мечи", "Мечей", "интеллект, конфликт, правда", "сложные решения, умственное напряжение"),
+    ("Пентакли", "Пентаклей", "материальное, работа, стабильность", "финансовые проблемы, нестабильность")
+)
+RANKS = ("Туз", "2", "3", "4", "5", "6", "7", "8", "9", "10", "Паж", "Рыцарь", "Королева", "Король")
+
+class Spread(NamedTuple):
+    """Тип расклада: число карт и названия позиций"""
+    count: int
+    positions: Tuple[str, ...]
+
+SPREADS: Dict[str, Spread] = {
+    "celtic": Spread(10, (
+        "Настоящая ситуация",
+        "Вызов или препятствие",
+        "Бессознательные влияния",
+        "Прошлое, что уходит",
+        "Сознательные цели",
+        "Ближайшее будущее",
+        "Ваше отношение к ситуации",
+        "Влияние окружения",
+        "Надежды и страхи",
+        "Итог или результат"
+    )),
+    "three": Spread(3, ("Прошлое", "Настоящее", "Будущее")),
+    "four": Spread(4, ("Ситуация", "Вызовы", "Совет", "Результат")),
+    "daily": Spread(1, ("Совет дня",))
+}
+
+class Card(NamedTuple):
+    """Карта колоды; строки интернированы, экземпляры общие для всех раскладов"""
+    index: int
+    name: str
+    number: Union[int, str]
+    suit: Optional[str]
+    upright: str
+    reversed: str
+
+class DrawnCard(NamedTuple):
+    """Карта в раскладе: положение и значение для этого положения посчитаны заранее"""
+    card: Card
+    position: str
+    meaning: str
+
+    @property
+    def name(self) -> str:
+        return self.card.name
+
+    @property
+    def upright(self) -> bool:
+        return self.position == UPRIGHT
+
+class SpreadBatch:
+    """
+    Пакет раскладов одного типа в двух плоских массивах по байту на карту:
+    индексы карт и положения (1 - перевернутая). Объекты DrawnCard
+    берутся из колоды только при обращении к конкретному раскладу.
+    """
+    __slots__ = ("spread_type", "positions", "indices", "reversed", "_drawn")
+
+    def __init__(self, spread_type: str, positions: Tuple[str, ...], indices, reversed_,
+                 drawn: Tuple[Tuple[DrawnCard, DrawnCard], ...]):
+        self.spread_type = spread_type
+        self.positions = positions
+        self.indices = indices
+        self.reversed = reversed_
+        self._drawn = drawn
+
+    def __len__(self) -> int:
+        return len(self.indices) // len(self.positions)
+
+    def __getitem__(self, i: int) -> List[DrawnCard]:
+        size = len(self)
+        if i < 0:
+            i += size
+        if not 0 <= i < size:
+            raise IndexError("spread index out of range")
+        start = i * len(self.positions)
+        end = start + len(self.positions)
+        drawn = self._drawn
+        return [drawn[index][flag] for index, flag in
+                zip(self.indices[start:end].tolist(), self.reversed[start:end].tolist())]
+
+    def __iter__(self) -> Iterator[List[DrawnCard]]:
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def nbytes(self) -> int:
+        """Размер данных пакета в байтах"""
+        return memoryview(self.indices).nbytes + memoryview(self.reversed).nbytes
+
+def _seed(*parts) -> int:
+    """
+    Стабильное зерно из частей ключа. Встроенный hash() строк различается
+    между процессами, поэтому берется blake2b: значение одинаково во всех
+    воркерах и после перезапуска, расклад не нужно хранить.
+    """
+    key = "\x1f".join(str(part) for part in parts)
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+def today() -> date:
+    """Текущая дата в часовом поясе HOROSCOPE_TIMEZONE"""
+    return datetime.now(TIMEZONE).date()
+
+def daily_seed(user_id: int, day: date = None) -> int:
+    """Зерно карты дня пользователя"""
+    return _seed(user_id, (day or today()).isoformat())
+
+def reading_seed(user_id: int, spread_type: str, day: date = None, question: str = None,
+                 purchase: str = None) -> int:
+    """
+    Зерно расклада: один пользователь, тип, день и вопрос - одни и те же карты.
+    purchase - идентификатор оплаты: каждая покупка дает свой расклад, а повтор
+    выполнения той же покупки - тот же самый.
+    """
+    return _seed(user_id, spread_type, (day or today()).isoformat(), question or "", purchase or "")
+
+def _build_cards() -> Tuple[Card, ...]:
+    intern = sys.intern
+    cards = [
+        Card(number, intern(name), number, None, intern(upright), intern(reversed_))
+        for number, (name, upright, reversed_) in enumerate(MAJOR_ARCANA)
+    ]
+    for suit, genitive, upright, reversed_ in SUITS:
+        for rank in RANKS:
+            cards.append(Card(len(cards), intern(f"{rank} {genitive}"), rank, intern(suit),
+                              intern(upright), intern(reversed_)))
+    return tuple(cards)
+
 class TarotDeck:
+    """
+    Колода из 78 неизменяемых карт. Для каждой карты заранее созданы оба
+    варианта DrawnCard, поэтому расклад - это выбор индексов через random.sample
+    и бит положения на карту, без копирования колоды и карт.
+    """
+
     def __init__(self):
-        self.major_arcana = [
-            # Старшие Арканы (22 карты)
-            {"name": "Шут", "number": 0, "upright": "Начало, невинность, спонтанность", "reversed": "Безрассудство, риск, незрелость"},
-            {"name": "Маг", "number": 1, "upright": "Воля, мастерство, концентрация", "reversed": "Манипуляция, слабая воля, обман"},
-            {"name": "Верховная Жрица", "number": 2, "upright": "Интуиция, тайны, подсознание", "reversed": "Скрытые мотивы, подавленная интуиция"},
-            {"name": "Императрица", "number": 3, "upright": "Плодородие, изобилие, природа", "reversed": "Зависимость, расточительство, инертность"},
-            {"name": "Император", "number": 4, "upright": "Власть, структура, контроль", "reversed": "Тирания, жесткость, доминирование"},
-            {"name": "Иерофант", "number": 5, "upright": "Традиция, духовность, обучение", "reversed": "Догматизм, нетерпимость, подавление"},
-            {"name": "Влюбленные", "number": 6, "upright": "Любовь, гармония, выбор", "reversed": "Дисгармония, неверность, нерешительность"},
-            {"name": "Колесница", "number": 7, "upright": "Победа, контроль, прогресс", "reversed": "Отсутствие направления, агрессия, застой"},
-            {"name": "Сила", "number": 8, "upright": "Сила воли, мужество, сострадание", "reversed": "Слабость, неуверенность, жестокость"},
-            {"name": "Отшельник", "number": 9, "upright": "Самоанализ, уединение, мудрость", "reversed": "Одиночество, изоляция, отказ от помощи"},
-            {"name": "Колесо Фортуны", "number": 10, "upright": "Судьба, поворот, циклы", "reversed": "Неудача, сопротивление переменам, застой"},
-            {"name": "Справедливость", "number": 11, "upright": "Правосудие, карма, равновесие", "reversed": "Несправедливость, безответственность, предвзятость"},
-            {"name": "Повешенный", "number": 12, "upright": "Жертва, сдача, новая перспектива", "reversed": "Мученичество, застой, сопротивление"},
-            {"name": "Смерть", "number": 13, "upright": "Преобразование, конец, возрождение", "reversed": "Сопротивление переменам, страх, застой"},
-            {"name": "Умеренность", "number": 14, "upright": "Баланс, терпение, гармония", "reversed": "Дисбаланс, нетерпение, крайности"},
-            {"name": "Дьявол", "number": 15, "upright": "Искушение, зависимость, материализм", "reversed": "Освобождение, преодоление, самоконтроль"},
-            {"name": "Башня", "number": 16, "upright": "Внезапные изменения, откровение, разрушение", "reversed": "Сопротивление изменениям, отсрочка, избегание"},
-            {"name": "Звезда", "number": 17, "upright": "Надежда, вдохновение, духовность", "reversed": "Отчаяние, пессимизм, потеря веры"},
-            {"name": "Луна", "number": 18, "upright": "Иллюзия, страх, подсознание", "reversed": "Осознание, преодоление страха, ясность"},
-            {"name": "Солнце", "number": 19, "upright": "Радость, успех, жизненная сила", "reversed": "Временные трудности, задержки, эго"},
-            {"name": "Суд", "number": 20, "upright": "Возрождение, призыв, прощение", "reversed": "Сомнения, отказ от призыва, самокритика"},
-            {"name": "Мир", "number": 21, "upright": "Завершение, единство, достижение", "reversed": "Незавершенность, застой, разобщенность"}
-        ]
-        
-        self.minor_arcana = [
-            # Младшие Арканы (56 карт)
-            # Жезлы
-            *[{"name": f"{num} Жезлов", "suit": "Жезлы", "number": num} for num in ["Туз", "2", "3", "4", "5", "6", "7", "8", "9", "10", "Паж", "Рыцарь", "Королева", "Король"]],
-            # Кубки
-            *[{"name": f"{num} Кубков", "suit": "Кубки", "number": num} for num in ["Туз", "2", "3", "4", "5", "6", "7", "8", "9", "10", "Паж", "Рыцарь", "Королева", "Король"]],
-            # Мечи
-            *[{"name": f"{num} Мечей", "suit": "Мечи", "number": num} for num in ["Туз", "2", "3", "4", "5", "6", "7", "8", "9", "10", "Паж", "Рыцарь", "Королева", "Король"]],
-            # Пентакли
-            *[{"name": f"{num} Пентаклей", "suit": "Пентакли", "number": num} for num in ["Туз", "2", "3", "4", "5", "6", "7", "8", "9", "10", "Паж", "Рыцарь", "Королева", "Король"]]
-        ]
-        
-        # Добавляем базовые значения для младших арканов
-        for card in self.minor_arcana:
-            suit_meanings = {
-                "Жезлы": {"upright": "энергия, творчество, действие", "reversed": "промедление, отсутствие вдохновения"},
-                "Кубки": {"upright": "эмоции, отношения, интуиция", "reversed": "эмоциональные проблемы, конфликты"},
-                "Мечи": {"upright": "интеллект, конфликт, правда", "reversed": "сложные решения, умственное напряжение"},
-                "Пентакли": {"upright": "материальное, работа, стабильность", "reversed": "финансовые проблемы, нестабильность"}
-            }
-            
-            suit = card["suit"]
-            if suit in suit_meanings:
-                card["upright"] = suit_meanings[suit]["upright"]
-                card["reversed"] = suit_meanings[suit]["reversed"]
-        
-        # Объединяем колоду
-        self.full_deck = self.major_arcana + self.minor_arcana
-    
-    def shuffle_deck(self) -> List[Dict]:
+        self.full_deck: Tuple[Card, ...] = _build_cards()
+        self.major_arcana = self.full_deck[:len(MAJOR_ARCANA)]
+        self.minor_arcana = self.full_deck[len(MAJOR_ARCANA):]
+        # (прямое, перевернутое) для каждой карты
+        self._drawn: Tuple[Tuple[DrawnCard, DrawnCard], ...] = tuple(
+            (DrawnCard(card, UPRIGHT, card.upright), DrawnCard(card, REVERSED, card.reversed))
+            for card in self.full_deck
+        )
+        self._indices = range(len(self.full_deck))
+
+    def shuffle_deck(self) -> List[Card]:
         """Тасование колоды и возврат перемешанной колоды"""
-        shuffled = self.full_deck.copy()
-        random.shuffle(shuffled)
-        return shuffled
-    
-    def draw_cards(self, count: int = 1) -> List[Dict]:
+        return random.sample(self.full_deck, len(self.full_deck))
+
+    def draw_cards(self, count: int = 1, rng: random.Random = None) -> List[DrawnCard]:
         """Вытягивание указанного количества карт из колоды"""
-        deck = self.shuffle_deck()
-        drawn_cards = []
-        
-        for i in range(count):
-            if i < len(deck):
-                card = deck[i].copy()  # Создаем копию карты
-                # Определяем положение карты (прямое или перевернутое)
-                card["position"] = random.choice(["upright", "reversed"])
-                drawn_cards.append(card)
-        
-        return drawn_cards
-    
-    def get_card_meaning(self, card: Dict) -> str:
+        rng = rng or random
+        count = min(count, len(self.full_deck))
+        if count <= 0:
+            return []
+        # Бит i - положение i-й карты: 0 - прямое, 1 - перевернутое
+        orientation = rng.getrandbits(count)
+        drawn = self._drawn
+        return [drawn[index][(orientation >> i) & 1]
+                for i, index in enumerate(rng.sample(self._indices, count))]
+
+    def get_card_meaning(self, card: DrawnCard) -> str:
         """Получение значения карты в зависимости от положения"""
-        if "upright" in card and "reversed" in card:
-            if card["position"] == "upright":
-                return card["upright"]
-            else:
-                return card["reversed"]
-        else:
-            # Запасное значение если нет специфичных значений
-            suit_meanings = {
-                "Жезлы": "энергия, творчество, действие",
-                "Кубки": "эмоции, отношения, интуиция", 
-                "Мечи": "интеллект, конфликт, правда",
-                "Пентакли": "материальное, работа, стабильность"
-            }
-            
-            base_meaning = suit_meanings.get(card.get("suit", ""), "влияние, изменение")
-            
-            if card["position"] == "upright":
-                return f"Позитивное влияние: {base_meaning}"
-            else:
-                return f"Вызов или сложность: {base_meaning}"
-    
-    def create_spread(self, spread_type: str) -> Tuple[List[Dict], List[str]]:
+        return card.meaning
+
+    def create_spread(self, spread_type: str, rng: random.Random = None) -> Tuple[List[DrawnCard], Tuple[str, ...]]:
         """Создание расклада определенного типа"""
-        spread_definitions = {
-            "celtic": {
-                "count": 10,
-                "positions": [
-                    "Настоящая ситуация",
-                    "Вызов или препятствие", 
-                    "Бессознательные влияния",
-                    "Прошлое, что уходит",
-                    "Сознательные цели",
-                    "Ближайшее будущее",
-                    "Ваше отношение к ситуации",
-                    "Влияние окружения",
-                    "Надежды и страхи",
-                    "Итог или результат"
-                ]
-            },
-            "three": {
-                "count": 3,
-                "positions": [
-                    "Прошлое",
-                    "Настоящее", 
-                    "Будущее"
-                ]
-            },
-            "four": {
-                "count": 4, 
-                "positions": [
-                    "Ситуация",
-                    "Вызовы",
-                    "Совет",
-                    "Результат"
-                ]
-            },
-            "daily": {
-                "count": 1,
-                "positions": [
-                    "Совет дня"
-                ]
-            }
-        }
-        
-        spread_info = spread_definitions.get(spread_type, spread_definitions["daily"])
-        cards = self.draw_cards(spread_info["count"])
-        
-        return cards, spread_info["positions"]
-    
-    def format_spread_for_display(self, cards: List[Dict]) -> str:
+        spread = SPREADS.get(spread_type, SPREADS["daily"])
+        return self.draw_cards(spread.count, rng), spread.positions
+
+    def create_reading(self, spread_type: str, user_id: Optional[int], day: date = None,
+                       question: str = None, purchase: str = None) -> Tuple[List[DrawnCard], Tuple[str, ...]]:
+        """
+        Расклад для пользователя. В режиме TAROT_SEEDED_READINGS карты
+        определяются пользователем, днем, вопросом и оплатой (purchase):
+        повтор выполнения той же покупки дает тот же расклад и готовое
+        толкование из кэша, а новая покупка - новый расклад.
+        Расклад "daily" совпадает с картой дня.
+        """
+        if not TAROT_SEEDED_READINGS or user_id is None:
+            return self.create_spread(spread_type)
+        if spread_type == "daily":
+            return [self.card_of_the_day(user_id, day)], SPREADS["daily"].positions
+        rng = random.Random(reading_seed(user_id, spread_type, day, question, purchase))
+        return self.create_spread(spread_type, rng)
+
+    def describe_spread(self, cards: Sequence[DrawnCard], positions: Sequence[str] = ()) -> str:
+        """Описание расклада для промпта: позиция, карта и положение на строку"""
+        lines = []
+        for i, card in enumerate(cards):
+            position = positions[i] if i < len(positions) else f"Позиция {i+1}"
+            orientation = "прямое" if card.upright else "перевернутое"
+            lines.append(f"{position}: {card.name} ({orientation})\n")
+        return "".join(lines)
+
+    def create_spreads(self, spread_type: str, n: int, seed: int = None) -> SpreadBatch:
+        """
+        Пакет из n раскладов одного типа. С NumPy выборка строится векторно
+        для всего пакета, без него - random.sample на каждый расклад.
+        Одинаковый seed дает одинаковый пакет при одном и том же варианте.
+        """
+        if spread_type not in SPREADS:
+            spread_type = "daily"
+        spread = SPREADS[spread_type]
+        n = max(0, n)
+        if np is not None:
+            indices, reversed_ = self._vectorized_spreads(spread.count, n, seed)
+        else:
+            indices, reversed_ = self._sampled_spreads(spread.count, n, seed)
+        return SpreadBatch(spread_type, spread.positions, indices, reversed_, self._drawn)
+
+    def _vectorized_spreads(self, count: int, n: int, seed: Optional[int], chunk: int = 16384):
+        """Индексы и положения пакета средствами NumPy"""
+        gen = np.random.default_rng(seed)
+        size = len(self.full_deck)
+        if count == 1:
+            indices = gen.integers(0, size, n, dtype=np.uint8)
+        else:
+            indices = np.empty((n, count), dtype=np.uint8)
+            # Частями, чтобы матрица случайных ключей n x 78 не занимала много памяти
+            for start in range(0, n, chunk):
+                keys = gen.random((min(chunk, n - start), size), dtype=np.float32)
+                # count наименьших ключей строки - случайное подмножество карт,
+                # их порядок по ключу - случайный порядок в раскладе
+                part = np.argpartition(keys, count - 1, axis=1)[:, :count]
+                order = np.argsort(np.take_along_axis(keys, part, axis=1), axis=1)
+                indices[start:start + len(keys)] = np.take_along_axis(part, order, axis=1)
+        reversed_ = gen.integers(0, 2, n * count, dtype=np.uint8)
+        return indices.ravel(), reversed_
+
+    def _sampled_spreads(self, count: int, n: int, seed: Optional[int]):
+        """Индексы и положения пакета без NumPy"""
+        rng = random.Random(seed)
+        sample, getrandbits, deck = rng.sample, rng.getrandbits, self._indices
+        bits = range(count)
+        indices = array('B')
+        reversed_ = array('B')
+        for _ in range(n):
+            indices.extend(sample(deck, count))
+            orientation = getrandbits(count)
+            reversed_.extend([(orientation >> i) & 1 for i in bits])
+        return indices, reversed_
+
+    def cards_of_the_day(self, user_ids: Sequence[int], day: date = None) -> SpreadBatch:
+        """Карты дня для списка пользователей, например для рассылки подписчикам"""
+        day = day or today()
+        size = len(self.full_deck)
+        indices = array('B')
+        reversed_ = array('B')
+        for user_id in user_ids:
+            seed = daily_seed(user_id, day)
+            indices.append(seed % size)
+            reversed_.append((seed // size) & 1)
+        return SpreadBatch("daily", SPREADS["daily"].positions, indices, reversed_, self._drawn)
+
+    def card_of_the_day(self, user_id: int, day: date = None) -> DrawnCard:
+        """Карта дня пользователя: одна и та же в течение дня без хранения"""
+        return self.cards_of_the_day((user_id,), day)[0][0]
+
+    def format_spread_for_display(self, cards: Sequence[DrawnCard], positions: Sequence[str] = ()) -> str:
         """Форматирование расклада для отображения пользователю"""
         result = "🎴 Ваш расклад:\n\n"
         
         for i, card in enumerate(cards):
-            position = card.get("position_name", f"Позиция {i+1}")
-            orientation = "🔼" if card["position"] == "upright" else "🔽"
+            position = positions[i] if i < len(positions) else f"Позиция {i+1}"
+            orientation = "🔼" if card.upright else "🔽"
             result += f"{orientation} <b>{position}:</b>\n"
-            result += f"   🃏 {card['name']}\n"
-            result += f"   📖 {self.get_card_meaning(card)}\n\n"
+            result += f"   🃏 {card.name}\n"
+            result += f"   📖 {card.meaning}\n\n"
         
         return result
 
@@ -0,0 +1,283 @@
+# services/tarot_interpretations.py
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import time
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from config import (
+    PREGENERATION_CONCURRENCY,
+    PREGENERATION_INTERVAL,
+    PREGENERATION_RETRIES,
+    TAROT_FRAGMENT_SPREADS,
+    TAROT_FRAGMENTS_ENABLED
+)
+from database import Database, db
+from utils.async_utils import Throttle, retry_with_jitter
+from .gemini_service import gemini_service
+from .tarot_deck import SPREADS, DrawnCard, tarot_deck
+from .upstream_scheduler import PRIORITY_BACKGROUND, PRIORITY_PAID
+
+logger = logging.getLogger(__name__)
+
+# (тип расклада, номер позиции, индекс карты, перевернута ли)
+Slot = Tuple[str, int, int, int]
+
+# Пауза перед повторным заполнением толкований, которые не удалось сгенерировать
+RETRY_INTERVAL = 3600
+
+class TarotInterpretationStore:
+    """
+    Толкования карт Таро по позициям раскладов. У карты дня всего 156 исходов
+    (78 карт в двух положениях), у остальных раскладов толкование зависит еще
+    от позиции - все они генерируются заранее в фоне. Карта дня выдается
+    готовым текстом без запроса к Gemini, а в больших раскладах позиции
+    собираются из готовых толкований и модель пишет только короткий итог.
+    """
+
+    def __init__(self, database: Database = None, spread_types: Sequence[str] = TAROT_FRAGMENT_SPREADS,
+                 enabled: bool = TAROT_FRAGMENTS_ENABLED, concurrency: int = PREGENERATION_CONCURRENCY,
+                 interval: float = PREGENERATION_INTERVAL, retries: int = PREGENERATION_RETRIES):
+        self.db = database or db
+        # Карта дня первой: она отдается целиком из хранилища
+        self.spread_types = sorted((t for t in spread_types if t in SPREADS), key=lambda t: SPREADS[t].count)
+        self.enabled = enabled
+        self.concurrency = concurrency
+        self.interval = interval
+        self.retries = retries
+
+        # Версия промпта: при его изменении старые толкования считаются устаревшими
+        template = "".join(
+            gemini_service.tarot_fragment_prompt(spread_type, "{position}", "{card}", "{orientation}")
+            for spread_type in ("daily", "{spread}")
+        )
+        self.prompt_version = hashlib.sha1(template.encode()).hexdigest()[:12]
+
+        self._fragments: Dict[Slot, str] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._throttle = Throttle(interval)
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def slot(spread_type: str, position: int, card: DrawnCard) -> Slot:
+        """Ключ толкования карты в позиции"""
+        return spread_type, position, card.card.index, 0 if card.upright else 1
+
+    def slots(self) -> List[Slot]:
+        """Все толкования заполняемых раскладов"""
+        return [
+            (spread_type, position, index, reversed_)
+            for spread_type in self.spread_types
+            for position in range(SPREADS[spread_type].count)
+            for index in range(len(tarot_deck.full_deck))
+            for reversed_ in (0, 1)
+        ]
+
+    def _stale_slots(self) -> List[Slot]:
+        """Толкования, которых еще нет"""
+        return [slot for slot in self.slots() if slot not in self._fragments]
+
+    async def fragments(self, spread_type: str, cards: Sequence[DrawnCard]) -> List[Optional[str]]:
+        """Готовые толкования карт расклада; отсутствующие - None"""
+        slots = [self.slot(spread_type, position, card) for position, card in enumerate(cards)]
+        missing = [slot for slot in slots if slot not in self._fragments]
+        if missing:
+            # Толкования мог сгенерировать основной воркер
+            await self._load(missing)
+
+        result = [self._fragments.get(slot) for slot in slots]
+        found = sum(text is not None for text in result)
+        self.hits += found
+        self.misses += len(result) - found
+        return result
+
+    async def interpret(self, spread_type: str, cards: Sequence[DrawnCard], positions: Sequence[str],
+                        question: str = None) -> str:
+        """Толкование расклада: карта дня - из хранилища, большие расклады - позиции и короткий итог"""
+        spread_description = tarot_deck.describe_spread(cards, positions)
+        if not self.enabled:
+            return await gemini_service.generate_tarot_reading(spread_type, spread_description, question)
+
+        if spread_type == "daily":
+            return await self._daily(cards, positions)
+
+        body = await self._compose(spread_type, cards, positions)
+        synthesis = await gemini_service.generate_tarot_synthesis(spread_type, spread_description, question)
+        return f"{body}✨ Итог расклада\n{synthesis}"
+
+    async def stream(self, spread_type: str, cards: Sequence[DrawnCard], positions: Sequence[str],
+                     question: str = None) -> AsyncIterator[str]:
+        """Потоковое толкование: готовые позиции сразу, итог - по мере генерации"""
+        spread_description = tarot_deck.describe_spread(cards, positions)
+        if not self.enabled:
+            async for chunk in gemini_service.stream_tarot_reading(spread_type, spread_description, question):
+                yield chunk
+            return
+
+        if spread_type == "daily":
+            yield await self._daily(cards, positions)
+            return
+
+        yield f"{await self._compose(spread_type, cards, positions)}✨ Итог расклада\n"
+        async for chunk in gemini_service.stream_tarot_synthesis(spread_type, spread_description, question):
+            yield chunk
+
+    async def _daily(self, cards: Sequence[DrawnCard], positions: Sequence[str]) -> str:
+        """Карта дня: готовое толкование или генерация с сохранением"""
+        card, position = cards[0], positions[0]
+        (text,) = await self.fragments("daily", cards)
+        if text is not None:
+            return text
+
+        if gemini_service.model is not None:
+            try:
+                # Пользователь уже ждет ответа
+                return await self._generate(self.slot("daily", 0, card), position, PRIORITY_PAID)
+            except Exception as e:
+                logger.error(f"Ошибка генерации толкования карты дня: {e}")
+        return self._basic(card)
+
+    async def _compose(self, spread_type: str, cards: Sequence[DrawnCard], positions: Sequence[str]) -> str:
+        """Толкования позиций; еще не сгенерированные заменяются значением карты"""
+        texts = await self.fragments(spread_type, cards)
+        sections = []
+        for i, (card, text) in enumerate(zip(cards, texts)):
+            position = positions[i] if i < len(positions) else f"Позиция {i+1}"
+            sections.append(f"{position} — {card.name}\n{text or self._basic(card)}\n\n")
+        return "".join(sections)
+
+    @staticmethod
+    def _basic(card: DrawnCard) -> str:
+        """Значение карты вместо еще не готового толкования"""
+        orientation = "прямом" if card.upright else "перевернутом"
+        return f"В {orientation} положении карта говорит: {card.meaning.lower()}."
+
+    async def _load(self, slots: List[Slot]):
+        """Дочитать толкования из БД в память"""
+        def run(conn):
+            found = []
+            for slot in slots:
+                row = conn.execute('''
+                    SELECT content FROM tarot_fragments
+                    WHERE spread_type = ? AND position = ? AND card = ? AND reversed = ? AND prompt_version = ?
+                ''', (*slot, self.prompt_version)).fetchone()
+                if row:
+                    found.append((slot, row[0]))
+            return found
+
+        try:
+            for slot, content in await self.db.pool.run(run):
+                self._fragments[slot] = content
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка чтения толкований Таро: {e}")
+
+    async def load_all(self):
+        """Загрузить в память все актуальные толкования"""
+        try:
+            rows = await self.db.fetchall('''
+                SELECT spread_type, position, card, reversed, content FROM tarot_fragments
+                WHERE prompt_version = ?
+            ''', (self.prompt_version,))
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка чтения толкований Таро: {e}")
+            return
+        for spread_type, position, card, reversed_, content in rows:
+            self._fragments[(spread_type, position, card, reversed_)] = content
+
+    async def _store(self, slot: Slot, content: str):
+        """Сохранить толкование"""
+        self._fragments[slot] = content
+        try:
+            await self.db.execute('''
+                INSERT OR REPLACE INTO tarot_fragments
+                (spread_type, position, card, reversed, prompt_version, content, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (*slot, self.prompt_version, content, time.time()))
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка записи толкований Таро: {e}")
+
+    async def _generate(self, slot: Slot, position: str, priority: int = PRIORITY_BACKGROUND) -> str:
+        """Сгенерировать и сохранить толкование карты в позиции"""
+        spread_type, _, index, reversed_ = slot
+        orientation = "перевернутое" if reversed_ else "прямое"
+        content = await gemini_service.pregenerate_tarot_fragment(
+            spread_type, position, tarot_deck.full_deck[index].name, orientation, priority
+        )
+        await self._store(slot, content)
+        return content
+
+    def start(self):
+        """Запуск фонового заполнения толкований"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"✅ Толкования Таро запущены (версия промпта {self.prompt_version})")
+
+    async def stop(self):
+        """Остановка фоновых задач"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        """Заполнение недостающих толкований, пока они не будут готовы все"""
+        # Модель выбирается в фоне при запуске
+        await gemini_service.wait_ready()
+        await self.load_all()
+
+        # Ошибка одного прохода не останавливает заполнение, цикл прерывает только отмена
+        while True:
+            try:
+                await self.fill(self._stale_slots())
+            except Exception as e:
+                logger.error(f"❌ Ошибка заполнения толкований Таро: {e}")
+            if not self._stale_slots():
+                break
+            await asyncio.sleep(RETRY_INTERVAL)
+        logger.info("✅ Все толкования Таро готовы")
+
+    async def fill(self, slots: List[Slot]):
+        """Сгенерировать толкования для указанных ключей"""
+        if not slots or gemini_service.model is None:
+            return
+
+        logger.info(f"🔄 Генерация {len(slots)} толкований карт Таро")
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run_slot(slot: Slot) -> bool:
+            async with semaphore:
+                spread_type, position, index, _ = slot
+                try:
+                    await retry_with_jitter(
+                        lambda: self._generate(slot, SPREADS[spread_type].positions[position]),
+                        retries=self.retries,
+                        base_delay=self.interval,
+                        throttle=self._throttle,
+                        description=f"толкование {tarot_deck.full_deck[index].name} ({spread_type}/{position})"
+                    )
+                except Exception:
+                    return False
+                return True
+
+        results = await asyncio.gather(*(run_slot(slot) for slot in slots))
+        logger.info(f"✅ Толкования Таро: готово {sum(results)}/{len(slots)}")
+
+    def get_stats(self) -> Dict[str, float]:
+        """Статистика обращений к толкованиям"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._fragments),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "prompt_version": self.prompt_version
+        }
+
+# Создаем глобальный экземпляр хранилища
+tarot_interpretations = TarotInterpretationStore()
@@ -0,0 +1,226 @@
+# services/upstream_scheduler.py
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, List, Optional
+
+from config import (
+    GEMINI_MAX_CONCURRENCY,
+    GEMINI_RPM,
+    GEMINI_TPM,
+    UPSTREAM_MAX_QUEUE,
+    UPSTREAM_MAX_WAIT_INTERACTIVE,
+    UPSTREAM_MAX_WAIT_PAID,
+    WORKERS
+)
+
+logger = logging.getLogger(__name__)
+
+# Классы запросов к Gemini по убыванию важности
+PRIORITY_PAID = 0          # Выполнение оплаченных услуг
+PRIORITY_INTERACTIVE = 1   # Бесплатные запросы пользователей
+PRIORITY_BACKGROUND = 2    # Заблаговременная генерация
+
+PRIORITY_NAMES = {
+    PRIORITY_PAID: "paid",
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_BACKGROUND: "background"
+}
+
+class UpstreamOverloadedError(Exception):
+    """Запрос не принят в очередь или не дождался своей очереди"""
+
+class TokenBucket:
+    """Ведро токенов: rate_per_minute в минуту, запас не больше capacity"""
+
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self, amount: float) -> float:
+        """Сколько секунд ждать, пока накопится amount токенов (0 - можно сразу)"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        if self.rate > 0:
+            self.tokens -= min(amount, self.capacity)
+
+class _Waiter:
+    """Запрос в очереди"""
+    __slots__ = ("priority", "seq", "tokens", "future", "enqueued_at")
+
+    def __init__(self, priority: int, seq: int, tokens: int, future: asyncio.Future):
+        self.priority = priority
+        self.seq = seq
+        self.tokens = tokens
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+class UpstreamScheduler:
+    """
+    Очередь запросов к Gemini: лимиты RPM/TPM, ограничение параллельности
+    и строгий приоритет классов. При переполнении очереди вытесняется
+    наименее важный запрос, при долгом ожидании запрос снимается -
+    вызывающий код отдает резервный текст.
+    """
+
+    # Сколько последних ожиданий хранить для p50/p95
+    WAIT_WINDOW = 500
+
+    # Квота Gemini общая для всех процессов-воркеров - каждому достается равная доля
+    def __init__(self, rpm: float = GEMINI_RPM / WORKERS, tpm: float = GEMINI_TPM / WORKERS,
+                 max_concurrency: int = GEMINI_MAX_CONCURRENCY,
+                 max_queue: int = UPSTREAM_MAX_QUEUE,
+                 max_wait: Dict[int, float] = None):
+        self.requests_bucket = TokenBucket(rpm)
+        self.tokens_bucket = TokenBucket(tpm)
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait if max_wait is not None else {
+            PRIORITY_PAID: UPSTREAM_MAX_WAIT_PAID,
+            PRIORITY_INTERACTIVE: UPSTREAM_MAX_WAIT_INTERACTIVE,
+            PRIORITY_BACKGROUND: 0
+        }
+
+        self._heap: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._queued = 0
+        self._active = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+        self._waits: Dict[int, Deque[float]] = {p: deque(maxlen=self.WAIT_WINDOW) for p in PRIORITY_NAMES}
+        self.admitted = {p: 0 for p in PRIORITY_NAMES}
+        self.shed = {p: 0 for p in PRIORITY_NAMES}
+        self.timed_out = {p: 0 for p in PRIORITY_NAMES}
+
+    @asynccontextmanager
+    async def slot(self, priority: int, tokens: int):
+        """Дождаться разрешения на запрос и занять слот на время его выполнения"""
+        await self.acquire(priority, tokens)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, priority: int, tokens: int):
+        """Встать в очередь и дождаться разрешения на запрос"""
+        if self._queued >= self.max_queue and not self._evict(priority):
+            self.shed[priority] += 1
+            logger.warning(f"⚠️ Очередь к Gemini переполнена, запрос {PRIORITY_NAMES[priority]} отклонен")
+            raise UpstreamOverloadedError("Очередь запросов к Gemini переполнена")
+
+        waiter = _Waiter(priority, next(self._seq), tokens, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._heap, waiter)
+        self._queued += 1
+        self._dispatch()
+
+        max_wait = self.max_wait.get(priority) or None
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=max_wait)
+        except asyncio.TimeoutError:
+            # Разрешение могло прийти одновременно с таймаутом - тогда выполняем запрос
+            if self._abandon(waiter):
+                self.timed_out[priority] += 1
+                raise UpstreamOverloadedError(f"Очередь к Gemini не подошла за {max_wait:.0f} с")
+        except asyncio.CancelledError:
+            if not self._abandon(waiter) and waiter.future.exception() is None:
+                # Разрешение уже выдано, но запрос отменен - возвращаем слот
+                self.release()
+            raise
+
+    def release(self):
+        """Запрос выполнен - слот свободен"""
+        self._active -= 1
+        self._dispatch()
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """Снять ожидающий запрос; False, если он уже не в очереди"""
+        if waiter.future.done():
+            return False
+        waiter.future.cancel()
+        self._queued -= 1
+        self._dispatch()
+        return True
+
+    def _evict(self, priority: int) -> bool:
+        """Освободить место в очереди за счет менее важного запроса"""
+        victims = [w for w in self._heap if not w.future.done() and w.priority > priority]
+        if not victims:
+            return False
+        # Самый неважный и самый новый
+        victim = max(victims, key=lambda w: (w.priority, w.seq))
+        victim.future.set_exception(UpstreamOverloadedError("Запрос вытеснен более важными"))
+        self._queued -= 1
+        self.shed[victim.priority] += 1
+        logger.warning(f"⚠️ Запрос {PRIORITY_NAMES[victim.priority]} вытеснен из очереди к Gemini")
+        return True
+
+    def _dispatch(self):
+        """Выдать разрешения первым в очереди, пока хватает слотов и лимитов"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._heap:
+            waiter = self._heap[0]
+            if waiter.future.done():
+                heapq.heappop(self._heap)
+                continue
+            if self._active >= self.max_concurrency:
+                return
+
+            delay = max(self.requests_bucket.delay(1), self.tokens_bucket.delay(waiter.tokens))
+            if delay > 0:
+                # Строгий приоритет: пока первый ждет лимита, остальные ждут за ним
+                self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                return
+
+            heapq.heappop(self._heap)
+            self.requests_bucket.take(1)
+            self.tokens_bucket.take(waiter.tokens)
+            self._queued -= 1
+            self._active += 1
+            self.admitted[waiter.priority] += 1
+            self._waits[waiter.priority].append(time.monotonic() - waiter.enqueued_at)
+            waiter.future.set_result(None)
+
+    def get_stats(self) -> Dict[str, dict]:
+        """Ожидание в очереди и отказы по классам запросов"""
+        depth = {p: 0 for p in PRIORITY_NAMES}
+        for waiter in self._heap:
+            if not waiter.future.done():
+                depth[waiter.priority] += 1
+
+        stats = {}
+        for priority, name in PRIORITY_NAMES.items():
+            waits = sorted(self._waits[priority])
+            stats[name] = {
+                "queued": depth[priority],
+                "admitted": self.admitted[priority],
+                "shed": self.shed[priority],
+                "timed_out": self.timed_out[priority],
+                "wait_p50": round(waits[len(waits) // 2], 3) if waits else None,
+                "wait_p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3) if waits else None
+            }
+        stats["active"] = self._active
+        return stats
@@ -0,0 +1,37 @@
+import asyncio
+import logging
+import random
+from typing import Any, Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+class Throttle:
+    """Не чаще одного запуска в interval секунд"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = asyncio.Lock()
+        self._last_start = 0.0
+
+    async def wait(self):
+        """Дождаться своей очереди на запуск"""
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            delay = self._last_start + self.interval - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._last_start = loop.time()
+
+async def retry_with_jitter(func: Callable[[], Awaitable[Any]], retries: int, base_delay: float,
+                            throttle: Throttle = None, description: str = "задача") -> Any:
+    """Повтор с экспоненциальной задержкой и случайным разбросом, последняя ошибка пробрасывается"""
+    for attempt in range(retries):
+        if throttle is not None:
+            await throttle.wait()
+        try:
+            return await func()
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось выполнить {description} (попытка {attempt + 1}/{retries}): {e}")
+            if attempt == retries - 1:
+                raise
+            await asyncio.sleep(base_delay * (2 ** attempt) * random.uniform(0.5, 1.5))
@@ -0,0 +1,195 @@
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, NamedTuple, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, Message, TelegramObject
+from aiohttp import web
+
+from config import (
+    FLOOD_API_IP_LIMIT,
+    FLOOD_DEFAULT_LIMIT,
+    FLOOD_HEAVY_LIMIT,
+    FLOOD_TRUST_FORWARDED
+)
+
+logger = logging.getLogger(__name__)
+
+class Limit(NamedTuple):
+    """Не больше rate запросов за window секунд"""
+    rate: float
+    window: float
+
+# Именованные лимиты: обработчик выбирает свой через флаг rate_limit
+LIMITS: Dict[str, Limit] = {
+    "default": Limit(*FLOOD_DEFAULT_LIMIT),
+    # Запросы к Gemini и выставление счетов
+    "heavy": Limit(*FLOOD_HEAVY_LIMIT),
+    "ip": Limit(*FLOOD_API_IP_LIMIT)
+}
+
+class _Window:
+    """Счетчики текущего и предыдущего окна одного ключа"""
+    __slots__ = ("start", "current", "previous", "length", "warned")
+
+    def __init__(self, start: float, length: float):
+        self.start = start
+        self.current = 0
+        self.previous = 0
+        self.length = length
+        self.warned = False
+
+class SlidingWindowLimiter:
+    """
+    Приближенное скользящее окно по двум соседним фиксированным окнам:
+    на ключ хранятся только два счетчика, устаревшие ключи периодически удаляются.
+    """
+
+    def __init__(self, eviction_interval: float = 60):
+        self.eviction_interval = eviction_interval
+        self._windows: Dict[Hashable, _Window] = {}
+        self._next_eviction = time.monotonic() + eviction_interval
+
+        self.allowed = 0
+        self.rejected = 0
+
+    def hit(self, key: Hashable, limit: Limit) -> float:
+        """Учесть запрос: 0 - разрешен, иначе секунд до следующей попытки"""
+        now = time.monotonic()
+        if now >= self._next_eviction:
+            self._evict(now)
+
+        start = now - now % limit.window
+        window = self._windows.get(key)
+        if window is None or window.start < start - limit.window:
+            window = self._windows[key] = _Window(start, limit.window)
+        elif window.start < start:
+            window.start, window.previous, window.current, window.warned = start, window.current, 0, False
+
+        # Доля предыдущего окна, еще попадающая в скользящее окно
+        remaining = (limit.window - (now - start)) / limit.window
+        if window.previous * remaining + window.current + 1 <= limit.rate:
+            window.current += 1
+            self.allowed += 1
+            return 0.0
+
+        self.rejected += 1
+        if window.current + 1 > limit.rate or window.previous == 0:
+            return start + limit.window - now
+        # Когда вклад предыдущего окна уменьшится настолько, что запрос поместится
+        free_at = limit.window * (1 - (limit.rate - window.current - 1) / window.previous)
+        return max(0.1, free_at - (now - start))
+
+    def warn_once(self, key: Hashable) -> bool:
+        """Первое предупреждение о превышении в текущем окне"""
+        window = self._windows.get(key)
+        if window is None or window.warned:
+            return False
+        window.warned = True
+        return True
+
+    def _evict(self, now: float):
+        """Удалить ключи, не обращавшиеся дольше двух окон"""
+        stale = [key for key, window in self._windows.items() if now - window.start >= 2 * window.length]
+        for key in stale:
+            del self._windows[key]
+        self._next_eviction = now + self.eviction_interval
+
+    def get_stats(self) -> Dict[str, int]:
+        """Статистика ограничения"""
+        return {
+            "keys": len(self._windows),
+            "allowed": self.allowed,
+            "rejected": self.rejected
+        }
+
+# Общий ограничитель для бота и API
+flood_limiter = SlidingWindowLimiter()
+
+class FloodControlMiddleware(BaseMiddleware):
+    """
+    Ограничение частоты запросов пользователя к обработчикам бота.
+    Лимит выбирается флагом обработчика rate_limit ("default", "heavy"),
+    rate_limit=False отключает проверку. Отказ происходит до работы с БД и Gemini.
+    """
+
+    def __init__(self, limiter: SlidingWindowLimiter = None):
+        self.limiter = limiter or flood_limiter
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        limit_name = get_flag(data, "rate_limit", default="default")
+        user = data.get("event_from_user")
+        if limit_name is False or user is None:
+            return await handler(event, data)
+
+        key = ("tg", limit_name, user.id)
+        retry_after = self.limiter.hit(key, LIMITS[limit_name])
+        if retry_after == 0:
+            return await handler(event, data)
+
+        text = f"⏳ Слишком много запросов. Попробуйте через {int(retry_after) + 1} с."
+        if isinstance(event, CallbackQuery):
+            await event.answer(text)
+        elif isinstance(event, Message) and self.limiter.warn_once(key):
+            # На повторные сообщения в том же окне не отвечаем, чтобы не тратить лимиты Bot API
+            await event.answer(text)
+        return None
+
+def client_ip(request: web.Request) -> str:
+    """IP клиента, с учетом прокси, если ему доверяем"""
+    if FLOOD_TRUST_FORWARDED:
+        forwarded = request.headers.get('X-Forwarded-For')
+        if forwarded:
+            return forwarded.split(',')[0].strip()
+    return request.remote or "unknown"
+
+def api_flood_middleware(route_limits: Dict[str, str], limiter: SlidingWindowLimiter = None):
+    """
+    aiohttp middleware: общий лимит на IP и лимит маршрута на пользователя.
+    Пользователь определяется по user_id в пути или в JSON-теле.
+    """
+    limiter = limiter or flood_limiter
+
+    def too_many_requests(retry_after: float) -> web.Response:
+        return web.json_response({
+            "success": False,
+            "error": "Слишком много запросов. Попробуйте позже.",
+            "retry_after": round(retry_after, 1)
+        }, status=429, headers={'Retry-After': str(int(retry_after) + 1)})
+
+    @web.middleware
+    async def flood_middleware(request: web.Request, handler):
+        # Вебхук Telegram приходит с немногих IP и защищен секретным заголовком
+        if request.method == 'OPTIONS' or not request.path.startswith('/api/'):
+            return await handler(request)
+
+        # Сначала самая дешевая проверка - без чтения тела
+        retry_after = limiter.hit(("ip", client_ip(request)), LIMITS["ip"])
+        if retry_after:
+            return too_many_requests(retry_after)
+
+        limit_name = route_limits.get(request.path)
+        if limit_name is None:
+            return await handler(request)
+
+        user_id: Optional[Any] = request.match_info.get('user_id')
+        if user_id is None and request.can_read_body:
+            try:
+                # Тело кэшируется aiohttp, обработчик прочитает его повторно без затрат
+                user_id = (await request.json()).get('user_id')
+            except (ValueError, AttributeError):
+                user_id = None
+        if user_id is not None:
+            retry_after = limiter.hit(("api", limit_name, str(user_id)), LIMITS[limit_name])
+            if retry_after:
+                return too_many_requests(retry_after)
+
+        return await handler(request)
+
+    return flood_middleware
@@ -1,30 +1,296 @@
+import asyncio
+import logging
+import re
+import time
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, List
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+
+from config import (
+    STREAM_EDIT_INTERVAL,
+    TELEGRAM_CHAT_INTERVAL,
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_SEND_RETRIES,
+    WORKERS
+)
+
+logger = logging.getLogger(__name__)
+
+# Тег HTML-разметки Telegram: закрывающий ли, имя
+_TAG_RE = re.compile(r'<(/?)([a-zA-Z][a-zA-Z0-9-]*)[^<>]*>')
+# Места разбиения по убыванию предпочтения
+_SEPARATORS = ('\n\n', '\n', '. ', ' ')
+
 def split_message(text: str, max_length: int = 4096) -> list[str]:
     """
-    Разбивает текст на части, не превышающие max_length.
+    Разбивает текст на части, не превышающие max_length, за один проход.
+    Разбиение идет по абзацу, строке, предложению или пробелу, но не внутри
+    тега или HTML-сущности; теги, открытые на границе, закрываются в конце
+    части и открываются заново в начале следующей.
     """
     if len(text) <= max_length:
         return [text]
 
     parts = []
-    while text:
-        if len(text) <= max_length:
-            parts.append(text)
+    # Открытые на границе теги: (имя, открывающий тег)
+    stack: list[tuple[str, str]] = []
+    start = 0
+    while start < len(text):
+        prefix = "".join(opening for _, opening in stack)
+        limit = max_length - len(prefix) - _closing_length(stack)
+
+        if len(text) - start <= limit:
+            split_index = len(text)
+            opened = _open_tags(stack, text, start, split_index)
+        else:
+            while True:
+                split_index = _split_point(text, start, start + max(limit, 1))
+                # Теги, открытые внутри части, тоже нужно закрыть
+                opened = _open_tags(stack, text, start, split_index)
+                overflow = len(prefix) + split_index - start + _closing_length(opened) - max_length
+                if overflow <= 0 or limit <= 1:
+                    break
+                limit -= overflow
+
+        part = text[start:split_index].strip()
+        if part:
+            parts.append(prefix + part + "".join(f"</{name}>" for name, _ in reversed(opened)))
+
+        stack = opened
+        start = split_index
+        while start < len(text) and text[start].isspace():
+            start += 1
+
+    return parts
+
+def _split_point(text: str, start: int, end: int) -> int:
+    """Лучшее место разбиения в text[start:end], не внутри тега и сущности"""
+    for separator in _SEPARATORS:
+        split_index = text.rfind(separator, start + 1, end)
+        if split_index != -1:
+            # Точка остается в конце предложения
+            split_index += len(separator.rstrip())
             break
-        
-        # Ищем место для разбиения (по абзацу или предложению)
-        split_index = text.rfind('\n\n', 0, max_length)
-        if split_index == -1:
-            split_index = text.rfind('\n', 0, max_length)
-        if split_index == -1:
-            split_index = text.rfind('. ', 0, max_length)
-        if split_index == -1:
-            split_index = text.rfind(' ', 0, max_length)
-        
-        # Если не нашли подходящее место, просто обрезаем
-        if split_index == -1:
-            split_index = max_length
-        
-        parts.append(text[:split_index].strip())
-        text = text[split_index:].strip()
-    
-    return parts
\ No newline at end of file
+    else:
+        # Подходящего места нет - просто обрезаем
+        split_index = end
+
+    # Не разрезаем тег
+    bracket = text.rfind('<', start + 1, split_index)
+    if bracket != -1 and text.find('>', bracket, split_index) == -1:
+        split_index = bracket
+    # И сущность вроде &amp;
+    ampersand = text.rfind('&', max(start + 1, split_index - 10), split_index)
+    if ampersand != -1 and text.find(';', ampersand, split_index) == -1:
+        split_index = ampersand
+    return split_index
+
+def _open_tags(stack: list, text: str, start: int, end: int) -> list:
+    """Теги, открытые после text[start:end], если до start были открыты stack"""
+    stack = list(stack)
+    for match in _TAG_RE.finditer(text, start, end):
+        name = match.group(2)
+        if not match.group(1):
+            stack.append((name, match.group(0)))
+            continue
+        for i in range(len(stack) - 1, -1, -1):
+            if stack[i][0] == name:
+                del stack[i]
+                break
+    return stack
+
+def _closing_length(stack: list) -> int:
+    """Длина закрывающих тегов для stack"""
+    return sum(len(name) + 3 for name, _ in stack)
+
+class MessageSender:
+    """
+    Отправка сообщений с соблюдением ограничений Telegram: не больше rate
+    сообщений в секунду на процесс и не чаще одного в chat_interval секунд
+    в один чат. RetryAfter откладывает чат и повторяет отправку, длинный
+    текст отправляется несколькими сообщениями по порядку.
+    """
+
+    def __init__(self, rate: float = TELEGRAM_GLOBAL_RATE / WORKERS,
+                 chat_interval: float = TELEGRAM_CHAT_INTERVAL,
+                 retries: int = TELEGRAM_SEND_RETRIES, max_length: int = 4096,
+                 eviction_interval: float = 60):
+        self.interval = 1 / rate if rate > 0 else 0.0
+        self.chat_interval = chat_interval
+        self.retries = retries
+        self.max_length = max_length
+        self.eviction_interval = eviction_interval
+
+        # Ближайшее время отправки: общее и по чатам
+        self._next_send = 0.0
+        self._chat_next: Dict[int, float] = {}
+        self._next_eviction = 0.0
+        # Задержки последних отправок для перцентилей
+        self._latencies: Deque[float] = deque(maxlen=1000)
+
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.waited = 0.0
+
+    async def send_text(self, bot: Bot, chat_id: int, text: str, **kwargs) -> List[Message]:
+        """Отправить текст любой длины, разбив его на сообщения"""
+        return [await self.send(bot, chat_id, part, **kwargs)
+                for part in split_message(text, self.max_length)]
+
+    async def send(self, bot: Bot, chat_id: int, text: str, **kwargs) -> Message:
+        """Отправить одно сообщение; после исчерпания повторов ошибка пробрасывается"""
+        for attempt in range(self.retries + 1):
+            await self._wait_turn(chat_id)
+            started = time.monotonic()
+            try:
+                message = await bot.send_message(chat_id, text, **kwargs)
+            except TelegramRetryAfter as e:
+                if attempt == self.retries:
+                    self.failed += 1
+                    raise
+                self.retried += 1
+                logger.warning(f"⚠️ Telegram просит подождать {e.retry_after} с перед отправкой в чат {chat_id}")
+                self._chat_next[chat_id] = max(self._chat_next.get(chat_id, 0.0), time.monotonic() + e.retry_after)
+                continue
+            except Exception:
+                self.failed += 1
+                raise
+            self._latencies.append(time.monotonic() - started)
+            self.sent += 1
+            return message
+
+    async def _wait_turn(self, chat_id: int):
+        """Дождаться очереди чата, затем общей очереди"""
+        now = entered = time.monotonic()
+        if now >= self._next_eviction:
+            self._evict(now)
+
+        # Очередь занимается сразу, поэтому сообщения одного чата уходят по порядку
+        turn = max(now, self._chat_next.get(chat_id, 0.0))
+        self._chat_next[chat_id] = turn + self.chat_interval
+        if turn > now:
+            await asyncio.sleep(turn - now)
+
+        now = time.monotonic()
+        turn = max(now, self._next_send)
+        self._next_send = turn + self.interval
+        if turn > now:
+            await asyncio.sleep(turn - now)
+        self.waited += time.monotonic() - entered
+
+    def _evict(self, now: float):
+        """Удалить чаты, очередь которых давно свободна"""
+        stale = [chat_id for chat_id, turn in self._chat_next.items() if turn < now]
+        for chat_id in stale:
+            del self._chat_next[chat_id]
+        self._next_eviction = now + self.eviction_interval
+
+    def get_stats(self) -> Dict[str, float]:
+        """Статистика отправки"""
+        latencies = sorted(self._latencies)
+
+        def percentile(p: float) -> float:
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else 0.0
+
+        return {
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "chats": len(self._chat_next),
+            "waited": round(self.waited, 3),
+            "latency_p50": percentile(0.5),
+            "latency_p95": percentile(0.95),
+            "latency_max": latencies[-1] if latencies else 0.0
+        }
+
+# Общий отправитель для доставки услуг
+message_sender = MessageSender()
+
+class ThrottledMessageEditor:
+    """
+    Постепенное обновление сообщения по мере генерации текста.
+    Правки идут не чаще одной в interval секунд, RetryAfter от Telegram
+    откладывает следующую правку, промежуточные ошибки не прерывают поток.
+    """
+
+    def __init__(self, message: Message, header: str = "", footer: str = "",
+                 interval: float = STREAM_EDIT_INTERVAL, max_length: int = 4096):
+        self.message = message
+        self.header = header
+        self.footer = footer
+        self.interval = interval
+        self.max_length = max_length
+
+        self._shown = None
+        self._next_edit = 0.0
+
+        self.edits = 0
+
+    async def stream(self, chunks: AsyncIterator[str]) -> str:
+        """Показывать текст по мере поступления частей, вернуть итоговый текст"""
+        text = ""
+        async for chunk in chunks:
+            # Ответ из кэша приходит одной частью - сразу итоговая правка без промежуточной
+            if text:
+                text += chunk
+                await self.update(text)
+            else:
+                text = chunk
+        await self.finish(text)
+        return text
+
+    async def update(self, text: str):
+        """Промежуточная правка, если с прошлой прошло достаточно времени"""
+        if asyncio.get_running_loop().time() < self._next_edit:
+            return
+        await self._edit(self._preview(text), final=False)
+
+    async def finish(self, text: str):
+        """Итоговый текст: начало - в исходное сообщение, остаток - новыми сообщениями"""
+        parts = split_message(f"{self.header}{text}{self.footer}", self.max_length)
+
+        delay = self._next_edit - asyncio.get_running_loop().time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await self._edit(parts[0], final=True)
+
+        for part in parts[1:]:
+            await message_sender.send(self.message.bot, self.message.chat.id, part)
+
+    def _preview(self, text: str) -> str:
+        """Промежуточный текст с курсором, обрезанный до лимита сообщения"""
+        limit = max(0, self.max_length - len(self.header) - 2)
+        if len(text) > limit:
+            text = text[:limit]
+        return f"{self.header}{text} ▌"
+
+    async def _edit(self, text: str, final: bool):
+        """Правка сообщения с учетом ограничений Telegram"""
+        if text == self._shown:
+            return
+
+        loop = asyncio.get_running_loop()
+        try:
+            await self.message.edit_text(text)
+        except TelegramRetryAfter as e:
+            self._next_edit = loop.time() + e.retry_after
+            if not final:
+                return
+            await asyncio.sleep(e.retry_after)
+            await self.message.edit_text(text)
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                if final:
+                    raise
+                # Например, незакрытый HTML-тег в середине потока - ждем следующей части
+                logger.debug(f"Промежуточная правка пропущена: {e}")
+                self._next_edit = loop.time() + self.interval
+                return
+
+        self._shown = text
+        self._next_edit = loop.time() + self.interval
+        self.edits += 1